@@ -1,19 +1,29 @@
 import os
+import sys
 import tkinter as tk
 from tkinter import ttk
 
+from cycle_table import CycleTable
+from cycle_query import CycleQuery
+from cycle_annotate import annotate
+from st_timing import MACHINES, BUDGETS, to_nops
+
 class OpcodeApp(tk.Tk):
     def __init__(self, filename):
         super().__init__()
         self.title("68000 Opcode Cycle Counts")
         self.geometry("1600x840")
 
+        # Tabs for the table browser and the ST timing calculator
+        notebook = ttk.Notebook(self)
+        notebook.pack(fill=tk.BOTH, expand=True)
+
         # Frame for filter and table
-        frame = ttk.Frame(self)
-        frame.pack(fill=tk.BOTH, expand=True)
+        frame = ttk.Frame(notebook)
+        notebook.add(frame, text="Cycle Table")
 
         # Filter Entry
-        filter_label = ttk.Label(frame, text="Filter by Opcode or cycle count:")
+        filter_label = ttk.Label(frame, text="Filter by opcode or cycle count (also <=12, 8-16, /regex/, ea:(A)+, size:l, ~add for cheapest forms):")
         filter_label.pack(side=tk.TOP, anchor="w")
         self.filter_entry = ttk.Entry(frame)
         self.filter_entry.pack(side=tk.TOP, fill=tk.X)
@@ -40,76 +50,118 @@ class OpcodeApp(tk.Tk):
 
         # Parse the file
         self.opcode_data = self.parse_file(filename)
-        self.original_data = self.opcode_data.copy()
-        self.display_data(self.opcode_data)
+        self.query = CycleQuery(self.cycle_table)
+        self.display_data(self.query.order)
+
+        self.create_timing_tab(notebook)
+
+    def create_timing_tab(self, notebook):
+        """Tab for costing a pasted instruction sequence with ST bus rounding."""
+        frame = ttk.Frame(notebook)
+        notebook.add(frame, text="ST Timing")
+
+        controls = ttk.Frame(frame)
+        controls.pack(side=tk.TOP, fill=tk.X)
+        ttk.Label(controls, text="Machine:").pack(side=tk.LEFT)
+        self.machine_var = tk.StringVar(value="ST")
+        ttk.Combobox(controls, textvariable=self.machine_var, values=list(MACHINES), width=8, state="readonly").pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Budget:").pack(side=tk.LEFT)
+        self.budget_var = tk.StringVar(value="Scanline")
+        ttk.Combobox(controls, textvariable=self.budget_var, values=list(BUDGETS), width=12, state="readonly").pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls, text="Calculate", command=self.calculate_timing).pack(side=tk.LEFT, padx=5)
+        self.timing_summary = ttk.Label(controls, text="Paste 68000 code on the left and press Calculate")
+        self.timing_summary.pack(side=tk.LEFT, padx=10)
+
+        panes = ttk.PanedWindow(frame, orient=tk.HORIZONTAL)
+        panes.pack(fill=tk.BOTH, expand=True)
+        self.source_text = tk.Text(panes, font=("Courier New", 12), width=50, undo=True)
+        panes.add(self.source_text, weight=1)
+
+        self.timing_tree = ttk.Treeview(panes, columns=["Line", "Instruction", "Cycles", "NOPs"], show="headings")
+        for col, anchor in (("Line", tk.E), ("Instruction", tk.W), ("Cycles", tk.CENTER), ("NOPs", tk.CENTER)):
+            self.timing_tree.heading(col, text=col)
+            self.timing_tree.column(col, anchor=anchor, width=300 if col == "Instruction" else 80)
+        panes.add(self.timing_tree, weight=1)
+
+    def calculate_timing(self):
+        # Pasted snippets are often unindented, so only "label:" starts a label here
+        lines = [line if line[:1].isspace() or ":" in line.split(";")[0] else "\t" + line
+                 for line in self.source_text.get("1.0", tk.END).splitlines()]
+        parsed, _, _ = annotate(lines, self.cycle_table, self.machine_var.get())
+
+        for item in self.timing_tree.get_children():
+            self.timing_tree.delete(item)
+
+        total = 0
+        unknown = 0
+        for line in parsed:
+            if line.unknown:
+                unknown += 1
+                self.timing_tree.insert("", "end", values=[line.number, line.instruction, "?", "?"])
+            elif line.timing is not None:
+                # Budgets are checked against the worst case of any branch
+                cycles = line.cost[1]
+                total += cycles
+                self.timing_tree.insert("", "end", values=[line.number, line.instruction, cycles, f"{to_nops(cycles):g}"])
+
+        budget = BUDGETS[self.budget_var.get()]
+        remaining = budget - total
+        status = "fits" if remaining >= 0 else "OVER BUDGET"
+        summary = (f"Total: {total} cycles = {to_nops(total):g} nops, "
+                   f"{self.budget_var.get()} {status} by {abs(to_nops(remaining)):g} nops")
+        if unknown:
+            summary += f" ({unknown} unknown)"
+        self.timing_summary.config(text=summary)
 
     def parse_file(self, filename):
-        with open(filename, "r") as f:
-            lines = f.readlines()
-
-        # Find the position of the ":" to determine where the opcode column ends
-        header = lines[0]
-        colon_index = header.index(":") if ":" in header else len(header)  # Safe fallback if no ":"
-
-        # Parse the rest of the header to find addressing modes (ignore the colon itself)
-        columns = []
-        prev_char = ' '
-        start_idx = colon_index + 1  # Start after the colon for the rest of the columns
-        for i, char in enumerate(header[start_idx:], start=start_idx):
-            if prev_char == ' ' and char != ' ':
-                start_idx = i
-            elif prev_char != ' ' and char == ' ':
-                columns.append((header[start_idx:i].strip(), start_idx, i))
-            prev_char = char
-
-        columns.append((header[start_idx:].strip(), start_idx, len(header)))  # Add last column
-        self.tree.config(columns=["Opcode"] + [c[0] for c in columns])
+        # The compiled index is cached, so this only parses the text when it has changed
+        self.cycle_table = CycleTable.load(filename)
+        columns = self.cycle_table.columns
+
+        self.tree.config(columns=["Opcode"] + columns)
         self.tree.heading("Opcode", text="Opcode")
         self.tree.column("Opcode", anchor=tk.W)  # Left-align the opcode column
         for col in columns:
-            self.tree.heading(col[0], text=col[0])
-            self.tree.column(col[0], anchor=tk.CENTER)  # Center-align addressing mode columns
+            self.tree.heading(col, text=col)
+            self.tree.column(col, anchor=tk.CENTER)  # Center-align addressing mode columns
 
+        # One row of strings per table row, in table order so row numbers match the query index
         opcode_data = []
-        # Process each row of data
-        for line in lines[1:]:
-            opcode = line[:colon_index].strip()  # Extract the opcode name up to the ":"
-            # distinct_opcodes = opcode.split('/')  # Split distinct opcodes
-            distinct_opcodes = [opcode]
-
-            for distinct_opcode in distinct_opcodes:  # Handle distinct opcodes correctly
-                row = [distinct_opcode.strip()]
-                for _, start, end in columns:
-                    row.append(line[start:end].strip())  # Extract cycle counts
-                opcode_data.append(row)
-
-        # Sort the data by opcode
-        opcode_data.sort(key=lambda x: x[0])
+        for row in self.cycle_table.rows:
+            opcode_data.append([row.template] + ["" if cycles is None else str(cycles) for cycles in row.cycles])
 
         return opcode_data
 
-    def display_data(self, data):
-        # Clear previous data
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Insert new data
-        for row in data:
-            self.tree.insert("", "end", values=row)
+    def display_data(self, row_ids):
+        """
+        Show the given table rows, in order. Items are inserted once and then
+        detached or moved, so each filter change only touches rows that differ.
+        """
+        wanted = [str(row_id) for row_id in row_ids]
+        for iid in wanted:
+            if not self.tree.exists(iid):
+                self.tree.insert("", "end", iid=iid, values=self.opcode_data[int(iid)])
+
+        visible = list(self.tree.get_children())
+        if visible == wanted:
+            return
+
+        wanted_set = set(wanted)
+        removed = [iid for iid in visible if iid not in wanted_set]
+        if removed:
+            self.tree.detach(*removed)
+            visible = [iid for iid in visible if iid in wanted_set]
+
+        for index, iid in enumerate(wanted):
+            if index < len(visible) and visible[index] == iid:
+                continue
+            self.tree.move(iid, "", index)
+            if iid in visible:
+                visible.remove(iid)
+            visible.insert(index, iid)
 
     def filter_data(self, event=None):
-        filter_text = self.filter_entry.get().strip().lower()
-        if filter_text == "":
-            self.display_data(self.original_data)
-        else:
-            # if the filter is a number, check if any column except the first exactly matches the number
-            # if the filter is not a number, check if the filter is in the opcode name
-            if filter_text.isdigit():
-                filtered_data = [row for row in self.original_data if any(filter_text == col for col in row[1:])]
-            else:
-                filtered_data = [row for row in self.original_data if filter_text in row[0].lower()]
-            
-            self.display_data(filtered_data)
+        self.display_data(self.query.search(self.filter_entry.get()))
 
     def adjust_column_widths(self, event=None):
         """Dynamically adjust column widths based on window size."""
@@ -125,6 +177,7 @@ class OpcodeApp(tk.Tk):
 
 # Usage
 if __name__ == "__main__":
-    path = os.path.join(os.path.dirname(__file__), "68000 Cycle Count.txt")
+    # Another table, such as one written by cycle_generate.py, can be given on the command line
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "68000 Cycle Count.txt")
     app = OpcodeApp(path)
     app.mainloop()
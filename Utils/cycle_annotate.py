@@ -0,0 +1,336 @@
+"""
+Annotate 68000 assembler source with cycle counts from "68000 Cycle Count.txt".
+
+Every instruction line is matched against the cycle table and prefixed with its
+cost. Totals are reported for each labelled block and for each loop body (a
+label that a later branch jumps back to). Budgets can be given so the script
+fails in CI when raster code grows past its timing.
+
+Usage:
+    python cycle_annotate.py demo.s
+    python cycle_annotate.py demo.s --totals --budget .scanline=512 --strict
+    python cycle_annotate.py demo.s --machine ST --budget .scanline=128n
+"""
+import argparse
+import json
+import re
+import sys
+
+from cycle_table import CycleTable, parse_instruction, canonical_mnemonic
+from st_timing import MACHINES, NOP_CYCLES, TimingModel
+
+# Assembler directives, which cost nothing at run time
+DIRECTIVES = {
+    'dc', 'ds', 'dcb', 'even', 'odd', 'cnop', 'align', 'section', 'text', 'data', 'bss',
+    'include', 'incbin', 'incdir', 'opt', 'org', 'xdef', 'xref', 'globl', 'end', 'equ',
+    'set', '=', 'equr', 'reg', 'macro', 'endm', 'rept', 'endr', 'if', 'ifd', 'ifnd',
+    'ifeq', 'ifne', 'ifgt', 'ifge', 'iflt', 'ifle', 'ifc', 'ifnc', 'else', 'endc',
+    'endif', 'output', 'comment', 'list', 'nolist', 'rsreset', 'rs', 'rsset', 'fail',
+}
+
+BRANCHES = {'bra', 'bcc', 'dbcc', 'jmp'}
+
+_LABEL = re.compile(r'^(?:([A-Za-z_.@][\w.@$]*):?|\s+([A-Za-z_.@][\w.@$]*):)')
+
+
+class SourceLine:
+    """One line of source with the cost of its instruction, if any."""
+
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+        self.label = None
+        # The enclosing global label, which scopes local .labels
+        self.scope = None
+        self.instruction = None
+        self.mnemonic = None
+        self.operands = []
+        self.timing = None
+        self.repeat = 1
+        self.unknown = False
+
+    @property
+    def cost(self):
+        """(best, worst) cycles for this line, including any REPT multiplier."""
+        if self.timing is None:
+            return 0, 0
+        cycles = self.timing.cycles
+        not_taken = self.timing.not_taken
+        if not_taken is None:
+            return cycles * self.repeat, cycles * self.repeat
+        return min(cycles, not_taken) * self.repeat, max(cycles, not_taken) * self.repeat
+
+
+def strip_comment(line):
+    """Remove ; comments and whole-line * comments, respecting quoted strings."""
+    if line.lstrip().startswith('*'):
+        return ''
+    quote = None
+    for i, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == ';':
+            return line[:i]
+    return line
+
+
+def is_local(label):
+    return label.startswith('.') or label.startswith('@')
+
+
+def label_key(label, scope):
+    """Local labels are only unique within their enclosing global label."""
+    return (scope, label) if is_local(label) else (None, label)
+
+
+def parse_source(lines, table):
+    """Parse assembler source lines and cost each instruction against the table."""
+    parsed = []
+    repeats = []
+    scope = None
+    for number, text in enumerate(lines, start=1):
+        line = SourceLine(number, text.rstrip('\n'))
+        parsed.append(line)
+        body = strip_comment(line.text)
+        if not body.strip():
+            line.scope = scope
+            continue
+
+        m = _LABEL.match(body)
+        if m:
+            line.label = m.group(1) or m.group(2)
+            body = body[m.end():]
+        fields = body.split(None, 2)
+        if fields and fields[0].lower() in ('equ', 'set', '=', 'equr', 'reg', 'rs', 'macro'):
+            # Symbol definitions are not code labels
+            line.label = None
+        if line.label and not is_local(line.label):
+            scope = line.label
+        line.scope = scope
+        if not fields:
+            continue
+        # Anything after the operand field is a comment
+        line.instruction = ' '.join(fields[:2])
+        mnemonic, size, operands = parse_instruction(line.instruction)
+        line.mnemonic = mnemonic
+        line.operands = operands
+
+        if mnemonic == 'rept':
+            try:
+                repeats.append(int(operands[0].lstrip('$'), 16 if operands[0].startswith('$') else 10))
+            except (IndexError, ValueError):
+                repeats.append(1)
+            continue
+        if mnemonic == 'endr':
+            if repeats:
+                repeats.pop()
+            continue
+        if mnemonic in DIRECTIVES:
+            continue
+
+        line.repeat = 1
+        for count in repeats:
+            line.repeat *= count
+        line.timing = table.lookup(line.instruction)
+        line.unknown = line.timing is None
+    return parsed
+
+
+def _sum_costs(lines):
+    best = worst = 0
+    for line in lines:
+        b, w = line.cost
+        best += b
+        worst += w
+    return best, worst
+
+
+def find_blocks(lines):
+    """
+    Split the source into blocks that each start at a label.
+    A global label's block runs on through its local labels, each of which
+    also gets a block of its own.
+    """
+    blocks = []
+    current_global = None
+    current_local = None
+    for line in lines:
+        if line.label:
+            block = {'name': line.label, 'start': line.number, 'lines': []}
+            blocks.append(block)
+            if is_local(line.label):
+                current_local = block
+            else:
+                current_global = block
+                current_local = None
+        for block in (current_global, current_local):
+            if block is not None:
+                block['lines'].append(line)
+    results = []
+    for block in blocks:
+        best, worst = _sum_costs(block['lines'])
+        results.append({
+            'name': block['name'],
+            'start': block['start'],
+            'end': block['lines'][-1].number,
+            'best': best,
+            'worst': worst,
+        })
+    return results
+
+
+def find_loops(lines):
+    """Find loop bodies: ranges from a label to a later branch back to it."""
+    label_lines = {label_key(line.label, line.scope): i for i, line in enumerate(lines) if line.label}
+    loops = []
+    for i, line in enumerate(lines):
+        if line.timing is None or not line.operands:
+            continue
+        if canonical_mnemonic(line.mnemonic) not in BRANCHES:
+            continue
+        target = line.operands[-1]
+        start = label_lines.get(label_key(target, line.scope))
+        if start is None or start > i:
+            continue
+        body = lines[start:i]
+        best, worst = _sum_costs(body)
+        # The back branch is taken on every iteration but the last
+        taken = line.timing.cycles * line.repeat
+        loops.append({
+            'name': target,
+            'start': lines[start].number,
+            'end': line.number,
+            'best': best + taken,
+            'worst': worst + taken,
+            'exit': line.timing.not_taken,
+        })
+    return loops
+
+
+def format_cost(line):
+    if line.unknown:
+        return '?'
+    if line.timing is None:
+        return ''
+    if line.timing.not_taken is not None:
+        text = f'{line.timing.cycles}/{line.timing.not_taken}'
+    else:
+        text = str(line.timing.cycles)
+    if line.timing.data_dependent:
+        text += '+'
+    if line.repeat != 1:
+        text += f' x{line.repeat}'
+    return text
+
+
+def format_range(best, worst):
+    return str(best) if best == worst else f'{best}-{worst}'
+
+
+def apply_machine(lines, model):
+    """Replace raw table timings with the machine's bus-rounded timings."""
+    code = [line for line in lines if line.timing is not None or line.unknown]
+    adjusted = model.adjust([(line.instruction, line.timing) for line in code])
+    for line, timing in zip(code, adjusted):
+        line.timing = timing
+
+
+def annotate(lines, table=None, machine='ST'):
+    """Parse and analyse source lines, returning (lines, blocks, loops)."""
+    if table is None:
+        table = CycleTable.load()
+    parsed = parse_source(lines, table)
+    apply_machine(parsed, TimingModel(machine, table))
+    return parsed, find_blocks(parsed), find_loops(parsed)
+
+
+def check_budgets(budgets, blocks, loops):
+    """Return messages for every block or loop whose worst case exceeds its budget."""
+    failures = []
+    named = {}
+    for block in blocks:
+        named.setdefault(block['name'], block)
+    for loop in loops:
+        # Loop budgets are per iteration, and take priority over the block
+        named[loop['name']] = loop
+    for name, limit in budgets.items():
+        item = named.get(name)
+        if item is None:
+            failures.append(f"{name}: no such label")
+        elif item['worst'] > limit:
+            failures.append(f"{name}: {item['worst']} cycles exceeds budget of {limit}")
+    return failures
+
+
+def parse_budget(text):
+    """Parse LABEL=CYCLES, or LABEL=NOPSn for a budget given in NOPs."""
+    name, _, value = text.partition('=')
+    try:
+        if value.lower().endswith('n'):
+            return name, int(value[:-1]) * NOP_CYCLES
+        return name, int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Budget must be LABEL=CYCLES or LABEL=NOPSn, got '{text}'")
+
+
+def format_total(best, worst):
+    cycles = format_range(best, worst)
+    nops = format_range(best // NOP_CYCLES, -(-worst // NOP_CYCLES))
+    return f"{cycles:>12} cycles {nops:>10} nops"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate 68000 source with cycle counts.")
+    parser.add_argument('source', help="Assembler source file")
+    parser.add_argument('--table', default=None, help="Cycle table file (defaults to 68000 Cycle Count.txt)")
+    parser.add_argument('--totals', action='store_true', help="Only print block and loop totals")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--machine', choices=list(MACHINES), default='ST',
+                        help="Bus timing model applied to the table figures (default ST)")
+    parser.add_argument('--budget', action='append', type=parse_budget, default=[],
+                        help="Fail if LABEL's worst case exceeds CYCLES, or NOPs with an n suffix (repeatable)")
+    parser.add_argument('--strict', action='store_true', help="Fail if any instruction is not in the table")
+    args = parser.parse_args(argv)
+
+    table = CycleTable.load(args.table) if args.table else CycleTable.load()
+    with open(args.source, 'r', errors='replace') as f:
+        parsed, blocks, loops = annotate(f.readlines(), table, args.machine)
+
+    unknown = [line for line in parsed if line.unknown]
+    failures = check_budgets(dict(args.budget), blocks, loops)
+    if args.strict:
+        failures += [f"line {line.number}: unknown instruction '{line.instruction}'" for line in unknown]
+
+    if args.json:
+        json.dump({
+            'blocks': blocks,
+            'loops': loops,
+            'unknown': [{'line': line.number, 'instruction': line.instruction} for line in unknown],
+            'failures': failures,
+        }, sys.stdout, indent=4)
+        print()
+    else:
+        if not args.totals:
+            for line in parsed:
+                print(f"{format_cost(line):>10} | {line.text}")
+            print()
+        print("Blocks:")
+        for block in blocks:
+            print(f"  {block['name']:<24} lines {block['start']:>5}-{block['end']:<5} {format_total(block['best'], block['worst'])}")
+        if loops:
+            print("Loops (per iteration):")
+            for loop in loops:
+                print(f"  {loop['name']:<24} lines {loop['start']:>5}-{loop['end']:<5} {format_total(loop['best'], loop['worst'])}")
+        if unknown:
+            print(f"{len(unknown)} instruction(s) not found in the cycle table")
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,448 @@
+"""
+Generate a full 68000 timing table from the effective address and instruction
+formulas of the M68000 User's Manual (section 8), instead of measuring it.
+
+The output is a text table in the same layout as "68000 Cycle Count.txt", so
+CycleTable, the annotator and the table browser can all use it. Data-dependent
+instructions (MULU/MULS, DIVU/DIVS, shifts by a register, dynamic bit numbers,
+Scc) get extra rows qualified with "best" and "average"; the plain row is the
+worst case.
+
+Figures are raw 68000 cycles for --machine 68000. For the ST and STE each part
+of an instruction (the operation and each effective address calculation) is
+rounded up to the 4 cycle bus slot, which is how the measured table behaves.
+
+Usage:
+    python cycle_generate.py > generated.txt
+    python cycle_generate.py --machine 68000 --write "68000 Raw Cycle Count.txt"
+    python cycle_generate.py --check
+"""
+import argparse
+import random
+import sys
+
+from cycle_table import CycleTable, EAMode, DEFAULT_TABLE, EA_COLUMNS, SHIFT_MNEMONICS, parse_instruction
+from st_timing import MACHINES, TimingModel
+
+DN, AN, IND, POSTINC, PREDEC, DISP, INDEX, ABS_W, ABS_L, PC_DISP, PC_INDEX, IMM = list(EAMode)[:12]
+
+ALL_MODES = [DN, AN, IND, POSTINC, PREDEC, DISP, INDEX, ABS_W, ABS_L, PC_DISP, PC_INDEX, IMM]
+DATA_MODES = [mode for mode in ALL_MODES if mode != AN]
+MEMORY_ALTERABLE = [IND, POSTINC, PREDEC, DISP, INDEX, ABS_W, ABS_L]
+DATA_ALTERABLE = [DN] + MEMORY_ALTERABLE
+CONTROL_MODES = [IND, DISP, INDEX, ABS_W, ABS_L, PC_DISP, PC_INDEX]
+
+# Effective address calculation time, (byte/word, long), table 8-1
+EA_TIMES = {
+    DN: (0, 0), AN: (0, 0), IND: (4, 8), POSTINC: (4, 8), PREDEC: (6, 10),
+    DISP: (8, 12), INDEX: (10, 14), ABS_W: (8, 12), ABS_L: (12, 16),
+    PC_DISP: (8, 12), PC_INDEX: (10, 14), IMM: (4, 8),
+}
+
+# Destination write time for MOVE, (byte/word, long), from tables 8-2 and 8-3
+MOVE_DEST_TIMES = {
+    DN: (0, 0), AN: (0, 0), IND: (4, 8), POSTINC: (4, 8), PREDEC: (4, 8),
+    DISP: (8, 12), INDEX: (10, 14), ABS_W: (8, 12), ABS_L: (12, 16),
+}
+
+# The destination operand written into each MOVE template
+MOVE_DESTS = {
+    DN: 'd0', AN: 'a1', IND: '(a1)', POSTINC: '(a1)+', PREDEC: '-(a1)',
+    DISP: '24(a1)', INDEX: '20(a1,d0.w)', ABS_W: '$200.w', ABS_L: '$20000',
+}
+
+# Total times for the control addressing instructions, table 8-10
+CONTROL_TIMES = {
+    'lea': {IND: 4, DISP: 8, INDEX: 12, ABS_W: 8, ABS_L: 12, PC_DISP: 8, PC_INDEX: 12},
+    'pea': {IND: 12, DISP: 16, INDEX: 20, ABS_W: 16, ABS_L: 20, PC_DISP: 16, PC_INDEX: 20},
+    'jmp': {IND: 8, DISP: 10, INDEX: 14, ABS_W: 10, ABS_L: 12, PC_DISP: 10, PC_INDEX: 14},
+    'jsr': {IND: 16, DISP: 18, INDEX: 22, ABS_W: 18, ABS_L: 20, PC_DISP: 18, PC_INDEX: 22},
+}
+
+# MOVEM base times before the per-register cost, table 8-10
+MOVEM_TO_REGISTERS = {IND: 12, POSTINC: 12, DISP: 16, INDEX: 18, ABS_W: 16, ABS_L: 20, PC_DISP: 16, PC_INDEX: 18}
+MOVEM_TO_MEMORY = {IND: 8, PREDEC: 8, DISP: 12, INDEX: 14, ABS_W: 12, ABS_L: 16}
+MOVEM_REGISTERS = 4
+
+# Operands substituted for "*" when checking a table row by row
+SAMPLE_OPERANDS = {
+    DN: 'd2', AN: 'a2', IND: '(a2)', POSTINC: '(a2)+', PREDEC: '-(a2)', DISP: '8(a2)',
+    INDEX: '8(a2,d3.w)', ABS_W: '$400.w', ABS_L: '$40000', PC_DISP: 'label(pc)',
+    PC_INDEX: 'label(pc,d3.w)', IMM: '#1',
+}
+
+# Operand samples used to estimate the average DIVU/DIVS time
+DIVIDE_SAMPLES = 20000
+
+
+def ea_time(mode, size):
+    return EA_TIMES[mode][1 if size == 'l' else 0]
+
+
+def divu_cycles(dividend, divisor):
+    """
+    Exact DIVU time, excluding the EA, following Jorge Cwik's analysis of the
+    microcode. Overflow exits early. The maximum is 136, not the manual's 140.
+    """
+    if (dividend >> 16) >= divisor:
+        return 10
+    mcycles = 38
+    hdivisor = divisor << 16
+    for _ in range(15):
+        negative = dividend & 0x80000000
+        dividend = (dividend << 1) & 0xffffffff
+        if negative:
+            dividend = (dividend - hdivisor) & 0xffffffff
+        else:
+            mcycles += 2
+            if dividend >= hdivisor:
+                dividend -= hdivisor
+                mcycles -= 1
+    return mcycles * 2
+
+
+def divs_cycles(dividend, divisor):
+    """Exact DIVS time, excluding the EA. The maximum is 156, not the manual's 158."""
+    mcycles = 7 if dividend < 0 else 6
+    if (abs(dividend) >> 16) >= abs(divisor):
+        return (mcycles + 2) * 2
+    quotient = abs(dividend) // abs(divisor)
+    mcycles += 55
+    if divisor >= 0:
+        mcycles += 1 if dividend < 0 else -1
+    for _ in range(15):
+        if not quotient & 0x8000:
+            mcycles += 1
+        quotient <<= 1
+    return mcycles * 2
+
+
+def divide_average(signed, samples=DIVIDE_SAMPLES):
+    """Mean time over random operands that do not overflow, seeded so the table is stable."""
+    rng = random.Random(68000)
+    total = 0
+    for _ in range(samples):
+        if signed:
+            divisor = rng.choice((-1, 1)) * rng.randint(1, 0x7fff)
+            dividend = rng.choice((-1, 1)) * rng.randrange(abs(divisor) << 16)
+            total += divs_cycles(dividend, divisor)
+        else:
+            divisor = rng.randint(1, 0xffff)
+            total += divu_cycles(rng.randrange(divisor << 16), divisor)
+    return round(total / samples)
+
+
+class TableBuilder:
+    """Collects rows of cost components, one list of components per column."""
+
+    def __init__(self):
+        self.rows = []
+        self.flow_rows = []
+
+    def add(self, template, modes, cost):
+        """Add a row; cost(mode) returns the list of cycle components, or None."""
+        cells = {}
+        for mode in modes:
+            components = cost(mode)
+            if components is not None:
+                cells[mode] = components
+        self.rows.append((template, cells))
+
+    def fixed(self, template, cycles):
+        self.rows.append((template, {DN: [cycles]}))
+
+    def flow(self, template, *cycles):
+        self.flow_rows.append((template, {mode: [value] for mode, value in zip(ALL_MODES, cycles)}))
+
+    def render(self, machine='ST'):
+        """Format the table text. Each component is rounded to the machine's bus granularity."""
+        granularity = MACHINES[machine]
+
+        def total(components):
+            return sum(-(-c // granularity) * granularity for c in components)
+
+        width = max(20, max(len(template) for template, _ in self.rows + self.flow_rows) + 1)
+        header = f"{'Name':<{width}}:" + f"{EA_COLUMNS[0]:>3}" + "".join(f"{name:>5}" for name in EA_COLUMNS[1:])
+
+        def format_row(template, cells):
+            values = [str(total(cells[mode])) if mode in cells else '' for mode in ALL_MODES]
+            return (f"{template:<{width}}" + f"{values[0]:>4}" + "".join(f"{v:>5}" for v in values[1:])).rstrip()
+
+        lines = [header]
+        lines += [format_row(template, cells) for template, cells in self.rows]
+        lines.append('')
+        lines += [format_row(template, cells) for template, cells in self.flow_rows]
+        return "\n".join(lines) + "\n"
+
+
+def _add_standard(builder, size):
+    long = size == 'l'
+    for op in ('add', 'and', 'cmp', 'eor', 'or', 'sub'):
+        # The immediate forms come first, so "add.l #1,d0" is costed as ADDI
+        if op in ('and', 'cmp'):
+            register = 14 if long else 8
+        else:
+            register = 16 if long else 8
+        memory = (12 if long else 8) if op == 'cmp' else (20 if long else 12)
+        builder.add(f"{op}.{size} #1,*", DATA_ALTERABLE,
+                    lambda m, r=register, b=memory: [r] if m == DN else [b, ea_time(m, size)])
+
+        if op != 'eor':
+            def to_register(m, op=op):
+                if not long:
+                    return [4, ea_time(m, size)]
+                # Long operations need 2 more cycles for register and immediate sources
+                base = 6 if op == 'cmp' or m not in (DN, AN, IMM) else 8
+                return [base, ea_time(m, size)]
+            builder.add(f"{op}.{size} *,d0", ALL_MODES if op in ('add', 'cmp', 'sub') else DATA_MODES, to_register)
+
+        if op == 'eor':
+            builder.add(f"eor.{size} d0,*", DATA_ALTERABLE,
+                        lambda m: [8 if long else 4] if m == DN else [12 if long else 8, ea_time(m, size)])
+        elif op != 'cmp':
+            builder.add(f"{op}.{size} d0,*", MEMORY_ALTERABLE, lambda m: [12 if long else 8, ea_time(m, size)])
+
+        if op in ('add', 'cmp', 'sub'):
+            def to_address(m, op=op):
+                if op == 'cmp' or long:
+                    base = 8 if op != 'cmp' and m in (DN, AN, IMM) else 6
+                else:
+                    base = 8
+                return [base, ea_time(m, size)]
+            builder.add(f"{op}a.{size} *,a1", ALL_MODES, to_address)
+
+    for op in ('addq', 'subq'):
+        def quick(m):
+            if m == DN:
+                return [8 if long else 4]
+            if m == AN:
+                return [8]
+            return [12 if long else 8, ea_time(m, size)]
+        builder.add(f"{op}.{size} #1,*", [DN, AN] + MEMORY_ALTERABLE, quick)
+
+    for op in ('addx', 'subx'):
+        builder.add(f"{op}.{size} *,*", [DN, PREDEC],
+                    lambda m: [8 if long else 4] if m == DN else [30 if long else 18])
+
+    builder.add(f"cmpm.{size} *,*", [POSTINC], lambda m: [20 if long else 12])
+
+    for op in ('clr', 'neg', 'negx', 'not'):
+        builder.add(f"{op}.{size} *", DATA_ALTERABLE,
+                    lambda m: [6 if long else 4] if m == DN else [12 if long else 8, ea_time(m, size)])
+    builder.add(f"tst.{size} *", DATA_ALTERABLE, lambda m: [4, ea_time(m, size)])
+
+    builder.fixed(f"ext.{size} d0", 4)
+
+
+def _add_shifts(builder, size):
+    long = size == 'l'
+    base = 8 if long else 6
+    # The count in the template is chosen so the figure is bus aligned, since
+    # the table's 2 cycles per count are added after the machine's rounding
+    count = 2 if long else 1
+    for op in sorted(SHIFT_MNEMONICS):
+        builder.fixed(f"{op}.{size} #{count},d0", base + 2 * count)
+        # Register counts are taken modulo 64
+        builder.fixed(f"{op}.{size} d0,d0", base + 2 * 63)
+        builder.fixed(f"{op}.{size} d0,d0 best", base)
+        builder.fixed(f"{op}.{size} d0,d0 average", base + 63)
+    if not long:
+        for op in sorted(SHIFT_MNEMONICS):
+            builder.add(f"{op}.w #1,*", MEMORY_ALTERABLE, lambda m: [8, ea_time(m, 'w')])
+
+
+def _add_move(builder, size):
+    index = 1 if size == 'l' else 0
+    for dest, operand in MOVE_DESTS.items():
+        builder.add(f"move.{size} *,{operand}", ALL_MODES,
+                    lambda m, d=dest: [4, ea_time(m, size), MOVE_DEST_TIMES[d][index]])
+
+    per_register = 8 if size == 'l' else 4
+    registers = f"d0-d{MOVEM_REGISTERS - 1}"
+    builder.add(f"movem.{size} *,{registers}", list(MOVEM_TO_REGISTERS),
+                lambda m: [MOVEM_TO_REGISTERS[m], per_register * MOVEM_REGISTERS])
+    builder.add(f"movem.{size} {registers},*", list(MOVEM_TO_MEMORY),
+                lambda m: [MOVEM_TO_MEMORY[m], per_register * MOVEM_REGISTERS])
+
+    movep = 24 if size == 'l' else 16
+    builder.fixed(f"movep.{size} d0,4(a1)", movep)
+    builder.fixed(f"movep.{size} 4(a0),d0", movep)
+
+
+def _add_bit_ops(builder):
+    # (dynamic register, static register, memory op time); BCHG, BCLR and BSET
+    # are 2 cycles quicker on a register for bit numbers below 16
+    bit_ops = {'bchg': (8, 12, 8), 'bclr': (10, 14, 8), 'bset': (8, 12, 8), 'btst': (6, 10, 4)}
+    for op, (dynamic, static, memory) in bit_ops.items():
+        modes = DATA_MODES if op == 'btst' else DATA_ALTERABLE
+        builder.add(f"{op} d0,*", modes, lambda m, r=dynamic, b=memory: [r] if m == DN else [b, ea_time(m, 'b')])
+        builder.add(f"{op} #1,*", [m for m in modes if m != IMM],
+                    lambda m, r=static, b=memory: [r] if m == DN else [b + 4, ea_time(m, 'b')])
+        if op != 'btst':
+            builder.fixed(f"{op} d0,* best", dynamic - 2)
+            builder.fixed(f"{op} d0,* average", dynamic - 1)
+            builder.fixed(f"{op} #1,* best", static - 2)
+            builder.fixed(f"{op} #1,* average", static - 1)
+
+
+def _add_multiply_divide(builder):
+    # MULU is 38 + 2 per set bit of the source, MULS 38 + 2 per 01/10 bit pair
+    for op in ('mulu', 'muls'):
+        builder.add(f"{op} *,d0", DATA_MODES, lambda m: [70, ea_time(m, 'w')])
+        builder.add(f"{op} *,d0 best", DATA_MODES, lambda m: [38, ea_time(m, 'w')])
+        builder.add(f"{op} *,d0 average", DATA_MODES, lambda m: [54, ea_time(m, 'w')])
+
+    for op, signed, best, worst in (('divu', False, 76, 136), ('divs', True, 120, 156)):
+        average = divide_average(signed)
+        builder.add(f"{op} *,d0", DATA_MODES, lambda m, c=worst: [c, ea_time(m, 'w')])
+        builder.add(f"{op} *,d0 best", DATA_MODES, lambda m, c=best: [c, ea_time(m, 'w')])
+        builder.add(f"{op} *,d0 average", DATA_MODES, lambda m, c=average: [c, ea_time(m, 'w')])
+
+
+def _add_control(builder):
+    for op in ('lea', 'pea', 'jmp', 'jsr'):
+        template = f"{op} *,a1" if op == 'lea' else f"{op} *"
+        # The address calculation and the rest of the instruction round separately
+        builder.add(template, CONTROL_MODES,
+                    lambda m, t=CONTROL_TIMES[op]: [t[m] - ea_time(m, 'w'), ea_time(m, 'w')])
+
+
+def _add_misc(builder):
+    builder.add("abcd *,*", [DN, PREDEC], lambda m: [6] if m == DN else [18])
+    builder.add("sbcd *,*", [DN, PREDEC], lambda m: [6] if m == DN else [18])
+    builder.add("nbcd *", DATA_ALTERABLE, lambda m: [6] if m == DN else [8, ea_time(m, 'b')])
+    builder.add("st *", DATA_ALTERABLE, lambda m: [6] if m == DN else [8, ea_time(m, 'b')])
+    builder.fixed("st * best", 4)
+    builder.fixed("st * average", 5)
+    builder.add("tas *", DATA_ALTERABLE, lambda m: [4] if m == DN else [10, ea_time(m, 'b')])
+    builder.add("chk *,d0", DATA_MODES, lambda m: [10, ea_time(m, 'w')])
+
+    builder.fixed("moveq #0,d0", 4)
+    builder.fixed("exg d0,d1", 6)
+    builder.fixed("swap d0", 4)
+    builder.fixed("nop", 4)
+    builder.fixed("link a0,#4", 16)
+    builder.fixed("unlk a0", 12)
+    builder.fixed("reset", 132)
+    builder.fixed("stop #$2000", 4)
+    builder.fixed("trapv", 4)
+    builder.fixed("move.l usp,a0", 4)
+    builder.fixed("move.l a0,usp", 4)
+
+    builder.add("move.w sr,*", DATA_ALTERABLE, lambda m: [6] if m == DN else [8, ea_time(m, 'w')])
+    builder.add("move.w *,ccr", DATA_MODES, lambda m: [12, ea_time(m, 'w')])
+    builder.add("move.w *,sr", DATA_MODES, lambda m: [12, ea_time(m, 'w')])
+    for op in ('andi', 'eori', 'ori'):
+        builder.fixed(f"{op} #$0,ccr", 20)
+        builder.fixed(f"{op} #$2700,sr", 20)
+
+
+def _add_flow(builder):
+    builder.flow("bra.l/.s", 10, 10)
+    builder.flow("bcc.l/.s taken", 10, 10)
+    builder.flow("bcs.l/.s not", 12, 8)
+    builder.flow("bsr.l/.s", 18, 18)
+    builder.flow("dbcc cc true,nz,z", 12, 10, 14)
+    builder.flow("rts/rte/rtr", 16, 20, 20)
+    builder.flow("trap/illegal", 34, 34)
+
+
+def generate_text(machine='ST'):
+    """The generated table as text, in the layout of "68000 Cycle Count.txt"."""
+    builder = TableBuilder()
+    for size in ('w', 'l'):
+        _add_standard(builder, size)
+        _add_shifts(builder, size)
+        _add_move(builder, size)
+    _add_bit_ops(builder)
+    _add_multiply_divide(builder)
+    _add_control(builder)
+    _add_misc(builder)
+    _add_flow(builder)
+    return builder.render(machine)
+
+
+def generate_table(machine='ST'):
+    """The generated table as a CycleTable, ready for lookups."""
+    return CycleTable(filename='<generated>', text=generate_text(machine))
+
+
+def sample_instruction(template, mode):
+    """Fill a row template's "*" operands with a sample operand in the given mode."""
+    text = ' '.join(template.split()[:2])
+    mnemonic, _, operands = parse_instruction(text)
+    if mnemonic in ('jmp', 'jsr') and not operands:
+        text += ' *'
+    if mnemonic in SHIFT_MNEMONICS and len(operands) == 2 and operands[1] == '*' and mode != DN:
+        # Memory shifts are written with a single operand
+        text = text.split()[0] + ' *'
+    return text.replace('*', SAMPLE_OPERANDS[mode])
+
+
+def cross_check(reference, generated, machine='ST'):
+    """
+    Compare every cell of a measured table with the generated one. Returns a list
+    of (instruction, measured, generated) where they disagree; generated is a
+    (best, worst) pair when the instruction is data-dependent and the measured
+    figure is outside that range.
+    """
+    model = TimingModel(machine, generated, pairing=False)
+    mismatches = []
+    for row in reference.rows:
+        name = row.template.split()[0].lower()
+        if '/' in name or name == 'dbcc':
+            # Branch rows are compared through the flow table below
+            continue
+        for column, measured in zip(reference.columns, row.cycles):
+            if measured is None:
+                continue
+            instruction = sample_instruction(row.template, EAMode(column))
+            expected = model.round(measured)
+            cycles = generated.cycle_range(instruction)
+            if cycles is None:
+                mismatches.append((instruction, expected, None))
+                continue
+            best, _, worst = (model.round(value) for value in cycles)
+            if best == worst and expected != worst:
+                mismatches.append((instruction, expected, worst))
+            elif not best <= expected <= worst:
+                mismatches.append((instruction, expected, (best, worst)))
+
+    for key, (taken, not_taken) in sorted(reference.flow.items(), key=str):
+        other = generated.flow.get(key)
+        expected = (model.round(taken), model.round(not_taken))
+        actual = None if other is None else (model.round(other[0]), model.round(other[1]))
+        if actual != expected:
+            mnemonic, size = key
+            mismatches.append((mnemonic + (f'.{size}' if size else ''), expected, actual))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the 68000 cycle table from the User's Manual formulas.")
+    parser.add_argument('--machine', choices=list(MACHINES), default='ST',
+                        help="68000 for raw cycles, ST/STE to round to the bus (default ST)")
+    parser.add_argument('--write', metavar='FILE', help="Write the table to FILE instead of standard output")
+    parser.add_argument('--check', nargs='?', const=DEFAULT_TABLE, metavar='TABLE',
+                        help="Cross-check against a measured table (defaults to 68000 Cycle Count.txt)")
+    args = parser.parse_args(argv)
+
+    text = generate_text(args.machine)
+    if args.check:
+        reference = CycleTable.load(args.check)
+        mismatches = cross_check(reference, CycleTable(filename='<generated>', text=text), args.machine)
+        for instruction, measured, generated in mismatches:
+            print(f"{instruction:<28} measured {measured}, generated {generated}")
+        print(f"{len(mismatches)} mismatch(es) against {args.check}")
+        return 1 if mismatches else 0
+
+    if args.write:
+        with open(args.write, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Query engine over the rows of the cycle table.
+
+An inverted index maps mnemonics to rows for operation queries, and each cycle
+column keeps a sorted list of (cycles, row) pairs so range queries are a
+bisect. A query is a space separated list of terms which must all match:
+
+    add             substring of the opcode template
+    12              some column costs exactly 12 cycles (as the old filter did)
+    <=12  >8  8-16  cycle range, on any column or on the ea: columns given
+    /^move\\.l/      regular expression on the template
+    ea:(A)+         only rows with a figure for this addressing mode
+    size:l          only .l forms
+    ~add            cheapest forms of the operation (add, adda, addq, addx...),
+                    ordered by cost
+"""
+import re
+from bisect import bisect_left, bisect_right
+
+from cycle_table import EAMode, parse_instruction, canonical_mnemonic
+
+# Instructions that can stand in for each other, for "cheapest equivalent" queries
+OPERATION_FAMILIES = {
+    'add': ('add', 'adda', 'addq', 'addx'),
+    'sub': ('sub', 'suba', 'subq', 'subx'),
+    'cmp': ('cmp', 'cmpa', 'tst'),
+    'move': ('move', 'moveq', 'movem', 'movep'),
+    'clr': ('clr', 'moveq', 'sub', 'eor'),
+    'lsl': ('lsl', 'asl', 'add'),
+    'jmp': ('jmp', 'bra'),
+    'jsr': ('jsr', 'bsr'),
+    'tst': ('tst', 'cmp'),
+}
+
+_RANGE = re.compile(r'^(<=|>=|<|>|=)?(\d+)$')
+_SPAN = re.compile(r'^(\d+)-(\d+)$')
+
+
+def _mode_column(name):
+    """Accept a column heading ('(A)+') or an EAMode name ('postinc')."""
+    for mode in EAMode:
+        if name.lower() in (mode.value.lower(), mode.name.lower()):
+            return mode.value
+    return None
+
+
+class CycleQuery:
+    """Indexes CycleTable.rows for fast filtering. Results are row numbers."""
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = table.rows
+        self.columns = table.columns
+        # Default display order, as the table browser has always shown it
+        self.order = sorted(range(len(self.rows)), key=lambda i: self.rows[i].template)
+
+        self.templates = [row.template.lower() for row in self.rows]
+        self.by_mnemonic = {}
+        self.by_column = {name: [] for name in self.columns}
+        self.by_cycles = []
+        self.sizes = []
+        for row_id, row in enumerate(self.rows):
+            mnemonic, size, _ = parse_instruction(self.templates[row_id])
+            names = {canonical_mnemonic(name) for name in (mnemonic or '').split('/')}
+            self.sizes.append(size[:1] if size else None)
+            for name in names:
+                self.by_mnemonic.setdefault(name, set()).add(row_id)
+            for name, cycles in zip(self.columns, row.cycles):
+                if cycles is not None:
+                    self.by_column[name].append((cycles, row_id))
+                    self.by_cycles.append((cycles, row_id))
+        for values in self.by_column.values():
+            values.sort()
+        self.by_cycles.sort()
+
+    def cycle_range(self, low, high, columns=None):
+        """Rows with a figure in [low, high] in any of the columns (all if None)."""
+        lists = [self.by_column[name] for name in columns] if columns else [self.by_cycles]
+        result = set()
+        for values in lists:
+            start = bisect_left(values, (low, -1))
+            end = bisect_right(values, (high, len(self.rows)))
+            result.update(row_id for _, row_id in values[start:end])
+        return result
+
+    def family(self, operation):
+        operation = canonical_mnemonic(operation.lower())
+        return OPERATION_FAMILIES.get(operation, (operation,))
+
+    def cheapest(self, operation, columns=None, size=None):
+        """
+        Rows of every form of an operation, cheapest first. Returns (cycles, row)
+        pairs, costed on the given columns or on the cheapest column of each row.
+        """
+        results = []
+        for mnemonic in self.family(operation):
+            for row_id in self.by_mnemonic.get(mnemonic, ()):
+                if size and self.sizes[row_id] not in (size, None):
+                    continue
+                row = self.rows[row_id]
+                cells = [cycles for name, cycles in zip(self.columns, row.cycles)
+                         if cycles is not None and (not columns or name in columns)]
+                if cells:
+                    results.append((min(cells), row_id))
+        results.sort(key=lambda item: (item[0], self.rows[item[1]].template))
+        return results
+
+    def _range_bounds(self, term):
+        m = _SPAN.match(term)
+        if m:
+            return int(m.group(1)), int(m.group(2))
+        m = _RANGE.match(term)
+        if not m:
+            return None
+        op, value = m.group(1) or '=', int(m.group(2))
+        return {
+            '=': (value, value),
+            '<': (0, value - 1),
+            '<=': (0, value),
+            '>': (value + 1, float('inf')),
+            '>=': (value, float('inf')),
+        }[op]
+
+    def _text_rows(self, text):
+        return {i for i, template in enumerate(self.templates) if text in template}
+
+    def search(self, query):
+        """Return matching row numbers in display order (cost order for ~ queries)."""
+        terms = query.strip().lower().split()
+        if not terms:
+            return list(self.order)
+
+        columns = []
+        for term in terms:
+            if term.startswith('ea:') or term.startswith('mode:'):
+                column = _mode_column(term.split(':', 1)[1])
+                if column is None:
+                    return []
+                columns.append(column)
+
+        result = None
+        ranked = None
+        for term in terms:
+            if term.startswith('ea:') or term.startswith('mode:'):
+                matches = set()
+                for column in columns:
+                    matches.update(row_id for _, row_id in self.by_column.get(column, ()))
+            elif term.startswith('size:'):
+                size = term[5:].lstrip('.')[:1]
+                matches = {i for i, s in enumerate(self.sizes) if s == size}
+            elif term.startswith('~') and len(term) > 1:
+                ranked = self.cheapest(term[1:], columns)
+                matches = {row_id for _, row_id in ranked}
+            elif len(term) > 2 and term.startswith('/') and term.endswith('/'):
+                try:
+                    pattern = re.compile(term[1:-1], re.IGNORECASE)
+                except re.error:
+                    return []
+                matches = {i for i, template in enumerate(self.templates) if pattern.search(template)}
+            elif self._range_bounds(term):
+                low, high = self._range_bounds(term)
+                matches = self.cycle_range(low, high, columns)
+            else:
+                matches = self._text_rows(term)
+            result = matches if result is None else result & matches
+            if not result:
+                return []
+
+        if ranked is not None:
+            return [row_id for _, row_id in ranked if row_id in result]
+        return [row_id for row_id in self.order if row_id in result]
@@ -0,0 +1,471 @@
+"""
+Structured index over "68000 Cycle Count.txt" for costing assembler instructions.
+
+Each row of the text table is an instruction template such as "add.w *,d0",
+where "*" stands for the addressing mode named by the column heading. The rows
+are expanded once into CycleEntry records keyed by mnemonic, size, operand
+direction and EA mode, with integer cycle counts. The compiled index is cached
+as a pickle next to the text file and only rebuilt when the text changes, so
+other tools can do O(1) lookups without parsing the table or starting Tk:
+
+    from cycle_table import CycleTable, EAMode, Direction
+    table = CycleTable.load()
+    table.get('add', 'w', Direction.SOURCE, EAMode.POSTINC, EAMode.DN).cycles
+    table.lookup('add.w (a0)+,d0').cycles
+"""
+import hashlib
+import os
+import pickle
+import re
+from collections import namedtuple
+from enum import Enum
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "68000 Cycle Count.txt")
+
+# Bump when the layout of the compiled index changes, to invalidate old caches
+CACHE_VERSION = 2
+
+
+class EAMode(Enum):
+    """Addressing modes; values are the column headings of the text table."""
+    DN = 'Dn'
+    AN = 'An'
+    IND = '(A)'
+    POSTINC = '(A)+'
+    PREDEC = '-(A)'
+    DISP = '$(A)'
+    INDEX = 'I(A)'
+    ABS_W = '.W'
+    ABS_L = '.L'
+    PC_DISP = '$(P)'
+    PC_INDEX = 'I(P)'
+    IMM = '#'
+    SR = 'sr'
+    CCR = 'ccr'
+    USP = 'usp'
+    LIST = 'list'
+
+
+class Direction(Enum):
+    """Which operand of the template is the variable effective address."""
+    NONE = 'none'        # no operands, e.g. nop
+    SINGLE = 'single'    # the only operand, e.g. clr.w <ea>
+    SOURCE = 'source'    # <ea>,other
+    DEST = 'dest'        # other,<ea>, also used for fixed forms such as moveq #0,d0
+    BOTH = 'both'        # <ea>,<ea> in the same mode, e.g. addx -(a0),-(a1)
+
+
+# Column headings of the cycle table, in order
+EA_COLUMNS = [mode.value for mode in list(EAMode)[:12]]
+
+CONDITION_CODES = {'t', 'f', 'hi', 'ls', 'cc', 'hs', 'cs', 'lo', 'ne', 'eq',
+                   'vc', 'vs', 'pl', 'mi', 'ge', 'lt', 'gt', 'le'}
+
+SHIFT_MNEMONICS = {'asl', 'asr', 'lsl', 'lsr', 'rol', 'ror', 'roxl', 'roxr'}
+
+# Alternative spellings that share a row with the canonical mnemonic
+MNEMONIC_ALIASES = {
+    'addi': 'add', 'subi': 'sub', 'andi': 'and', 'ori': 'or', 'eori': 'eor',
+    'cmpi': 'cmp', 'movea': 'move', 'dbra': 'dbcc', 'illegal': 'trap', 'rtr': 'rte',
+}
+
+# Instructions whose cost depends on operand values at run time
+DATA_DEPENDENT = {'mulu', 'muls', 'divu', 'divs'}
+
+# A third word on a template row marks it as a data-dependent case, e.g. "mulu *,d0 best"
+VARIANT_QUALIFIERS = ('best', 'average')
+
+# One expanded cell of the table. `other` is the mode of the fixed operand, and
+# `adjust` is (kind, table count, cycles per unit) for shift counts and MOVEM lists.
+CycleKey = namedtuple('CycleKey', ['mnemonic', 'size', 'direction', 'ea', 'other'])
+CycleEntry = namedtuple('CycleEntry', ['mnemonic', 'size', 'direction', 'ea', 'other', 'cycles', 'template', 'adjust'])
+
+# A row of the text table as displayed: template and one int (or None) per column
+CycleRow = namedtuple('CycleRow', ['template', 'cycles'])
+
+# Cost of an instruction: `cycles` is the normal (or branch taken) cost,
+# `not_taken` the fall-through cost of a conditional branch.
+Timing = namedtuple('Timing', ['cycles', 'not_taken', 'template', 'data_dependent'])
+
+_REGISTER_NUMBERS = {f'{bank}{n}': (8 if bank == 'a' else 0) + n for bank in 'da' for n in range(8)}
+_REGISTER_NUMBERS['sp'] = 15
+_INDEX_REGISTER = re.compile(r'^(d[0-7]|a[0-7]|sp)(\.[wl])?(\*[1248])?$')
+_REGLIST_PART = re.compile(r'^(d[0-7]|a[0-7]|sp)(?:-(d[0-7]|a[0-7]|sp))?$')
+
+
+def split_operands(text):
+    """Split an operand field on commas that are not inside parentheses."""
+    operands = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            operands.append(text[start:i].strip())
+            start = i + 1
+    if text[start:].strip():
+        operands.append(text[start:].strip())
+    return operands
+
+
+def register_count(operand):
+    """Number of registers in a MOVEM register list such as d0-d3/a0, or None."""
+    count = 0
+    for part in operand.lower().split('/'):
+        m = _REGLIST_PART.match(part)
+        if not m:
+            return None
+        first = _REGISTER_NUMBERS[m.group(1)]
+        last = _REGISTER_NUMBERS[m.group(2)] if m.group(2) else first
+        count += abs(last - first) + 1
+    return count
+
+
+def operand_mode(operand):
+    """Classify an operand's addressing mode as an EAMode."""
+    op = operand.strip().lower()
+    if op.startswith('#'):
+        return EAMode.IMM
+    if op in _REGISTER_NUMBERS:
+        return EAMode.AN if op[0] in 'as' else EAMode.DN
+    if op in ('sr', 'ccr', 'usp'):
+        return EAMode(op)
+    if ('-' in op or '/' in op) and not op.startswith('-(') and register_count(op):
+        return EAMode.LIST
+    if op.startswith('-(') and op.endswith(')'):
+        return EAMode.PREDEC
+    if op.startswith('(') and op.endswith(')+'):
+        return EAMode.POSTINC
+    if op.endswith(').w') or op.endswith(').l'):
+        # (xxx).w style absolute addressing
+        return EAMode.ABS_W if op.endswith('.w') else EAMode.ABS_L
+    if op.endswith(')') and '(' in op:
+        outer, inner = op[:-1].split('(', 1)
+        parts = [p.strip() for p in inner.split(',') if p.strip()]
+        if outer.strip():
+            parts.insert(0, outer.strip())
+        base = None
+        index = False
+        for part in parts:
+            if part == 'pc' or (part in _REGISTER_NUMBERS and part[0] in 'as' and base is None):
+                base = part
+            elif _INDEX_REGISTER.match(part):
+                index = True
+        if base == 'pc':
+            return EAMode.PC_INDEX if index else EAMode.PC_DISP
+        if base is not None:
+            if index:
+                return EAMode.INDEX
+            return EAMode.DISP if len(parts) > 1 else EAMode.IND
+    if op.endswith('.w'):
+        return EAMode.ABS_W
+    return EAMode.ABS_L
+
+
+def parse_instruction(text):
+    """
+    Split 'move.w d0,(a1)' into ('move', 'w', ['d0', '(a1)']).
+    Anything after the operand field (a comment, or a table qualifier) is ignored.
+    """
+    fields = text.strip().split(None, 2)
+    if not fields:
+        return None, None, []
+    mnemonic = fields[0].lower()
+    size = None
+    if '.' in mnemonic:
+        mnemonic, size = mnemonic.split('.', 1)
+    operands = split_operands(fields[1]) if len(fields) > 1 else []
+    return mnemonic, size, operands
+
+
+def canonical_mnemonic(mnemonic, modes=()):
+    """Map condition code families and aliases onto the names used by the table."""
+    mnemonic = MNEMONIC_ALIASES.get(mnemonic, mnemonic)
+    if mnemonic.startswith('db') and mnemonic[2:] in CONDITION_CODES:
+        return 'dbcc'
+    if mnemonic.startswith('b') and mnemonic[1:] in CONDITION_CODES:
+        return 'bcc'
+    if mnemonic.startswith('s') and mnemonic[1:] in CONDITION_CODES:
+        return 'st'
+    if mnemonic in ('add', 'sub', 'cmp') and modes and modes[-1] == EAMode.AN:
+        return mnemonic + 'a'
+    return mnemonic
+
+
+def parse_columns(header):
+    """
+    Find (name, start, end) for each cycle column after the ':' in the header.
+    Values are right aligned under their heading, so each cell starts where the
+    previous heading ends and wide values can spill to the left.
+    """
+    colon_index = header.index(":") if ":" in header else len(header)
+    columns = []
+    prev_char = ' '
+    start_idx = colon_index + 1
+    for i, char in enumerate(header[start_idx:], start=start_idx):
+        if prev_char == ' ' and char != ' ':
+            start_idx = i
+        elif prev_char != ' ' and char == ' ':
+            columns.append((header[start_idx:i].strip(), i))
+        prev_char = char
+    # The last column runs to the end of each line
+    columns.append((header[start_idx:].strip(), None))
+
+    cells = []
+    cell_start = colon_index + 1
+    for name, end in columns:
+        cells.append((name, cell_start, end))
+        cell_start = end
+    return colon_index, cells
+
+
+def _key_modes(direction, ea, other):
+    """Operand modes in source order for an entry."""
+    if direction == Direction.SINGLE:
+        return (ea,)
+    if direction == Direction.SOURCE:
+        return (ea, other) if other else (ea,)
+    if direction == Direction.DEST:
+        return (other, ea) if other else (ea,)
+    if direction == Direction.BOTH:
+        return (ea, ea)
+    return ()
+
+
+class CycleTable:
+    """Cycle counts from the text table, compiled into dictionary indexes."""
+
+    def __init__(self, filename=DEFAULT_TABLE, text=None):
+        """Parse a table file, or table text already in memory (e.g. a generated table)."""
+        self.filename = filename
+        self.columns = []
+        self.rows = []
+        # CycleKey -> CycleEntry, for structured queries
+        self.entries = {}
+        # (mnemonic, size, operand modes) -> CycleEntry, for matching source
+        self.index = {}
+        # (mnemonic, size) -> (taken, not_taken) for branches and returns
+        self.flow = {}
+        # (mnemonic, size, operand modes) -> {'best': cycles, 'average': cycles}
+        # from rows qualified with "best" or "average"; the plain row is the worst case
+        self.variants = {}
+        self._cache = {}
+        if text is None:
+            with open(filename, "rb") as f:
+                data = f.read()
+        else:
+            data = text.encode('latin-1')
+        self.digest = hashlib.sha1(data).hexdigest()
+        self._parse(data.decode('latin-1'))
+
+    @classmethod
+    def load(cls, filename=DEFAULT_TABLE, cache_file=None):
+        """
+        Load the compiled index from its cache, rebuilding the cache when the
+        text table has changed (or the cache is missing or from an old version).
+        """
+        if cache_file is None:
+            cache_file = filename + ".cache"
+        with open(filename, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        try:
+            with open(cache_file, "rb") as f:
+                version, cached_digest, table = pickle.load(f)
+            if version == CACHE_VERSION and cached_digest == digest:
+                table.filename = filename
+                return table
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError):
+            pass
+
+        table = cls(filename)
+        try:
+            with open(cache_file, "wb") as f:
+                pickle.dump((CACHE_VERSION, table.digest, table), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass  # A read-only install just parses the text every time
+        return table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def _parse(self, text):
+        lines = text.splitlines()
+        colon_index, columns = parse_columns(lines[0])
+        self.columns = [name for name, _, _ in columns]
+        flow_section = False
+        for line in lines[1:]:
+            if not line.strip():
+                # Rows after the blank line are branches, whose columns are not EA modes
+                flow_section = True
+                continue
+            template = line[:colon_index].strip()
+            cells = [line[start:end].strip() for _, start, end in columns]
+            cycles = tuple(int(cell) if cell.isdigit() else None for cell in cells)
+            self.rows.append(CycleRow(template, cycles))
+            if flow_section and self._add_flow_row(template, cycles):
+                continue
+            self._add_row(template, cycles)
+
+    def _add_flow_row(self, template, cycles):
+        values = [value for value in cycles if value is not None]
+        name = template.split()[0].lower()
+        if name in ('bra.l/.s', 'bsr.l/.s'):
+            mnemonic = name[:3]
+            self.flow[(mnemonic, 'w')] = (values[0], None)
+            self.flow[(mnemonic, 's')] = (values[1], None)
+        elif name == 'bcc.l/.s' or name == 'bcs.l/.s':
+            taken = 'taken' in template.split()[1:]
+            for size, value in zip(('w', 's'), values):
+                current = self.flow.get(('bcc', size), (None, None))
+                self.flow[('bcc', size)] = (value, current[1]) if taken else (current[0], value)
+        elif name == 'dbcc':
+            # Columns are: condition true, loop taken (count not expired), count expired
+            self.flow[('dbcc', None)] = (values[1], max(values[0], values[2]))
+        elif '/' in name:
+            for mnemonic, value in zip(name.split('/'), values):
+                self.flow[(mnemonic, None)] = (value, None)
+        else:
+            # jmp, jsr and unlk use the normal EA columns
+            return False
+        return True
+
+    def _add_row(self, template, cycles):
+        mnemonic, size, operands = parse_instruction(template)
+        if mnemonic in ('jmp', 'jsr') and not operands:
+            operands = ['*']
+        fields = template.split()
+        qualifier = fields[2].lower() if len(fields) > 2 else None
+
+        adjust = None
+        if mnemonic in SHIFT_MNEMONICS and operands and operands[0].startswith('#') and operands[1] == '*':
+            # Memory shifts are written with a single operand in source
+            operands = ['*']
+        elif mnemonic in SHIFT_MNEMONICS and operands and operands[0].startswith('#'):
+            adjust = ('count', int(operands[0][1:]), 2)
+        elif mnemonic == 'movem':
+            per_register = 8 if size == 'l' else 4
+            for op in operands:
+                if op != '*' and register_count(op):
+                    adjust = ('registers', register_count(op), per_register)
+
+        fixed = [None if op == '*' else operand_mode(op) for op in operands]
+        mnemonic = canonical_mnemonic(mnemonic, [m for m in fixed if m])
+        if None not in fixed:
+            # Fixed forms have a single figure, whatever column it sits in
+            ea = fixed[-1] if fixed else None
+            other = fixed[0] if len(fixed) == 2 else None
+            direction = (Direction.NONE, Direction.SINGLE, Direction.DEST)[len(fixed)]
+        else:
+            ea = None
+            other = next((m for m in fixed if m is not None), None)
+            if fixed == [None, None]:
+                direction = Direction.BOTH
+            elif len(fixed) == 1:
+                direction = Direction.SINGLE
+            else:
+                direction = Direction.SOURCE if fixed[0] is None else Direction.DEST
+
+        for column, value in zip(self.columns, cycles):
+            if value is None:
+                continue
+            if None in fixed:
+                ea = EAMode(column)
+            modes = _key_modes(direction, ea, other)
+            if qualifier in VARIANT_QUALIFIERS:
+                self.variants.setdefault((mnemonic, size, modes), {})[qualifier] = value
+                continue
+            self._add_entry(CycleEntry(mnemonic, size, direction, ea, other, value, template, adjust), modes)
+            if mnemonic == 'exg':
+                for pair in ((EAMode.DN, EAMode.AN), (EAMode.AN, EAMode.DN), (EAMode.AN, EAMode.AN)):
+                    self._add_entry(CycleEntry(mnemonic, size, direction, ea, other, value, template, adjust), pair)
+
+    def _add_entry(self, entry, modes):
+        # The first row wins: the table lists the specific forms first
+        self.entries.setdefault(CycleKey(*entry[:5]), entry)
+        self.index.setdefault((entry.mnemonic, entry.size, modes), entry)
+
+    def get(self, mnemonic, size, direction, ea, other=None):
+        """Structured O(1) query, returning the CycleEntry or None."""
+        return self.entries.get(CycleKey(mnemonic, size, direction, ea, other))
+
+    def _find(self, index, mnemonic, size, modes):
+        for candidate in (size, None, 'w') if size in (None, 'b') else (size, None):
+            entry = index.get((mnemonic, candidate, modes))
+            if entry:
+                return entry
+        return None
+
+    def _parse_key(self, instruction):
+        mnemonic, size, operands = parse_instruction(instruction)
+        if mnemonic is None:
+            return None, None, [], ()
+        modes = tuple(operand_mode(op) for op in operands)
+        mnemonic = canonical_mnemonic(mnemonic, modes)
+        if mnemonic == 'movem':
+            # A single register is still a register list to MOVEM
+            modes = tuple(EAMode.LIST if m in (EAMode.DN, EAMode.AN) else m for m in modes)
+        return mnemonic, size, operands, modes
+
+    def cycle_range(self, instruction):
+        """
+        (best, average, worst) cycles for an instruction. Only tables with best and
+        average rows (such as the generated one) have a spread for data-dependent forms.
+        """
+        timing = self.lookup(instruction)
+        if timing is None:
+            return None
+        if timing.not_taken is not None:
+            return min(timing.cycles, timing.not_taken), None, max(timing.cycles, timing.not_taken)
+        mnemonic, size, _, modes = self._parse_key(' '.join(instruction.lower().split()))
+        variants = self._find(self.variants, mnemonic, size, modes) or {}
+        return (variants.get('best', timing.cycles), variants.get('average', timing.cycles), timing.cycles)
+
+    def lookup(self, instruction):
+        """Return the Timing for an instruction such as 'add.w (a0)+,d0', or None."""
+        key = ' '.join(instruction.lower().split())
+        if key in self._cache:
+            return self._cache[key]
+        timing = self._lookup(key)
+        self._cache[key] = timing
+        return timing
+
+    def _lookup(self, instruction):
+        mnemonic, size, operands, modes = self._parse_key(instruction)
+        if mnemonic is None:
+            return None
+
+        if mnemonic in ('bra', 'bsr', 'bcc', 'dbcc') or (mnemonic, None) in self.flow:
+            flow_size = 's' if size in ('s', 'b') else 'w'
+            flow = self.flow.get((mnemonic, flow_size)) or self.flow.get((mnemonic, None))
+            if flow is None:
+                return None
+            return Timing(flow[0], flow[1], mnemonic, False)
+
+        entry = self._find(self.index, mnemonic, size, modes)
+        if entry is None:
+            return None
+        cycles = entry.cycles
+        adjust = entry.adjust
+        data_dependent = mnemonic in DATA_DEPENDENT or self._find(self.variants, mnemonic, size, modes) is not None
+        if adjust and adjust[0] == 'count':
+            if operands[0].startswith('#'):
+                try:
+                    count = int(operands[0][1:].lstrip('$'), 16 if operands[0][1:].startswith('$') else 10)
+                    cycles += (count - adjust[1]) * adjust[2]
+                except ValueError:
+                    pass
+            else:
+                data_dependent = True
+        elif adjust and adjust[0] == 'registers':
+            count = next((register_count(op) for op in operands
+                          if operand_mode(op) in (EAMode.LIST, EAMode.DN, EAMode.AN)), None)
+            if count:
+                cycles += (count - adjust[1]) * adjust[2]
+        elif mnemonic in SHIFT_MNEMONICS and len(modes) == 2 and modes[0] == EAMode.DN:
+            data_dependent = True
+        return Timing(cycles, None, entry.template, data_dependent)
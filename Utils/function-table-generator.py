@@ -1,12 +1,16 @@
 import tkinter as tk
-from tkinter import ttk, filedialog
-import numpy as np
-import struct
+from tkinter import ttk, filedialog, simpledialog
 import json
+import os
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import ctypes
 
+from function_tables import EXPRESSION, LEGACY_FUNCTIONS, generate, table_expression
+from trig_tables import TRIG_FUNCTIONS
+from table_bundle import load_bundle, table_bytes, write_bundle
+from table_optimizer import best, candidate_config, interpolation_verdict, search
+
 class FunctionTableGenerator:
     def __init__(self, root):
         self.root = root
@@ -49,7 +53,9 @@ class FunctionTableGenerator:
             ("Load Config", self.load_config),
             ("Save Config", self.save_config),
             ("Generate", self.generate_data),
-            ("Save Data", self.save_data)
+            ("Save Data", self.save_data),
+            ("Optimize", self.optimize_table),
+            ("Build Bundle", self.build_bundle)
         ]:
             btn = ttk.Button(toolbar, text=text, command=command)
             btn.pack(side=tk.LEFT, padx=int(2 * scaling))
@@ -61,13 +67,19 @@ class FunctionTableGenerator:
         # Function selection
         ttk.Label(param_frame, text="Function:").grid(row=0, column=0, sticky=tk.W)
         self.function_var = tk.StringVar(value="SIN")
-        self.function_combo = ttk.Combobox(param_frame, textvariable=self.function_var, values=["SIN", "COS"])
+        self.function_combo = ttk.Combobox(param_frame, textvariable=self.function_var,
+                                           values=list(LEGACY_FUNCTIONS) + list(TRIG_FUNCTIONS) + [EXPRESSION])
         self.function_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
         
+        # Expression of x (and y), used when the function is Expression
+        ttk.Label(param_frame, text="Expression:").grid(row=1, column=0, sticky=tk.W)
+        self.expression_var = tk.StringVar(value="sin(deg2rad(x))")
+        ttk.Entry(param_frame, textvariable=self.expression_var).grid(row=1, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        
         # Range inputs
-        ttk.Label(param_frame, text="Range (degrees):").grid(row=1, column=0, sticky=tk.W)
+        ttk.Label(param_frame, text="X range (degrees for SIN/COS):").grid(row=2, column=0, sticky=tk.W)
         range_frame = ttk.Frame(param_frame)
-        range_frame.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        range_frame.grid(row=2, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
         
         self.range_min_var = tk.StringVar(value="0")
         self.range_max_var = tk.StringVar(value="360")
@@ -76,20 +88,35 @@ class FunctionTableGenerator:
         ttk.Entry(range_frame, textvariable=self.range_max_var, width=6).pack(side=tk.LEFT, padx=int(2 * scaling))
         
         # Scale input
-        ttk.Label(param_frame, text="Scale:").grid(row=2, column=0, sticky=tk.W)
+        ttk.Label(param_frame, text="Scale:").grid(row=3, column=0, sticky=tk.W)
         self.scale_var = tk.StringVar(value="255")
-        ttk.Entry(param_frame, textvariable=self.scale_var).grid(row=2, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        ttk.Entry(param_frame, textvariable=self.scale_var).grid(row=3, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
         
         # Number of entries
-        ttk.Label(param_frame, text="Number of entries:").grid(row=3, column=0, sticky=tk.W)
+        ttk.Label(param_frame, text="Number of entries:").grid(row=4, column=0, sticky=tk.W)
         self.entries_var = tk.StringVar(value="361")
-        ttk.Entry(param_frame, textvariable=self.entries_var).grid(row=3, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        ttk.Entry(param_frame, textvariable=self.entries_var).grid(row=4, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        
+        # Y range and entries; leave the entries empty for a 1-D table
+        ttk.Label(param_frame, text="Y range (2-D tables):").grid(row=5, column=0, sticky=tk.W)
+        y_range_frame = ttk.Frame(param_frame)
+        y_range_frame.grid(row=5, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        
+        self.y_range_min_var = tk.StringVar(value="0")
+        self.y_range_max_var = tk.StringVar(value="0")
+        ttk.Entry(y_range_frame, textvariable=self.y_range_min_var, width=6).pack(side=tk.LEFT, padx=int(2 * scaling))
+        ttk.Label(y_range_frame, text="to").pack(side=tk.LEFT, padx=int(2 * scaling))
+        ttk.Entry(y_range_frame, textvariable=self.y_range_max_var, width=6).pack(side=tk.LEFT, padx=int(2 * scaling))
+        
+        ttk.Label(param_frame, text="Y entries (2-D tables):").grid(row=6, column=0, sticky=tk.W)
+        self.y_entries_var = tk.StringVar(value="")
+        ttk.Entry(param_frame, textvariable=self.y_entries_var).grid(row=6, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
         
         # Entry size
-        ttk.Label(param_frame, text="Entry size (bits):").grid(row=4, column=0, sticky=tk.W)
+        ttk.Label(param_frame, text="Entry size (bits):").grid(row=7, column=0, sticky=tk.W)
         self.size_var = tk.StringVar(value="16")
         size_combo = ttk.Combobox(param_frame, textvariable=self.size_var, values=["8", "16", "32"])
-        size_combo.grid(row=4, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
+        size_combo.grid(row=7, column=1, sticky=(tk.W, tk.E), pady=int(2 * scaling))
         
         # Create plot frame with scaled padding
         plot_frame = ttk.LabelFrame(main_frame, text="Preview", padding=int(5 * scaling))
@@ -113,38 +140,44 @@ class FunctionTableGenerator:
         
         self.generated_data = None
         
+    def get_config(self):
+        return {
+            'function': self.function_var.get(),
+            'expression': self.expression_var.get(),
+            'range_min': self.range_min_var.get(),
+            'range_max': self.range_max_var.get(),
+            'y_range_min': self.y_range_min_var.get(),
+            'y_range_max': self.y_range_max_var.get(),
+            'y_entries': self.y_entries_var.get(),
+            'scale': self.scale_var.get(),
+            'entries': self.entries_var.get(),
+            'size': self.size_var.get()
+        }
+
     def generate_data(self):
         try:
-            min_deg = float(self.range_min_var.get())
-            max_deg = float(self.range_max_var.get())
-            scale = float(self.scale_var.get())
-            num_entries = int(self.entries_var.get())
-            
-            # Generate x values (degrees)
-            x = np.linspace(min_deg, max_deg, num_entries)
-            
-            # Convert degrees to radians
-            radians = np.deg2rad(x)
-            
-            # Generate y values based on selected function
-            if self.function_var.get() == "SIN":
-                y = np.sin(radians) * scale
-            else:  # COS
-                y = np.cos(radians) * scale
-            
-            # Round to integers
-            self.generated_data = np.round(y).astype(int)
+            # The whole domain is evaluated at once, so large tables generate instantly
+            config = self.get_config()
+            self.generated_data, x, y = generate(config)
+            title = config['expression'] if config['function'] == EXPRESSION else config['function']
             
             # Update plot
             self.ax.clear()
-            self.ax.plot(x, self.generated_data, linewidth=2)
-            self.ax.set_title(f"{self.function_var.get()} Table")
-            self.ax.set_xlabel("Degrees")
-            self.ax.set_ylabel("Value")
-            self.ax.grid(True)
+            if y is not None:
+                self.ax.imshow(self.generated_data, origin='lower', aspect='auto',
+                               extent=(x[0], x[-1], y[0], y[-1]))
+                self.ax.set_ylabel("Y")
+            else:
+                # Plotting every point of a huge table only slows the preview
+                step = max(1, len(x) // 4096)
+                self.ax.plot(x[::step], self.generated_data[::step], linewidth=2)
+                self.ax.set_ylabel("Value")
+                self.ax.grid(True)
+            self.ax.set_title(f"{title} Table")
+            self.ax.set_xlabel("Degrees" if config['function'] in LEGACY_FUNCTIONS or config['function'] in TRIG_FUNCTIONS else "X")
             self.canvas.draw()
             
-        except ValueError as e:
+        except (ValueError, TypeError, ZeroDivisionError) as e:
             tk.messagebox.showerror("Error", f"Invalid input: {str(e)}")
     
     def save_data(self):
@@ -159,27 +192,85 @@ class FunctionTableGenerator:
         
         if filename:
             try:
+                size_bits = int(self.size_var.get())
+                # 8-bit tables are unsigned unless they go negative; values that do not fit are an error
+                signed = size_bits > 8 or self.generated_data.min() < 0
+                data = table_bytes(self.generated_data, size_bits, signed)
                 with open(filename, 'wb') as f:
-                    size_bits = int(self.size_var.get())
-                    
-                    if size_bits == 8:
-                        fmt = '>B'  # unsigned char
-                        data = np.clip(self.generated_data, 0, 255)
-                    elif size_bits == 16:
-                        fmt = '>h'  # short
-                        data = np.clip(self.generated_data, -32768, 32767)
-                    else:  # 32
-                        fmt = '>l'  # long
-                        data = self.generated_data
-                    
-                    for value in data:
-                        f.write(struct.pack(fmt, value))
+                    f.write(data)
                         
                 tk.messagebox.showinfo("Success", "Data saved successfully!")
                 
             except Exception as e:
                 tk.messagebox.showerror("Error", f"Failed to save data: {str(e)}")
     
+    def optimize_table(self):
+        config = self.get_config()
+        if config['y_entries'].strip():
+            tk.messagebox.showwarning("Warning", "Only 1-D tables can be optimized.")
+            return
+        max_error = simpledialog.askfloat("Optimize", "Largest error allowed (in the function's units):",
+                                          initialvalue=0.001, minvalue=0.0)
+        if max_error is None:
+            return
+        budget = simpledialog.askinteger("Optimize", "Memory budget (bytes):", initialvalue=2048, minvalue=1)
+        if budget is None:
+            return
+        
+        try:
+            expression = table_expression(config)
+            x_range = (float(config['range_min']), float(config['range_max']))
+            candidates = search(expression, x_range)
+            winner = best(candidates, max_error, budget)
+            verdict = interpolation_verdict(candidates, max_error, budget)
+            if winner is None:
+                tk.messagebox.showinfo("Optimize", f"No table meets the bound within the budget.\n{verdict}")
+                return
+            
+            # Load the stored part of the winning table into the form
+            winning = candidate_config(winner, expression, x_range)
+            self.function_var.set(EXPRESSION)
+            self.expression_var.set(expression)
+            self.range_min_var.set(winning['range_min'])
+            self.range_max_var.set(winning['range_max'])
+            self.y_entries_var.set('')
+            self.scale_var.set(winning['scale'])
+            self.entries_var.set(winning['entries'])
+            self.size_var.set(winning['size'])
+            self.generate_data()
+            
+            fold = {1: "no folding", 2: "half table", 4: "quarter table"}[winner.fold]
+            tk.messagebox.showinfo("Optimize",
+                                   f"{winner.stored} entries of {winner.bits} bits ({winner.bytes} bytes), "
+                                   f"shift {winner.shift}, {fold}, "
+                                   f"{'interpolated' if winner.interpolate else 'nearest entry'}\n"
+                                   f"Max error {winner.max_error:.3g}, RMS error {winner.rms_error:.3g}, "
+                                   f"{winner.cycles} cycles per lookup ({winner.routine})\n{verdict}")
+        except (ValueError, TypeError, ZeroDivisionError) as e:
+            tk.messagebox.showerror("Error", f"Failed to optimize: {str(e)}")
+    
+    def build_bundle(self):
+        config_file = filedialog.askopenfilename(
+            title="Select Bundle Config",
+            filetypes=[("Bundle configs", "*.json"), ("All files", "*.*")]
+        )
+        if not config_file:
+            return
+        prefix = filedialog.asksaveasfilename(
+            title="Save Bundle As",
+            initialfile=os.path.splitext(os.path.basename(config_file))[0],
+            filetypes=[("All files", "*.*")]
+        )
+        if not prefix:
+            return
+        
+        try:
+            binary, tables, elapsed = write_bundle(load_bundle(config_file), os.path.splitext(prefix)[0])
+            tk.messagebox.showinfo("Success", f"{len(tables)} tables, {len(binary)} bytes, built in {elapsed * 1000:.1f} ms\n"
+                                              f"Wrote .bin, .s and .h files")
+        except Exception as e:
+            tk.messagebox.showerror("Error", f"Failed to build bundle: {str(e)}")
+    
     def save_config(self):
         filename = filedialog.asksaveasfilename(
             defaultextension=".cfg",
@@ -187,14 +278,7 @@ class FunctionTableGenerator:
         )
         
         if filename:
-            config = {
-                'function': self.function_var.get(),
-                'range_min': self.range_min_var.get(),
-                'range_max': self.range_max_var.get(),
-                'scale': self.scale_var.get(),
-                'entries': self.entries_var.get(),
-                'size': self.size_var.get()
-            }
+            config = self.get_config()
             
             try:
                 with open(filename, 'w') as f:
@@ -219,6 +303,11 @@ class FunctionTableGenerator:
                 self.scale_var.set(config['scale'])
                 self.entries_var.set(config['entries'])
                 self.size_var.set(config['size'])
+                # Configs from before expressions and 2-D tables have none of these
+                self.expression_var.set(config.get('expression', LEGACY_FUNCTIONS.get(config['function'], '')))
+                self.y_range_min_var.set(config.get('y_range_min', '0'))
+                self.y_range_max_var.set(config.get('y_range_max', '0'))
+                self.y_entries_var.set(config.get('y_entries', ''))
                 
                 tk.messagebox.showinfo("Success", "Configuration loaded successfully!")
             except Exception as e:
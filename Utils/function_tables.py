@@ -0,0 +1,216 @@
+"""
+Lookup tables from expressions, for the function table generator.
+
+A table is defined by the same settings the generator saves in its .cfg files:
+a function, an x range and number of entries, a scale and an entry size. The
+function is SIN or COS of x in degrees, or an expression of x, evaluated on
+the whole np.linspace domain at once:
+
+    sqrt(x)                 square roots
+    65536 / x               reciprocals, or perspective divide k / z
+    exp(-x / 64)            exponential fades
+    rad2deg(arctan2(y, x))  atan2 over a grid
+
+The folded sine layouts of trig_tables ('SIN half', 'SIN quarter' and
+'SIN/COS') are functions too; for them entries is the entries per period and
+the range is not used.
+
+Giving a y range and y entries makes a 2-D table of y_entries rows of x
+entries, with x varying fastest, so f(x, y) is at row y, column x.
+
+Expressions are parsed with ast and only numbers, the variables x, y (the
+domain) and i, j (the entry index along x and y), arithmetic, comparisons
+and the NumPy functions in FUNCTIONS, called with exactly the arguments in
+ARITY, are allowed; anything else (attributes, subscripts, other names) is
+rejected before evaluation. Numbers are made
+np.float64, so arithmetic on constants alone (9**9**9**9) overflows to inf
+at once rather than running Python's unbounded integer arithmetic.
+
+Usage:
+    python function_tables.py "sqrt(x)" --range 0 255 --entries 256 --scale 16 --output sqrt.dat
+    python function_tables.py "x * y" --range 0 15 --entries 16 --y-range 0 15 --y-entries 16 --size 8
+    python function_tables.py --config table.cfg --output table.dat
+"""
+import argparse
+import ast
+import json
+import sys
+
+import numpy as np
+
+from trig_tables import TRIG_FUNCTIONS, build as build_trig
+
+FUNCTIONS = {
+    name: getattr(np, name) for name in (
+        'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh', 'hypot',
+        'deg2rad', 'rad2deg', 'sqrt', 'cbrt', 'square', 'exp', 'exp2', 'log', 'log2', 'log10', 'power',
+        'abs', 'sign', 'floor', 'ceil', 'rint', 'trunc', 'minimum', 'maximum', 'clip', 'where', 'mod',
+        'logical_and', 'logical_or', 'logical_not',
+    )
+}
+
+# Arguments each function takes; any more would be a ufunc's out= array, which
+# would overwrite the domain in place
+ARITY = {name: function.nin for name, function in FUNCTIONS.items() if isinstance(function, np.ufunc)}
+ARITY.update(clip=3, where=3)
+
+CONSTANTS = {'pi': np.pi, 'e': np.e}
+
+VARIABLES = ('x', 'y', 'i', 'j')
+
+# The generator's original functions, of x in degrees
+LEGACY_FUNCTIONS = {
+    'SIN': 'sin(deg2rad(x))',
+    'COS': 'cos(deg2rad(x))',
+}
+
+EXPRESSION = 'Expression'
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+              ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant) + _OPERATORS
+
+# Name numbers are wrapped in; not a valid name in an expression, so it cannot be called directly
+_FLOAT = '__float64__'
+
+
+class _FloatConstants(ast.NodeTransformer):
+    def visit_Constant(self, node):
+        try:
+            float(node.value)
+        except OverflowError:
+            raise ValueError(f"The number {node.value} is too large")
+        call = ast.Call(func=ast.Name(id=_FLOAT, ctx=ast.Load()), args=[node], keywords=[])
+        return ast.copy_location(call, node)
+
+
+def compile_expression(text):
+    """Check an expression against the whitelist and compile it."""
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression '{text}': {e.msg}")
+    names = set(FUNCTIONS) | set(CONSTANTS) | set(VARIABLES)
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES):
+            raise ValueError(f"'{type(node).__name__}' is not allowed in an expression")
+        if isinstance(node, ast.Name) and node.id not in names:
+            raise ValueError(f"Unknown name '{node.id}', expected one of {', '.join(VARIABLES)} "
+                             f"or {', '.join(sorted(set(FUNCTIONS) | set(CONSTANTS)))}")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS
+                                           or node.keywords):
+            raise ValueError("Only the listed functions can be called, with positional arguments")
+        if isinstance(node, ast.Call) and len(node.args) != ARITY[node.func.id]:
+            raise ValueError(f"{node.func.id}() takes {ARITY[node.func.id]} argument(s), got {len(node.args)}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"Only numbers are allowed as constants, got {node.value!r}")
+    tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+    return compile(tree, '<expression>', 'eval')
+
+
+def evaluate(text, x_range, entries, y_range=None, y_entries=None):
+    """
+    The expression's values over the domain: shape (entries,), or (y_entries, entries)
+    for a 2-D table. Returns (values, x, y), with y None for a 1-D table.
+    """
+    code = compile_expression(text)
+    x = np.linspace(x_range[0], x_range[1], entries)
+    namespace = dict(FUNCTIONS, **CONSTANTS)
+    namespace[_FLOAT] = np.float64
+    if y_entries:
+        y = np.linspace(y_range[0], y_range[1], y_entries)
+        shape = (y_entries, entries)
+        namespace.update(x=x[None, :], y=y[:, None], i=np.arange(entries)[None, :], j=np.arange(y_entries)[:, None])
+    else:
+        y = None
+        shape = (entries,)
+        namespace.update(x=x, y=np.zeros(1), i=np.arange(entries), j=np.zeros(1, dtype=int))
+    with np.errstate(all='ignore'):
+        values = eval(code, {'__builtins__': {}}, namespace)
+    # Constant expressions, or ones of y alone, still fill the table
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), shape), x, y
+
+
+def table_expression(config):
+    """The expression a config's function stands for."""
+    function = config.get('function', 'SIN')
+    if function == EXPRESSION:
+        return config['expression']
+    if function not in LEGACY_FUNCTIONS:
+        raise ValueError(f"Unknown function '{function}', expected one of "
+                         f"{', '.join(list(LEGACY_FUNCTIONS) + [EXPRESSION])}")
+    return LEGACY_FUNCTIONS[function]
+
+
+def is_2d(config):
+    return bool(str(config.get('y_entries', '')).strip())
+
+
+def generate(config):
+    """
+    The table a config describes, as rounded integers of the table's shape,
+    with its x and y domains. Settings may be strings, as the generator saves them.
+    """
+    entries = int(config['entries'])
+    if config.get('function') in TRIG_FUNCTIONS:
+        values = build_trig(TRIG_FUNCTIONS[config['function']], entries, float(config['scale']))
+        return values, np.arange(len(values)) * 360.0 / entries, None
+    y_range = y_entries = None
+    if is_2d(config):
+        y_range = (float(config['y_range_min']), float(config['y_range_max']))
+        y_entries = int(config['y_entries'])
+    values, x, y = evaluate(table_expression(config), (float(config['range_min']), float(config['range_max'])),
+                            entries, y_range, y_entries)
+    values = values * float(config['scale'])
+    bad = ~np.isfinite(values)
+    if bad.any():
+        position = np.unravel_index(np.argmax(bad), values.shape)
+        raise ValueError(f"The function is not finite at x = {x[position[-1]]:g}"
+                         + (f", y = {y[position[0]]:g}" if y is not None else ""))
+    return np.round(values).astype(np.int64), x, y
+
+
+def load_config(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a lookup table from an expression.")
+    parser.add_argument('expression', nargs='?', help="Expression of x (and y for a 2-D table)")
+    parser.add_argument('--config', help="Generator .cfg file to use instead of the other settings")
+    parser.add_argument('--range', type=float, nargs=2, default=(0.0, 360.0), metavar=('MIN', 'MAX'),
+                        help="Range of x (default 0 360)")
+    parser.add_argument('--entries', type=int, default=361, help="Entries along x (default 361)")
+    parser.add_argument('--y-range', type=float, nargs=2, metavar=('MIN', 'MAX'), help="Range of y for a 2-D table")
+    parser.add_argument('--y-entries', type=int, help="Entries along y for a 2-D table")
+    parser.add_argument('--scale', type=float, default=255.0, help="Scale applied before rounding (default 255)")
+    parser.add_argument('--size', type=int, choices=(8, 16, 32), default=16, help="Entry size in bits (default 16)")
+    parser.add_argument('--output', help="Write the table as big-endian binary")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config = load_config(args.config)
+    elif args.expression:
+        config = {'function': EXPRESSION, 'expression': args.expression, 'range_min': args.range[0],
+                  'range_max': args.range[1], 'entries': args.entries, 'scale': args.scale, 'size': args.size}
+        if args.y_entries:
+            y_range = args.y_range or args.range
+            config.update(y_range_min=y_range[0], y_range_max=y_range[1], y_entries=args.y_entries)
+    else:
+        parser.error("Give an expression or --config")
+
+    values, _, _ = generate(config)
+    name = config['function'] if config.get('function') in TRIG_FUNCTIONS else table_expression(config)
+    print(f"{name}: {values.size} entries {'x'.join(map(str, values.shape))}, "
+          f"values {values.min()}..{values.max()}")
+    if args.output:
+        dtype = np.dtype({8: '>i1' if values.min() < 0 else '>u1', 16: '>i2', 32: '>i4'}[int(config['size'])])
+        limits = np.iinfo(dtype)
+        with open(args.output, 'wb') as f:
+            f.write(values.clip(limits.min, limits.max).astype(dtype).tobytes())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
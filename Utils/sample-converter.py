@@ -5,15 +5,43 @@ import matplotlib
 matplotlib.use('TkAgg')
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-import wave
-from pydub import AudioSegment
 import numpy as np
 
+from sample_pipeline import read_info, pipeline, collect, write_wav
+from sample_pyramid import WaveformPyramid
+from sample_model import SampleModel
+from sample_loops import find_loops, render_loop
+import sample_codecs
+from sample_resampler import ATARI_RATES
+from sample_spectrum import analyze, format_report, spectrogram_image
+
+# Dither menu choices, as (dither, noise shaping) for the conversion pipeline
+DITHER_OPTIONS = {
+    "None": ('none', 'none'),
+    "TPDF": ('tpdf', 'none'),
+    "TPDF + Noise Shaping": ('tpdf', 'first'),
+}
+
+# Compressed save menu entries: codec name and file extension
+COMPRESSED_FORMATS = {
+    "4-bit Delta": ('delta', '.DL4'),
+    "4-bit Adaptive Delta": ('adaptive', '.AD4'),
+    "IMA ADPCM": ('ima', '.IMA'),
+}
+
+# Resize events arrive in bursts; the plot is redrawn once they stop for this long
+RESIZE_DELAY_MS = 100
+
+# Narrowest view, in samples, that the mouse wheel can zoom in to
+MIN_VIEW_SAMPLES = 32
+
 
 class SampleSettingsDialog(simpledialog.Dialog):
     def __init__(self, parent, title=None, initial_sample_rate=15650):
         self.sample_rate = initial_sample_rate
         self.signed = False  # Default to unsigned samples
+        self.offset = 0  # Byte offset of the samples in the file
+        self.length = None  # Number of samples, or None to read to the end of the file
         super().__init__(parent, title)
 
     def body(self, master):
@@ -28,14 +56,27 @@ class SampleSettingsDialog(simpledialog.Dialog):
         self.signed_radio_signed = tk.Radiobutton(master, text="Signed (-127 to 128)", variable=self.signed_var, value=True)
         self.signed_radio_signed.grid(row=1, column=1, sticky='w')
         self.signed_radio_unsigned.grid(row=2, column=1, sticky='w')
+
+        # Loading part of a file picks a sample out of a disk or memory dump
+        tk.Label(master, text="Start Offset (bytes):").grid(row=3, column=0, sticky='e')
+        self.offset_entry = tk.Entry(master)
+        self.offset_entry.insert(0, "0")
+        self.offset_entry.grid(row=3, column=1)
+        tk.Label(master, text="Length (blank for all):").grid(row=4, column=0, sticky='e')
+        self.length_entry = tk.Entry(master)
+        self.length_entry.grid(row=4, column=1)
         return self.sample_rate_entry
 
     def apply(self):
         try:
             self.sample_rate = int(self.sample_rate_entry.get())
             self.signed = self.signed_var.get()
+            # Offsets and lengths may be given in hex, as 0x...
+            self.offset = int(self.offset_entry.get() or "0", 0)
+            length = self.length_entry.get().strip()
+            self.length = int(length, 0) if length else None
         except ValueError:
-            messagebox.showerror("Invalid Input", "Please enter a valid integer for the sample rate.")
+            messagebox.showerror("Invalid Input", "Please enter valid integers for the sample rate, offset and length.")
             self.sample_rate = None
             self.signed = None
 
@@ -45,22 +86,49 @@ class AtariSTSoundViewer:
         self.root.title("Atari ST Sound Data Viewer")
         self.root.geometry("1600x800")
 
+        self.model = None  # SampleModel holding sample_data and the selected region
         self.sample_data = None
+        self.pyramid = None  # Min/max/RMS summary of sample_data, for drawing
+        self.view = (0, 0)  # Range of samples shown
         self.sample_rate = 15650  # default sample rate
         self.signed = False  # default to unsigned samples
 
         self.aggregation_method = tk.StringVar(value="Mean")  # Default aggregation method
+        self.dither_method = tk.StringVar(value="None")  # Dither applied when converting audio files
+        self.analyze_first = tk.BooleanVar(value=False)  # Show the spectrum report before choosing a rate
 
         self.create_widgets()
 
     def create_widgets(self):
         self.fig = Figure(figsize=(16,8), dpi=100)
         self.ax = self.fig.add_subplot(111)
+        self.ax.set_xlabel("Sample Number")
+        self.ax.set_ylabel("Amplitude")
+
+        # The waveform lines are animated: they are blitted over a cached background
+        # and updated with set_data, rather than clearing and replotting the axes
+        self.line, = self.ax.plot([], [], animated=True)
+        self.min_line, = self.ax.plot([], [], color=self.line.get_color(), animated=True)
+        self.background = None
+        self.drawn_limits = None
+        # Canvas size the layout was last fitted to
+        self.layout_size = None
+
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=1)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+        # Mouse wheel zooms around the pointer, dragging pans
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_press)
+        self.canvas.mpl_connect('motion_notify_event', self.on_drag)
+        self.canvas.mpl_connect('button_release_event', self.on_release)
+        self.drag_start = None
+        self.selection_patch = None
 
-        # Bind resize event
-        self.canvas.get_tk_widget().bind("<Configure>", self.on_resize)
+        # Bind resize event, keeping the canvas's own resize handler
+        self.resize_job = None
+        self.canvas.get_tk_widget().bind("<Configure>", self.on_resize, add="+")
 
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
@@ -71,12 +139,30 @@ class AtariSTSoundViewer:
         fileMenu.add_command(label="Save as WAV", command=self.save_as_wav)
         fileMenu.add_separator()
         fileMenu.add_command(label="Load WAV File", command=self.load_wav_file)
+        fileMenu.add_command(label="Analyze Audio File...", command=self.analyze_audio_file)
         fileMenu.add_command(label="Save as Raw Atari ST", command=self.save_as_raw)
+        compressedMenu = tk.Menu(fileMenu)
+        fileMenu.add_cascade(label="Save Compressed", menu=compressedMenu)
+        for label, (codec, extension) in COMPRESSED_FORMATS.items():
+            compressedMenu.add_command(label=label + "...",
+                                       command=lambda codec=codec, extension=extension: self.save_compressed(codec, extension))
+        fileMenu.add_command(label="Load Compressed Sample", command=self.load_compressed)
         fileMenu.add_separator()
         fileMenu.add_command(label="Convert Sample Signedness", command=self.convert_sample_signedness)
         fileMenu.add_separator()
         fileMenu.add_command(label="Exit", command=self.root.quit)
 
+        # Saving writes the selected region, or the whole sample if nothing is selected
+        editMenu = tk.Menu(menubar)
+        menubar.add_cascade(label="Edit", menu=editMenu)
+        editMenu.add_command(label="Select Visible Region", command=self.select_visible_region)
+        editMenu.add_command(label="Select Region...", command=self.select_region)
+        editMenu.add_command(label="Clear Selection", command=self.clear_selection)
+        editMenu.add_separator()
+        editMenu.add_command(label="Crop to Selection", command=self.crop_to_selection)
+        editMenu.add_separator()
+        editMenu.add_command(label="Find Loop Points...", command=self.find_loop_points)
+
         optionsMenu = tk.Menu(menubar)
         menubar.add_cascade(label="Options", menu=optionsMenu)
 
@@ -85,10 +171,163 @@ class AtariSTSoundViewer:
         optionsMenu.add_radiobutton(label="Max", variable=self.aggregation_method, command=self.update_plot)
         optionsMenu.add_radiobutton(label="RMS", variable=self.aggregation_method, command=self.update_plot)
         optionsMenu.add_radiobutton(label="Absolute Mean", variable=self.aggregation_method, command=self.update_plot)
+        optionsMenu.add_radiobutton(label="Min/Max", variable=self.aggregation_method, command=self.update_plot)
+        optionsMenu.add_separator()
+        optionsMenu.add_command(label="Show Whole Sample", command=self.show_whole_sample)
+
+        # Dither submenu
+        ditherMenu = tk.Menu(optionsMenu)
+        optionsMenu.add_separator()
+        optionsMenu.add_cascade(label="Dither", menu=ditherMenu)
+        for label in DITHER_OPTIONS:
+            ditherMenu.add_radiobutton(label=label, variable=self.dither_method)
+        optionsMenu.add_checkbutton(label="Analyze Before Converting", variable=self.analyze_first)
 
     def on_resize(self, event):
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_DELAY_MS, self.update_plot)
+
+    def set_model(self, model):
+        """Replace the sample data, summarise it for drawing and show all of it."""
+        self.model = model
+        self.sample_data = model.data
+        self.pyramid = WaveformPyramid(model.data)
+        self.view = (0, len(model.data))
+        self.show_selection()
+
+    def show_selection(self):
+        if self.selection_patch is not None:
+            self.selection_patch.remove()
+            self.selection_patch = None
+        if self.model is not None and self.model.selection is not None:
+            self.selection_patch = self.ax.axvspan(*self.model.selection, color='orange', alpha=0.2)
+        # The selection is part of the background, so the axes have to be redrawn
+        self.drawn_limits = None
+        self.update_plot()
+
+    def select_visible_region(self):
+        if self.model is not None:
+            self.model.select(*self.view)
+            self.show_selection()
+
+    def select_region(self):
+        if self.model is None:
+            messagebox.showwarning("Warning", "No sample data to select from.")
+            return
+        start, stop = self.model.region
+        start = simpledialog.askinteger("Select Region", "First sample:", initialvalue=start,
+                                        minvalue=0, maxvalue=len(self.model))
+        if start is None:
+            return
+        stop = simpledialog.askinteger("Select Region", "End sample (exclusive):", initialvalue=stop,
+                                       minvalue=start, maxvalue=len(self.model))
+        if stop is None:
+            return
+        self.model.select(start, stop)
+        self.show_selection()
+
+    def clear_selection(self):
+        if self.model is not None:
+            self.model.clear_selection()
+            self.show_selection()
+
+    def crop_to_selection(self):
+        if self.model is None or self.model.selection is None:
+            messagebox.showwarning("Warning", "No region selected.")
+            return
+        self.model.crop()
+        self.set_model(self.model)
+
+    def find_loop_points(self):
+        """
+        Search the selection for loops, with the start in its first half and the
+        end in its second, and list the candidates. Choosing one selects the loop.
+        """
+        if self.model is None or self.model.selection is None:
+            messagebox.showwarning("Warning", "Select the region to search for loop points first.")
+            return
+        start, stop = self.model.selection
+        middle = (start + stop) // 2
+        try:
+            candidates = find_loops(self.model.data, (start, middle), (middle, stop))
+        except ValueError as e:
+            messagebox.showerror("Error", f"Failed to find loop points:\n{e}")
+            return
+        if not candidates:
+            messagebox.showinfo("Loop Points", "No loop points found in the selection.")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Loop Points")
+        listbox = tk.Listbox(window, width=60, font="TkFixedFont")
+        listbox.pack(fill=tk.BOTH, expand=1)
+        listbox.insert(tk.END, f"{'Start':>8} {'End':>8} {'Length':>7} {'Score':>7} {'Click':>7}")
+        for candidate in candidates:
+            listbox.insert(tk.END, f"{candidate.start:>8} {candidate.end:>8} {candidate.end - candidate.start:>7} "
+                                   f"{candidate.score:>7.4f} {candidate.click:>7.4f}")
+
+        def chosen():
+            selection = listbox.curselection()
+            if not selection or selection[0] == 0:
+                return None
+            return candidates[selection[0] - 1]
+
+        def on_select(event):
+            candidate = chosen()
+            if candidate:
+                self.model.select(candidate.start, candidate.end)
+                self.show_selection()
+
+        def save_preview():
+            candidate = chosen()
+            if candidate is None:
+                messagebox.showwarning("Warning", "Choose a loop to preview.", parent=window)
+                return
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension=".wav",
+                                                     filetypes=[("WAV Files", "*.wav")])
+            if file_path:
+                preview = render_loop(self.model.data, candidate.start, candidate.end)
+                write_wav([preview], file_path, self.sample_rate, self.model.signed)
+
+        listbox.bind("<<ListboxSelect>>", on_select)
+        tk.Button(window, text="Save Loop Preview...", command=save_preview).pack()
+
+    def show_whole_sample(self):
+        if self.sample_data is not None:
+            self.set_view(0, len(self.sample_data))
+
+    def set_view(self, start, stop):
+        length = len(self.sample_data)
+        width = min(length, max(MIN_VIEW_SAMPLES, stop - start))
+        start = min(max(0, start), length - width)
+        self.view = (int(start), int(start + width))
         self.update_plot()
 
+    def on_scroll(self, event):
+        if self.sample_data is None or event.xdata is None:
+            return
+        start, stop = self.view
+        zoom = 0.8 if event.button == 'up' else 1.25
+        # Keep the sample under the pointer where it is
+        new_start = event.xdata - (event.xdata - start) * zoom
+        self.set_view(new_start, new_start + (stop - start) * zoom)
+
+    def on_press(self, event):
+        if self.sample_data is not None and event.inaxes == self.ax and event.button == 1:
+            self.drag_start = (event.x, self.view)
+
+    def on_drag(self, event):
+        if self.drag_start is None:
+            return
+        x, (start, stop) = self.drag_start
+        samples_per_pixel = (stop - start) / max(1, self.ax.bbox.width)
+        offset = (x - event.x) * samples_per_pixel
+        self.set_view(start + offset, stop + offset)
+
+    def on_release(self, event):
+        self.drag_start = None
+
     def load_raw_sample_data(self):
         file_path = filedialog.askopenfilename()
         if file_path:
@@ -101,18 +340,11 @@ class AtariSTSoundViewer:
                 else:
                     return  # User cancelled or input was invalid
 
-                # Read the data
-                with open(file_path, 'rb') as f:
-                    raw_data = f.read()
-                # Decide on signed or unsigned
-                if self.signed:
-                    dtype = np.int8
-                else:
-                    dtype = np.uint8
-                self.sample_data = np.frombuffer(raw_data, dtype=dtype)
+                # Map the file rather than reading it, so large dumps load instantly
+                model = SampleModel.open(file_path, self.sample_rate, self.signed, dialog.offset, dialog.length)
 
                 # Update plot
-                self.update_plot()
+                self.set_model(model)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load file:\n{e}")
 
@@ -120,8 +352,11 @@ class AtariSTSoundViewer:
         file_path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav;*.mp3;*.flac")])
         if file_path:
             try:
-                # Load audio file using pydub
-                audio : AudioSegment = AudioSegment.from_file(file_path)
+                # Only the header is read here; the audio is streamed through the pipeline below
+                info = read_info(file_path)
+                if self.analyze_first.get():
+                    # Left open beside the rate prompt, to choose the rate from
+                    self.show_analysis(file_path)
                 
                 # Ask for target sample rate
                 sr = simpledialog.askinteger("Sample Rate", "Enter target sample rate (Hz):", initialvalue=15650)
@@ -130,54 +365,64 @@ class AtariSTSoundViewer:
                 else:
                     self.sample_rate = 15650  # default
 
-                # Resample audio
-                if audio.frame_rate != self.sample_rate:
-                    audio = audio.set_frame_rate(self.sample_rate)
-
                 # Check if audio is stereo and needs to be converted to mono
-                if audio.channels > 1:
+                mono = 'mix'
+                if info.channels > 1:
                     # Ask the user if they want to mix down to mono
                     mix_to_mono = messagebox.askyesno("Stereo Audio Detected", "The audio file is stereo. Do you want to mix it down to mono?")
-                    if mix_to_mono:
-                        audio = audio.set_channels(1)  # Mix down to mono
-                    else:
-                        audio = audio.split_to_mono()[0]  # Use the first channel
+                    mono = 'mix' if mix_to_mono else 'first'  # Otherwise use the first channel
 
                 # Ask for signedness
                 signed_answer = messagebox.askyesno("Sample Signedness", "Treat samples as signed?")
                 self.signed = signed_answer
 
-                # Export audio to raw data
-                raw_data = audio.raw_data
-                sample_width = audio.sample_width
-
-                # Convert raw data to numpy array
-                data = np.frombuffer(raw_data, dtype=f'int{sample_width * 8}')
-
-                # Since we have ensured audio is mono, no need to handle multiple channels here
-
-                # Normalize data to -1.0 to 1.0
-                max_val = float(2 ** (8 * sample_width - 1))
-                data = data / max_val
-
-                # Scale to 8-bit range
-                data = data * 127  # Scale to -127 to 127
-
-                if not self.signed:
-                    data = data + 128  # Shift to 0 to 255
-
-                # Clip and convert to integers
-                if self.signed:
-                    self.sample_data = np.clip(data, -128, 127).astype(np.int8)
-                else:
-                    self.sample_data = np.clip(data, 0, 255).astype(np.uint8)
+                # Decode, mix down, resample, scale to 8-bit and quantize block by block,
+                # so only the 8-bit result is ever held in memory
+                dither, shaping = DITHER_OPTIONS[self.dither_method.get()]
+                sample_data = collect(pipeline(file_path, self.sample_rate, self.signed, mono,
+                                               dither=dither, shaping=shaping))
 
                 # Update plot
-                self.update_plot()
+                self.set_model(SampleModel(sample_data, self.sample_rate, self.signed, file_path))
 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load audio file:\n{e}")
 
+    def analyze_audio_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav;*.mp3;*.flac")])
+        if file_path:
+            try:
+                self.show_analysis(file_path)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to analyze audio file:\n{e}")
+
+    def show_analysis(self, file_path):
+        """Open a window with the spectrum and level report and a spectrogram of an audio file."""
+        analysis = analyze(file_path)
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Analysis of {file_path}")
+        report = tk.Text(window, height=13, width=90, font="TkFixedFont")
+        report.insert(tk.END, "\n".join(format_report(analysis)))
+        report.config(state=tk.DISABLED)
+        report.pack(fill=tk.X)
+
+        fig = Figure(figsize=(10, 4), dpi=100)
+        ax = fig.add_subplot(111)
+        image, extent = spectrogram_image(analysis, columns=1000)
+        ax.imshow(image, origin='lower', aspect='auto', extent=extent, cmap='magma', vmin=image.max() - 90)
+        # Each ST/STE rate's Nyquist frequency; content above it is filtered out
+        for rate in ATARI_RATES:
+            if rate / 2 < extent[3]:
+                ax.axhline(rate / 2, color='cyan', linewidth=0.5)
+                ax.text(extent[1], rate / 2, f" {rate}", color='cyan', fontsize=8, va='bottom', ha='right')
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Frequency (Hz)")
+        fig.tight_layout()
+        canvas = FigureCanvasTkAgg(fig, master=window)
+        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=1)
+        canvas.draw()
+
     def save_as_wav(self):
         if self.sample_data is None:
             messagebox.showwarning("Warning", "No sample data to save.")
@@ -185,16 +430,9 @@ class AtariSTSoundViewer:
         file_path = filedialog.asksaveasfilename(defaultextension=".wav", filetypes=[("WAV Files", "*.wav")])
         if file_path:
             try:
-                with wave.open(file_path, 'wb') as wav_file:
-                    wav_file.setnchannels(1)
-                    wav_file.setsampwidth(1)  # 8-bit samples
-                    wav_file.setframerate(self.sample_rate)
-                    if self.signed:
-                        # Convert signed int8 data to unsigned uint8 by adding 128
-                        data = (self.sample_data.astype(np.int16) + 128).astype(np.uint8).tobytes()
-                    else:
-                        data = self.sample_data.astype(np.uint8).tobytes()
-                    wav_file.writeframes(data)
+                # Written a chunk at a time, converting signed samples to unsigned for WAV
+                self.model.sample_rate = self.sample_rate
+                self.model.save_wav(file_path)
                 messagebox.showinfo("Success", "WAV file saved successfully.")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save WAV file:\n{e}")
@@ -207,16 +445,43 @@ class AtariSTSoundViewer:
         file_path = filedialog.asksaveasfilename(defaultextension=".SAM", filetypes=[("Atari ST Raw Files", "*.SAM;*.SPL")])
         if file_path:
             try:
-                with open(file_path, 'wb') as f:
-                    if self.signed:
-                        data = self.sample_data.astype(np.int8).tobytes()
-                    else:
-                        data = self.sample_data.astype(np.uint8).tobytes()
-                    f.write(data)
+                self.model.save_raw(file_path)
                 messagebox.showinfo("Success", "Raw sample data saved successfully.")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save raw data:\n{e}")
 
+    def save_compressed(self, codec, extension):
+        if self.sample_data is None:
+            messagebox.showwarning("Warning", "No sample data to save.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=extension,
+                                                 filetypes=[("Compressed Samples", "*" + extension)])
+        if file_path:
+            try:
+                # The codecs work on signed samples
+                samples = self.model.selected()
+                if not self.model.signed:
+                    samples = (samples.view(np.uint8) ^ 0x80).view(np.int8)
+                result = sample_codecs.encode(samples, codec)
+                with open(file_path, 'wb') as f:
+                    f.write(result.data)
+                messagebox.showinfo("Success", f"Compressed sample saved: {len(result.data)} bytes, "
+                                               f"SNR {result.snr_db:.1f} dB.")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save compressed sample:\n{e}")
+
+    def load_compressed(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Compressed Samples", "*.DL4;*.AD4;*.IMA")])
+        if file_path:
+            try:
+                with open(file_path, 'rb') as f:
+                    sample_data = sample_codecs.decode(f.read())
+                # Decoded samples are signed; show them as the ST would play them
+                self.signed = True
+                self.set_model(SampleModel(sample_data, self.sample_rate, True, file_path))
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to load compressed sample:\n{e}")
+
     def convert_sample_signedness(self):
         if self.sample_data is None:
             messagebox.showwarning("Warning", "No sample data to convert.")
@@ -230,17 +495,15 @@ class AtariSTSoundViewer:
             return
         
         try:
-            if self.signed:
-                # Convert from signed to unsigned
-                self.sample_data = (self.sample_data.astype(np.int16) + 128).astype(np.uint8)
-                self.signed = False
-            else:
-                # Convert from unsigned to signed
-                self.sample_data = (self.sample_data.astype(np.int16) - 128).astype(np.int8)
-                self.signed = True
+            # Flips the top bit of each sample in place, a chunk at a time. Mapped files
+            # are copy-on-write, so the file on disk is left as it was.
+            self.model.convert_signedness()
+            self.signed = self.model.signed
             
-            # Update the plot
-            self.update_plot()
+            # Update the plot, keeping the current zoom
+            view = self.view
+            self.set_model(self.model)
+            self.set_view(*view)
             
             # Notify the user
             messagebox.showinfo("Conversion Complete", "Sample signedness has been converted.")
@@ -248,56 +511,66 @@ class AtariSTSoundViewer:
             messagebox.showerror("Error", f"Failed to convert sample signedness:\n{e}")
 
     def update_plot(self):
-        if self.sample_data is None:
+        """
+        Draw the current view from the pyramid, one point per pixel. When the axis
+        limits have not changed (a change of aggregation, say) only the lines are
+        redrawn, by blitting them over the cached background. Panning and zooming
+        change the limits, so they redraw the axes once and the background is
+        recached in on_draw; the layout is only refitted when the canvas is resized.
+        """
+        self.resize_job = None
+        if self.pyramid is None:
             return
 
-        self.ax.clear()
-
         # Get the width of the canvas in pixels
         canvas_width = self.canvas.get_tk_widget().winfo_width()
         if canvas_width <= 1:
             canvas_width = 800
 
-        data_length = len(self.sample_data)
-
-        if data_length > canvas_width:
-            # Number of samples per bin
-            bin_size = max(1, data_length // canvas_width)
-            # Recalculate the number of bins
-            num_bins = data_length // bin_size
-            # Ensure we have at least one bin
-            if num_bins == 0:
-                num_bins = 1
-                bin_size = data_length
-            # Trim the data to fit into an exact multiple of bin_size
-            trimmed_length = bin_size * num_bins
-            trimmed_data = self.sample_data[:trimmed_length]
-            # Reshape and aggregate
-            reshaped_data = trimmed_data.reshape((num_bins, bin_size))
-            # Choose aggregation method
-            method = self.aggregation_method.get()
-            if method == "Mean":
-                aggregated_data = reshaped_data.mean(axis=1)
-            elif method == "Max":
-                aggregated_data = reshaped_data.max(axis=1)
-            elif method == "RMS":
-                aggregated_data = np.sqrt(np.mean(reshaped_data.astype(np.float64) ** 2, axis=1))
-            elif method == "Absolute Mean":
-                aggregated_data = np.mean(np.abs(reshaped_data), axis=1)
-            else:
-                aggregated_data = reshaped_data.mean(axis=1)  # Default to mean
+        start, stop = self.view
+        envelope = self.pyramid.window(start, stop, canvas_width)
+
+        # Choose aggregation method
+        method = self.aggregation_method.get()
+        if method == "Min/Max":
+            self.line.set_data(envelope.x, envelope.maximum)
+            self.min_line.set_data(envelope.x, envelope.minimum)
         else:
-            # No need to downsample
-            aggregated_data = self.sample_data
+            aggregated_data = {
+                "Mean": envelope.mean,
+                "Max": envelope.maximum,
+                "RMS": envelope.rms,
+                "Absolute Mean": envelope.mean_abs,
+            }.get(method, envelope.mean)  # Default to mean
+            self.line.set_data(envelope.x, aggregated_data)
+            self.min_line.set_data([], [])
+
+        low, high = self.pyramid.limits
+        limits = (start, stop, low, high, canvas_width)
+        if self.background is not None and limits == self.drawn_limits:
+            self.blit_lines()
+            return
 
-        # Plot the aggregated data
-        self.ax.plot(aggregated_data)
-        self.ax.set_xlim(0, len(aggregated_data))
-        self.ax.set_ylim(np.min(self.sample_data), np.max(self.sample_data))
-        self.ax.set_xlabel("Sample Number")
-        self.ax.set_ylabel("Amplitude")
-        self.fig.tight_layout()
-        self.canvas.draw()
+        self.ax.set_xlim(start, max(stop, start + 1))
+        self.ax.set_ylim(low, high if high > low else low + 1)
+        size = (canvas_width, self.canvas.get_tk_widget().winfo_height())
+        if size != self.layout_size:
+            self.fig.tight_layout()
+            self.layout_size = size
+        self.drawn_limits = limits
+        self.canvas.draw_idle()
+
+    def on_draw(self, event):
+        # Everything but the animated lines has just been drawn; keep it for blitting
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+        self.ax.draw_artist(self.min_line)
+
+    def blit_lines(self):
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.line)
+        self.ax.draw_artist(self.min_line)
+        self.canvas.blit(self.ax.bbox)
 
 if __name__ == "__main__":
     root = tk.Tk()
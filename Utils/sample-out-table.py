@@ -1,38 +1,22 @@
 import tkinter as tk
-from tkinter import filedialog, ttk
-import struct
-import matplotlib.pyplot as plt
+from tkinter import filedialog, ttk, messagebox, simpledialog
+from matplotlib import colormaps
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 import numpy as np
 
-# Mapping of register numbers to descriptions
-REGISTER_DESCRIPTIONS = {
-    0: 'Channel A Fine Tune',
-    1: 'Channel A Coarse Tune',
-    2: 'Channel B Fine Tune',
-    3: 'Channel B Coarse Tune',
-    4: 'Channel C Fine Tune',
-    5: 'Channel C Coarse Tune',
-    6: 'Noise Period',
-    7: 'Mixer Control',
-    8: 'Channel A Volume',
-    9: 'Channel B Volume',
-    10: 'Channel C Volume',
-    11: 'Envelope Period Fine',
-    12: 'Envelope Period Coarse',
-    13: 'Envelope Shape/Cycle',
-    14: 'I/O Port A',
-    15: 'I/O Port B',
-}
+from ym_table import ENTRIES, REGISTER_DESCRIPTIONS, YM_REGISTERS, YmSampleTable
+from ym_volume import optimize_table, report, table_outputs
+from ym_render import render_file
+from ym_family import optimized_family, pack_family, remapped_family
 
 class SampleTableViewer(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Sample Table Viewer")
         self.geometry("1200x750")
-        self.entries = []
-        self.original_entries = []
-        self.register_values = []
+        self.table = None
+        self.original_table = None
         self.num_channels = 2  # Default to 2 channels
         self.create_widgets()
 
@@ -52,6 +36,7 @@ class SampleTableViewer(tk.Tk):
         # Create a frame for the graph
         self.graph_frame = tk.Frame(self)
         self.graph_frame.pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True)
+        self.create_graph()
 
         # Create control frame
         self.control_frame = tk.Frame(self)
@@ -73,11 +58,19 @@ class SampleTableViewer(tk.Tk):
         filemenu.add_command(label="Load 3-Channel Table", command=lambda: self.load_sample_table(3))
         filemenu.add_separator()
         
+        # Generate from the YM volume model
+        filemenu.add_command(label="Generate 2-Channel Table", command=lambda: self.generate_sample_table(2))
+        filemenu.add_command(label="Generate 3-Channel Table", command=lambda: self.generate_sample_table(3))
+        filemenu.add_separator()
+
         # Save options
         filemenu.add_command(label="Save Sample Table", command=self.save_sample_table_as_binary)
+        filemenu.add_command(label="Export Scaled Family...", command=self.export_scaled_family)
         filemenu.add_separator()
         filemenu.add_command(label="Load from Text", command=self.load_sample_table_from_text)
         filemenu.add_command(label="Save as Text", command=self.save_sample_table_as_text)
+        filemenu.add_separator()
+        filemenu.add_command(label="Render Sample Through Table...", command=self.render_sample)
         menubar.add_cascade(label="File", menu=filemenu)
         self.config(menu=menubar)
 
@@ -115,49 +108,103 @@ class SampleTableViewer(tk.Tk):
             self.populate_table()
             self.plot_graph()
 
-            # Keep a copy of the original entries
-            self.original_entries = self.entries.copy()
+            # Keep the original entries for scaling
+            self.original_table = self.table
+
+    def generate_sample_table(self, num_channels):
+        metric = "max" if messagebox.askyesno("Error Metric", "Minimize the largest error rather than the RMS error?") else "rms"
+        monotonic = messagebox.askyesno("Monotonic", "Keep the output rising with the sample value?")
+        gain = simpledialog.askfloat("Gain", "Share of full output for the loudest sample (0 to 1):",
+                                     initialvalue=1.0, minvalue=0.01, maxvalue=1.0)
+        if gain is None:
+            return
+
+        self.num_channels = num_channels
+        self.table, outputs = optimize_table(num_channels, metric, monotonic, gain)
+        self.original_table = self.table
+
+        self.create_table_columns()
+        self.populate_table()
+        self.plot_graph()
+
+        result = report(outputs, gain)
+        messagebox.showinfo("Generated Table",
+                            f"Max error {result.max_error:.2f}, RMS error {result.rms_error:.2f} (8-bit steps)\n"
+                            f"{'Monotonic' if result.monotonic else f'{result.inversions} inversions'}, "
+                            f"{result.distinct} distinct levels")
+
+    def render_sample(self):
+        if self.table is None:
+            messagebox.showwarning("Warning", "Load or generate a table first.")
+            return
+        sample_path = filedialog.askopenfilename(title="Select Sample to Render",
+                                                 filetypes=[("Atari ST Raw Files", "*.SAM;*.SPL")])
+        if not sample_path:
+            return
+        rate = simpledialog.askinteger("Replay Rate", "Replay rate (Hz):", initialvalue=12517, minvalue=1)
+        if rate is None:
+            return
+        signed = messagebox.askyesno("Sample Signedness", "Is the sample signed?")
+        output_path = filedialog.asksaveasfilename(title="Save Rendering", defaultextension=".wav",
+                                                   filetypes=[("WAV Files", "*.wav")])
+        if not output_path:
+            return
+        try:
+            # The ideal output is written beside the rendering for A/B comparison
+            ideal_path = output_path[:-4] + "-ideal.wav" if output_path.lower().endswith(".wav") else output_path + "-ideal.wav"
+            result = render_file(sample_path, self.table, output_path, rate, signed, ideal_path)
+            messagebox.showinfo("Rendered",
+                                f"SNR {result.snr_db:.1f} dB against the ideal output\n"
+                                f"RMS error {result.rms_error:.2f}, max error {result.max_error:.2f} (8-bit steps)\n"
+                                f"Ideal output saved as {ideal_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to render sample:\n{e}")
 
     def save_sample_table_as_binary(self):
         file_path = filedialog.asksaveasfilename(
             defaultextension=".TAB",
             filetypes=[("Binary Files", "*.TAB;*.DAT;*.BIN")]
         )
-        if file_path:
+        if file_path and self.table is not None:
+            # Register and value bytes per channel; 3-channel tables are padded to 4
+            self.table.save(file_path)
+
+    def export_scaled_family(self):
+        if self.original_table is None:
+            messagebox.showwarning("Warning", "Load or generate a table first.")
+            return
+        count = simpledialog.askinteger("Scaled Family", "Number of volumes (e.g. 16 or 32):",
+                                        initialvalue=16, minvalue=2, maxvalue=256)
+        if count is None:
+            return
+        optimize = messagebox.askyesno("Scaled Family", "Re-optimize each volume rather than remapping entries?")
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".BIN",
+            filetypes=[("Binary Files", "*.BIN;*.DAT")]
+        )
+        if not file_path:
+            return
+        try:
+            if optimize:
+                gain = float(table_outputs(self.original_table).max())
+                writes, _ = optimized_family(count, self.num_channels, gain=gain)
+            else:
+                writes = remapped_family(self.original_table, count)
+            data, index = pack_family(writes)
             with open(file_path, 'wb') as f:
-                for entry in self.entries:
-                    # Write each channel's data
-                    for i in range(self.num_channels if self.num_channels == 2 else 4):
-                        if i < self.num_channels or (self.num_channels == 3 and i < 3):
-                            reg_num = entry[f'reg{i+1}_num']
-                            reg_val = entry[f'reg{i+1}_val']
-                            f.write(struct.pack('>BB', reg_num, reg_val))
-                        else:
-                            # Write padding bytes for 3-channel format
-                            f.write(struct.pack('>BB', 0, 0))
+                f.write(data)
+            messagebox.showinfo("Scaled Family", f"{count} tables, {len(data)} bytes with a {index} offset index")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export family:\n{e}")
 
     def save_sample_table_as_text(self):
         file_path = filedialog.asksaveasfilename(
             defaultextension=".txt",
             filetypes=[("Text Files", "*.txt")]
         )
-        if file_path:
+        if file_path and self.table is not None:
             with open(file_path, 'w') as f:
-                # Write header
-                header = ['index']
-                for i in range(self.num_channels):
-                    header.extend([f'reg{i+1}', f'val{i+1}'])
-                f.write(','.join(header) + '\n')
-                
-                # Write data
-                for entry in self.entries:
-                    values = [str(entry['index'])]
-                    for i in range(self.num_channels):
-                        values.extend([
-                            str(entry[f'reg{i+1}_num']),
-                            f"{entry[f'reg{i+1}_val']:02X}"
-                        ])
-                    f.write(','.join(values) + '\n')
+                f.write(self.table.to_text())
 
     def load_sample_table_from_text(self):
         file_path = filedialog.askopenfilename(
@@ -166,83 +213,17 @@ class SampleTableViewer(tk.Tk):
         )
         if file_path:
             with open(file_path, 'r') as f:
-                lines = f.readlines()
-                
-            header = lines[0].strip().split(',')
-            self.num_channels = (len(header) - 1) // 2  # Subtract 1 for index column, divide by 2 for reg/val pairs
+                self.table = YmSampleTable.from_text(f.read())
+            self.num_channels = self.table.channels
             
             self.create_table_columns()
-            self.entries = []
-            
-            for line in lines[1:]:  # Skip header
-                parts = line.strip().split(',')
-                if len(parts) == (self.num_channels * 2) + 1:
-                    entry = {'index': int(parts[0])}
-                    for i in range(self.num_channels):
-                        reg_num = int(parts[i*2 + 1])
-                        reg_val = int(parts[i*2 + 2], 16)
-                        entry[f'reg{i+1}_num'] = reg_num
-                        entry[f'reg{i+1}_val'] = reg_val
-                        entry[f'raw_bytes{i+1}'] = f'{reg_num:02X}{reg_val:02X}'
-                    self.entries.append(entry)
-            
-            self.original_entries = self.entries.copy()
+            self.original_table = self.table
             self.populate_table()
             self.plot_graph()
 
     def parse_sample_table(self, data, num_channels):
-        self.entries.clear()
-        num_entries = 256
-        bytes_per_entry = len(data) // num_entries
-        bytes_per_channel = 4 if bytes_per_entry == num_channels * 4 else 2 if bytes_per_entry > num_channels else 1
-        self.register_values = [{} for _ in range(num_entries)]
-
-        for i in range(num_entries):
-            offset = i * bytes_per_entry
-            entry = data[offset:offset + bytes_per_entry]
-            if len(entry) < bytes_per_entry:
-                break
-
-            entry_dict = {'index': i}
-
-            for j in range(num_channels):
-                if bytes_per_channel == 4:
-                    # Each channel has 4 bytes: register (8 bits) and value (8 bits)
-                    channel_data = struct.unpack('>HH', entry[j*4:(j+1)*4])
-                    reg_num = (channel_data[0] >> 8) & 0x0F     # Lower 4 bits for register number
-                    reg_val = (channel_data[1] >> 8)            # 8 bits for value
-                    
-                    entry_dict[f'reg{j+1}_num'] = reg_num
-                    entry_dict[f'reg{j+1}_val'] = reg_val
-                    entry_dict[f'raw_bytes{j+1}'] = f'{channel_data[0]:04X}{channel_data[1]:04X}'
-                    
-                    # Store register values
-                    self.register_values[i][reg_num] = reg_val
-                elif bytes_per_channel == 2:
-                    # Each channel has 2 bytes: register (8 bits) and value (8 bits)
-                    channel_data = struct.unpack('>BB', entry[j*2:(j+1)*2])
-                    reg_num = channel_data[0] & 0x0F  # Lower 4 bits for register number
-                    reg_val = channel_data[1]  # 8 bits for value
-                    
-                    entry_dict[f'reg{j+1}_num'] = reg_num
-                    entry_dict[f'reg{j+1}_val'] = reg_val
-                    entry_dict[f'raw_bytes{j+1}'] = f'{channel_data[0]:02X}{channel_data[1]:02X}'
-                    
-                    # Store register values
-                    self.register_values[i][reg_num] = reg_val
-                else:
-                    # Each channel just has a value, register numbers are implicit (let's say 8 and 9)
-                    channel_data = struct.unpack('>B', entry[j:j+1])
-                    reg_num = 8 + j
-                    reg_val = channel_data[0]
-                    entry_dict[f'reg{j+1}_num'] = reg_num
-                    entry_dict[f'reg{j+1}_val'] = reg_val
-                    entry_dict[f'raw_bytes{j+1}'] = f'{reg_val:02X}'
-
-                    # Store register values
-                    self.register_values[i][reg_num] = reg_val
-
-            self.entries.append(entry_dict)
+        # The layout (1, 2 or 4 bytes per channel) is detected from the size of the data
+        self.table = YmSampleTable.from_bytes(data, num_channels)
 
     def populate_table(self):
         # Clear existing data
@@ -250,72 +231,70 @@ class SampleTableViewer(tk.Tk):
             self.tree.delete(item)
 
         # Insert new data
-        for entry in self.entries:
-            values = [entry['index']]
-            for i in range(self.num_channels):
+        for index, row in enumerate(self.table.writes.tolist()):
+            values = [index]
+            for reg_num, reg_val in row:
                 values.extend([
-                    f"{entry[f'reg{i+1}_num']} ({REGISTER_DESCRIPTIONS.get(entry[f'reg{i+1}_num'], 'Unknown')})",
-                    f"{entry[f'reg{i+1}_val']:02X}"
+                    f"{reg_num} ({REGISTER_DESCRIPTIONS.get(reg_num, 'Unknown')})",
+                    f"{reg_val:02X}"
                 ])
             self.tree.insert('', tk.END, values=values)
 
     def apply_scale(self):
+        if self.original_table is None:
+            return
         try:
             scale_factor = float(self.scale_entry.get())
             self.scale_volume(scale_factor)
 
-            self.rebuild_sample_table()
             self.populate_table()
             self.plot_graph()
 
         except ValueError:
-            tk.messagebox.showerror("Error", "Invalid scale factor (must be between 0 and 1)")
+            messagebox.showerror("Error", "Invalid scale factor (must be between 0 and 1)")
 
     def scale_volume(self, scale_factor):
-        if scale_factor <= 0 or scale_factor > 1:
-            raise ValueError("Scale factor must be between 0 and 1")
-        
-        # Clear scaled entries and calculate new indices based on scale factor
-        scaled_entries = []
-        num_entries = len(self.original_entries)
-
-        for i in range(num_entries):
-            scaled_index = int(i * scale_factor)
-            if scaled_index < num_entries:
-                scaled_entries.append(self.original_entries[scaled_index])
+        # Entry i plays what entry int(i * scale_factor) of the original table did
+        self.table = self.original_table.scaled(scale_factor)
+
+    def create_graph(self):
+        # One figure and one line per register, updated in place by plot_graph
+        self.fig = Figure(figsize=(10, 5))
+        self.ax = self.fig.add_subplot(111)
+        colors = colormaps['tab20'].resampled(YM_REGISTERS)
+        self.register_lines = [
+            self.ax.plot([], [], label=f"Reg {reg_num}: {REGISTER_DESCRIPTIONS.get(reg_num, 'Unknown')}",
+                         color=colors(reg_num), visible=False)[0]
+            for reg_num in range(YM_REGISTERS)
+        ]
+        self.ax.set_xlabel('Sample Index')
+        self.ax.set_ylabel('Register Value')
+        self.ax.set_xlim(0, ENTRIES - 1)
+        self.ax.grid(True)
+        self.fig.tight_layout()
 
-        self.entries = scaled_entries
+        # Ensure the graph occupies the top and expands
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.graph_frame)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
     def plot_graph(self):
-        # Clear existing graph
-        for widget in self.graph_frame.winfo_children():
-            widget.destroy()
-
-        fig, ax = plt.subplots(figsize=(10, 5))
-        x = np.arange(len(self.register_values))
-        colors = plt.cm.get_cmap('tab20', 16)
-        for reg_num in range(16):
-            values = []
-            last_value = np.nan
-            for reg_vals in self.register_values:
-                val = reg_vals.get(reg_num, last_value)
-                values.append(val)
-                if not np.isnan(val):
-                    last_value = val
-
-            if not all(np.isnan(values)):
-                ax.plot(x, values, label=f"Reg {reg_num}: {REGISTER_DESCRIPTIONS.get(reg_num, 'Unknown')}", color=colors(reg_num))
-
-        ax.set_xlabel('Sample Index')
-        ax.set_ylabel('Register Value')
-        ax.legend(loc='upper right', fontsize='small', ncol=2)
-        ax.grid(True)
-        fig.tight_layout()
-
-        # Ensure the graph occupies the top and expands
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        # Each register's value after every entry, carried forward where an entry leaves it alone
+        timelines = self.table.register_timelines()
+        x = np.arange(len(timelines))
+        used = ~np.isnan(timelines).all(axis=0)
+        for reg_num, line in enumerate(self.register_lines):
+            line.set_data(x, timelines[:, reg_num])
+            line.set_visible(bool(used[reg_num]))
+
+        visible = [line for line in self.register_lines if line.get_visible()]
+        if visible:
+            self.ax.legend(handles=visible, loc='upper right', fontsize='small', ncol=2)
+        elif self.ax.get_legend():
+            self.ax.get_legend().remove()
+        self.ax.set_xlim(0, max(len(x) - 1, 1))
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view(scalex=False)
+        self.canvas.draw_idle()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,261 @@
+"""
+Batch conversion of a directory of audio files to Atari samples, without the GUI.
+
+A profile fixes every choice the converter would otherwise ask about: target
+rate, signedness, mono policy, resampler quality, dither, noise shaping, bit
+depth, gain and output format (SAM, SPL or WAV). Profiles are JSON files with
+any of these keys, for example:
+
+    {"rate": 12517, "signed": true, "mono": "mix", "dither": "tpdf", "format": "spl"}
+
+Files are converted in parallel, one per worker process. Each input is hashed
+and the hash is recorded in manifest.json in the output directory along with
+the output size and the input peak level; when the batch is run again, files
+whose content and profile are unchanged and whose output still exists are
+skipped. Inputs that would write the same output (a.wav and a.flac both make
+a.SAM) fail rather than overwrite each other; names are compared ignoring
+case, as TOS and most desktop file systems do.
+
+Usage:
+    python sample_batch.py sounds/ atari/ --profile ste.json
+    python sample_batch.py sounds/ atari/ --rate 12517 --signed --format spl --jobs 4 --recursive
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sample_pipeline import DEFAULT_RATE, MONO_POLICIES, convert_file
+from sample_resampler import DEFAULT_QUALITY, QUALITIES
+from sample_dither import BIT_DEPTHS, DITHER_MODES, NOISE_SHAPING
+
+FORMATS = ('sam', 'spl', 'wav')
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.aif', '.aiff')
+
+MANIFEST_NAME = 'manifest.json'
+
+Profile = namedtuple('Profile', ['rate', 'signed', 'mono', 'quality', 'dither', 'shaping', 'bits', 'gain', 'format'])
+DEFAULT_PROFILE = Profile(DEFAULT_RATE, False, 'mix', DEFAULT_QUALITY, 'none', 'none', 8, 1.0, 'sam')
+
+# Bytes hashed at a time
+_HASH_CHUNK = 1 << 20
+
+
+def make_profile(**settings):
+    """A Profile from the defaults and any settings given, checking every value."""
+    unknown = set(settings) - set(Profile._fields)
+    if unknown:
+        raise ValueError(f"Unknown profile setting(s) {', '.join(sorted(unknown))}, "
+                         f"expected one of {', '.join(Profile._fields)}")
+    profile = DEFAULT_PROFILE._replace(**settings)
+    profile = profile._replace(rate=int(profile.rate), signed=bool(profile.signed), bits=int(profile.bits),
+                               gain=float(profile.gain), format=profile.format.lower())
+    choices = {
+        'mono': MONO_POLICIES,
+        'quality': QUALITIES,
+        'dither': DITHER_MODES,
+        'shaping': tuple(NOISE_SHAPING),
+        'bits': BIT_DEPTHS,
+        'format': FORMATS,
+    }
+    for field, allowed in choices.items():
+        value = getattr(profile, field)
+        if value not in allowed:
+            raise ValueError(f"Unknown {field} '{value}', expected one of {', '.join(map(str, allowed))}")
+    if profile.dither == 'none' and profile.shaping != 'none':
+        raise ValueError("Noise shaping rounds, so it needs the round or tpdf dither rather than none")
+    if profile.rate <= 0:
+        raise ValueError(f"Sample rate must be positive, got {profile.rate}")
+    return profile
+
+
+def load_profile(path):
+    with open(path) as f:
+        return make_profile(**json.load(f))
+
+
+def profile_key(profile):
+    """Short hash identifying a profile's settings, stored with each manifest entry."""
+    text = json.dumps(profile._asdict(), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_inputs(directory, recursive=False):
+    """Audio files in a directory, as paths relative to it, sorted."""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, name), directory))
+        if not recursive:
+            break
+        dirs.sort()
+    return sorted(found)
+
+
+def output_name(relative_path, profile):
+    """Output path for an input, relative to the output directory; Atari raw formats are upper case."""
+    base = os.path.splitext(relative_path)[0]
+    return base + ('.wav' if profile.format == 'wav' else '.' + profile.format.upper())
+
+
+def output_collisions(inputs, profile):
+    """{input: [other inputs]} for inputs whose output name matches another's, ignoring case."""
+    by_output = {}
+    for name in inputs:
+        by_output.setdefault(output_name(name, profile).lower(), []).append(name)
+    return {name: [other for other in names if other != name]
+            for names in by_output.values() if len(names) > 1 for name in names}
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get('files', {})
+
+
+def save_manifest(output_dir, profile, entries):
+    manifest = {'profile': profile._asdict(), 'files': entries}
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def convert_one(source_dir, output_dir, relative_path, profile, previous=None, force=False):
+    """
+    Convert one file unless the previous manifest entry shows it is up to date.
+    Returns the new manifest entry, with 'status' 'converted', 'skipped' or 'failed'.
+    """
+    source = os.path.join(source_dir, relative_path)
+    target_name = output_name(relative_path, profile)
+    target = os.path.join(output_dir, target_name)
+    key = profile_key(profile)
+    try:
+        content_hash = file_hash(source)
+        if (not force and previous and previous.get('status') != 'failed' and previous.get('hash') == content_hash
+                and previous.get('profile') == key and os.path.exists(target)):
+            return dict(previous, status='skipped')
+
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        result = convert_file(source, target, profile.rate, profile.signed, profile.mono, profile.gain,
+                              quality=profile.quality, bits=profile.bits, dither=profile.dither,
+                              shaping=profile.shaping)
+        return {
+            'status': 'converted',
+            'output': target_name,
+            'hash': content_hash,
+            'profile': key,
+            'input_bytes': os.path.getsize(source),
+            'output_bytes': os.path.getsize(target),
+            'frames': result.frames_out,
+            'channels': result.channels,
+            'rate': result.rate,
+            'peak': round(result.peak, 6),
+        }
+    except Exception as e:
+        return {'status': 'failed', 'output': target_name, 'error': str(e)}
+
+
+def _convert_task(task):
+    return task[2], convert_one(*task)
+
+
+def convert_directory(source_dir, output_dir, profile=DEFAULT_PROFILE, jobs=None, recursive=False, force=False,
+                      progress=None):
+    """
+    Convert every audio file in source_dir into output_dir, jobs processes at a
+    time (default one per CPU), and write the manifest. progress, if given, is
+    called with (relative_path, entry) as each file finishes. Returns the
+    manifest entries keyed by input path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir)
+    inputs = find_inputs(source_dir, recursive)
+    collisions = output_collisions(inputs, profile)
+    tasks = [(source_dir, output_dir, name, profile, previous.get(name), force)
+             for name in inputs if name not in collisions]
+
+    entries = {}
+    for name, others in collisions.items():
+        entries[name] = {'status': 'failed', 'output': output_name(name, profile),
+                         'error': f"output would overwrite that of {', '.join(others)}"}
+        if progress:
+            progress(name, entries[name])
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) <= 1:
+        results = map(_convert_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(_convert_task, tasks)
+    try:
+        for name, entry in results:
+            entries[name] = entry
+            if progress:
+                progress(name, entry)
+    finally:
+        if executor:
+            executor.shutdown()
+        # Entries for inputs that no longer exist are dropped
+        save_manifest(output_dir, profile, entries)
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory of audio files to Atari samples.")
+    parser.add_argument('source', help="Directory of input audio files")
+    parser.add_argument('output', help="Directory for the converted samples and manifest.json")
+    parser.add_argument('--profile', help="JSON profile; options given below override it")
+    parser.add_argument('--rate', type=int, help=f"Target sample rate (default {DEFAULT_PROFILE.rate})")
+    parser.add_argument('--signed', action='store_const', const=True, help="Write signed samples")
+    parser.add_argument('--unsigned', dest='signed', action='store_const', const=False, help="Write unsigned samples")
+    parser.add_argument('--mono', choices=MONO_POLICIES, help="Mono policy (default mix)")
+    parser.add_argument('--quality', choices=QUALITIES, help=f"Resampler quality (default {DEFAULT_QUALITY})")
+    parser.add_argument('--dither', choices=DITHER_MODES, help="Dither (default none)")
+    parser.add_argument('--shaping', choices=list(NOISE_SHAPING), help="Noise shaping (default none)")
+    parser.add_argument('--bits', type=int, choices=BIT_DEPTHS, help="Sample depth (default 8)")
+    parser.add_argument('--gain', type=float, help="Gain applied before quantizing (default 1.0)")
+    parser.add_argument('--format', choices=FORMATS, help="Output format (default sam)")
+    parser.add_argument('--jobs', type=int, help="Worker processes (default one per CPU)")
+    parser.add_argument('--recursive', action='store_true', help="Include subdirectories, mirroring them in the output")
+    parser.add_argument('--force', action='store_true', help="Convert every file even if it is unchanged")
+    args = parser.parse_args(argv)
+
+    try:
+        settings = load_profile(args.profile)._asdict() if args.profile else {}
+        overrides = {field: getattr(args, field) for field in Profile._fields if getattr(args, field) is not None}
+        profile = make_profile(**dict(settings, **overrides))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    def report(name, entry):
+        if entry['status'] == 'failed':
+            print(f"{name}: failed: {entry['error']}")
+        else:
+            print(f"{name}: {entry['status']} -> {entry['output']}, {entry['output_bytes']} bytes, "
+                  f"peak {entry['peak']:.3f}")
+
+    entries = convert_directory(args.source, args.output, profile, args.jobs, args.recursive, args.force, report)
+    counts = {status: sum(1 for entry in entries.values() if entry['status'] == status)
+              for status in ('converted', 'skipped', 'failed')}
+    print(f"{counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
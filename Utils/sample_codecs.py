@@ -0,0 +1,443 @@
+"""
+4-bit sample codecs that halve the memory 8-bit samples take on the ST.
+
+Three codecs, each coding one sample per nibble, high nibble first:
+
+    delta       fixed 4-bit delta: each code adds a Fibonacci step to the
+                last sample, wrapping as add.b does
+    adaptive    4-bit delta whose step is shifted left 0 to 3 places, the
+                shift rising after large steps and falling after small ones;
+                the sample saturates at -128..127
+    ima         IMA-style ADPCM on a 16-bit predictor with the standard 89
+                step sizes; the output is the top byte of the predictor
+
+The sample is coded in blocks (BLOCK_SAMPLES by default). Each block starts with
+a small header holding the decoder state, so the 68000 can start playing from
+any block, and the encoder can search all the blocks side by side. A file is an
+8 byte header (sample count as a long, block length as a word, codec number,
+pad byte) followed by the blocks. The last block is padded to full length.
+
+Each codec's step function is written in integer arithmetic that follows its
+68000 depack routine (DEPACK_SOURCE, printed with --asm) instruction by
+instruction, so decode() gives the same bytes the ST plays.
+
+The encoder is a lookahead search: at each sample it tries every sequence of
+`depth` codes and keeps the first code of the sequence with the least squared
+error, which avoids the step choices greedy coding (depth 1) paints itself into.
+The search runs across all blocks at once, one NumPy operation per sample
+position.
+
+Run with --benchmark to compare SNR against encode speed:
+
+    python sample_codecs.py --benchmark
+    python sample_codecs.py sample.sam sample.ima --codec ima --depth 2
+"""
+import argparse
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+BLOCK_SAMPLES = 512
+
+FILE_HEADER = struct.Struct('>IHBx')
+
+# Fixed delta steps; codes near the middle make small changes
+DELTA_STEPS = np.array([-34, -21, -13, -8, -5, -3, -2, -1, 0, 1, 2, 3, 5, 8, 13, 21], dtype=np.int32)
+
+# Adaptive delta steps before shifting, and the shift change after each code
+ADAPTIVE_STEPS = np.array([-11, -8, -6, -4, -3, -2, -1, 0, 1, 2, 3, 4, 6, 8, 11, 15], dtype=np.int32)
+ADAPTIVE_SHIFTS = np.array([1, 1, 0, 0, 0, 0, -1, -1, -1, 0, 0, 0, 0, 1, 1, 1], dtype=np.int32)
+MAX_SHIFT = 3
+
+IMA_STEPS = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+    15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767], dtype=np.int32)
+IMA_INDEX = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+
+def _wrap_byte(values):
+    return ((values + 128) & 255) - 128
+
+
+class DeltaCodec:
+    name = 'delta'
+    number = 1
+    header = struct.Struct('>bx')
+
+    def initial_state(self, targets):
+        return (targets[:, 0].astype(np.int32),)
+
+    def step(self, state, codes):
+        sample = _wrap_byte(state[0] + DELTA_STEPS[codes])
+        return (sample,), sample
+
+    def pack_header(self, state):
+        return [self.header.pack(int(sample)) for sample in state[0]]
+
+    def unpack_header(self, data):
+        return (self.header.unpack(data)[0],)
+
+    def target(self, samples):
+        return samples
+
+    def output(self, values):
+        return values
+
+
+class AdaptiveDeltaCodec(DeltaCodec):
+    name = 'adaptive'
+    number = 2
+    header = struct.Struct('>bB')
+
+    def initial_state(self, targets):
+        # Start with the shift the block's typical step size needs
+        typical = np.abs(np.diff(targets, axis=1)).mean(axis=1)
+        shift = np.clip(np.floor(np.log2(np.maximum(typical, 1.0) / 2.0)), 0, MAX_SHIFT).astype(np.int32)
+        return targets[:, 0].astype(np.int32), shift
+
+    def step(self, state, codes):
+        sample, shift = state
+        sample = np.clip(sample + (ADAPTIVE_STEPS[codes] << shift), -128, 127)
+        shift = np.clip(shift + ADAPTIVE_SHIFTS[codes], 0, MAX_SHIFT)
+        return (sample, shift), sample
+
+    def pack_header(self, state):
+        return [self.header.pack(int(sample), int(shift)) for sample, shift in zip(*state)]
+
+    def unpack_header(self, data):
+        return self.header.unpack(data)
+
+
+class ImaCodec(DeltaCodec):
+    name = 'ima'
+    number = 3
+    header = struct.Struct('>hBx')
+
+    def initial_state(self, targets):
+        typical = np.abs(np.diff(targets, axis=1)).mean(axis=1)
+        index = np.searchsorted(IMA_STEPS, typical).clip(0, len(IMA_STEPS) - 1).astype(np.int32)
+        return np.clip(targets[:, 0], -32768, 32767).astype(np.int32), index
+
+    def step(self, state, codes):
+        predictor, index = state
+        step = IMA_STEPS[index]
+        difference = ((step >> 3) + np.where(codes & 4, step, 0) + np.where(codes & 2, step >> 1, 0)
+                      + np.where(codes & 1, step >> 2, 0))
+        predictor = np.clip(np.where(codes & 8, predictor - difference, predictor + difference), -32768, 32767)
+        index = np.clip(index + IMA_INDEX[codes], 0, len(IMA_STEPS) - 1)
+        return (predictor, index), predictor
+
+    def pack_header(self, state):
+        return [self.header.pack(int(predictor), int(index)) for predictor, index in zip(*state)]
+
+    def unpack_header(self, data):
+        return self.header.unpack(data)
+
+    def target(self, samples):
+        # Aim for the middle of each output level, since the output drops the low byte
+        return (samples.astype(np.int32) << 8) + 128
+
+    def output(self, values):
+        return values >> 8
+
+
+CODECS = {codec.name: codec for codec in (DeltaCodec(), AdaptiveDeltaCodec(), ImaCodec())}
+CODEC_NUMBERS = {codec.number: codec for codec in CODECS.values()}
+
+EncodeResult = namedtuple('EncodeResult', ['data', 'decoded', 'snr_db', 'seconds'])
+
+
+def _get_codec(name):
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec '{name}', expected one of {', '.join(CODECS)}")
+    return CODECS[name]
+
+
+def _blocks(samples, block_samples):
+    """Signed samples as (blocks, block_samples), padding the last block with its final sample."""
+    if block_samples < 2 or block_samples % 2:
+        raise ValueError(f"Block length must be an even number of samples, got {block_samples}")
+    count = -(-len(samples) // block_samples)
+    padded = np.empty(count * block_samples, dtype=np.int32)
+    padded[:len(samples)] = samples
+    padded[len(samples):] = samples[-1] if len(samples) else 0
+    return padded.reshape(count, block_samples)
+
+
+def _search(codec, state, targets, depth):
+    """First code of the best `depth` code sequence for each block, from the given state."""
+    codes = np.arange(16)
+    lanes = len(targets)
+    cost = np.zeros((lanes, 1), dtype=np.float64)
+    for level in range(min(depth, targets.shape[1])):
+        # Every sequence so far, extended by every code
+        state = tuple(np.repeat(part.reshape(lanes, -1), 16, axis=1) for part in state)
+        state, values = codec.step(state, np.tile(codes, cost.shape[1])[None, :])
+        error = (values - targets[:, level:level + 1]).astype(np.float64)
+        cost = np.repeat(cost, 16, axis=1) + error * error
+    return cost.reshape(lanes, 16, -1).min(axis=2).argmin(axis=1)
+
+
+def encode_codes(samples, codec_name, depth=2, block_samples=BLOCK_SAMPLES):
+    """Codes (blocks, block_samples) and the initial state per block for signed 8-bit samples."""
+    codec = _get_codec(codec_name)
+    targets = codec.target(_blocks(np.asarray(samples, dtype=np.int32), block_samples))
+    initial = codec.initial_state(targets)
+    state = initial
+    codes = np.empty(targets.shape, dtype=np.uint8)
+    # An empty sample has no blocks to search
+    for position in range(targets.shape[1] if len(targets) else 0):
+        chosen = _search(codec, state, targets[:, position:position + depth], depth)
+        state, _ = codec.step(state, chosen)
+        codes[:, position] = chosen
+    return codes, initial
+
+
+def pack(codec_name, codes, initial, count):
+    """File bytes for encoded blocks: the file header, then each block's header and nibbles."""
+    codec = _get_codec(codec_name)
+    nibbles = (codes[:, 0::2] << 4) | codes[:, 1::2]
+    headers = codec.pack_header(initial)
+    blocks = b''.join(header + row.tobytes() for header, row in zip(headers, nibbles))
+    return FILE_HEADER.pack(count, codes.shape[1], codec.number) + blocks
+
+
+def unpack(data):
+    """(codec, codes, initial state, sample count) from file bytes."""
+    count, block_samples, number = FILE_HEADER.unpack_from(data)
+    if number not in CODEC_NUMBERS:
+        raise ValueError(f"Unknown codec number {number} in packed sample")
+    codec = CODEC_NUMBERS[number]
+    block_bytes = codec.header.size + block_samples // 2
+    blocks = -(-count // block_samples)
+    raw = np.frombuffer(data, dtype=np.uint8, count=blocks * block_bytes, offset=FILE_HEADER.size)
+    raw = raw.reshape(blocks, block_bytes)
+    states = [codec.unpack_header(row[:codec.header.size].tobytes()) for row in raw]
+    parts = len(codec.unpack_header(bytes(codec.header.size)))
+    initial = tuple(np.array([state[part] for state in states], dtype=np.int32) for part in range(parts))
+    nibbles = raw[:, codec.header.size:]
+    codes = np.empty((blocks, block_samples), dtype=np.uint8)
+    codes[:, 0::2] = nibbles >> 4
+    codes[:, 1::2] = nibbles & 15
+    return codec, codes, initial, count
+
+
+def decode_codes(codec, codes, initial, count):
+    """Signed 8-bit samples from codes, stepping every block at once as the 68000 would one by one."""
+    state = initial
+    output = np.empty(codes.shape, dtype=np.int32)
+    for position in range(codes.shape[1]):
+        state, values = codec.step(state, codes[:, position].astype(np.int32))
+        output[:, position] = values
+    return codec.output(output).reshape(-1)[:count].astype(np.int8)
+
+
+def decode(data):
+    """Signed 8-bit samples from a packed file's bytes."""
+    return decode_codes(*unpack(data))
+
+
+def snr_db(original, decoded):
+    signal = np.square(np.asarray(original, dtype=np.float64)).sum()
+    noise = np.square(np.asarray(decoded, dtype=np.float64) - original).sum()
+    return 10 * np.log10(signal / noise) if noise else float('inf')
+
+
+def encode(samples, codec_name, depth=2, block_samples=BLOCK_SAMPLES):
+    """Encode signed 8-bit samples, returning the file bytes, the decoded result and its SNR."""
+    samples = np.asarray(samples, dtype=np.int8)
+    start = time.perf_counter()
+    codes, initial = encode_codes(samples, codec_name, depth, block_samples)
+    data = pack(codec_name, codes, initial, len(samples))
+    elapsed = time.perf_counter() - start
+    decoded = decode(data)
+    return EncodeResult(data, decoded, snr_db(samples, decoded), elapsed)
+
+
+def benchmark(samples=None, depths=(1, 2, 3), block_samples=BLOCK_SAMPLES):
+    """SNR and encode speed for each codec and search depth."""
+    if samples is None:
+        # Two seconds of a decaying chord over noise, at 12517 Hz
+        rate = 12517
+        t = np.arange(2 * rate) / rate
+        tone = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.2, 329.6, 880.0)) / 4
+        signal = tone * np.exp(-t) + np.random.default_rng(0).normal(0, 0.02, len(t))
+        samples = np.clip(np.round(signal * 127), -128, 127).astype(np.int8)
+    results = []
+    for name in CODECS:
+        for depth in depths:
+            result = encode(samples, name, depth, block_samples)
+            results.append({
+                'codec': name,
+                'depth': depth,
+                'snr_db': result.snr_db,
+                'samples_per_second': len(samples) / result.seconds,
+                'ratio': len(samples) / len(result.data),
+            })
+    return results
+
+
+# 68000 depack routines. Each decodes one block: a0 points at the block header,
+# a1 at the output, d7 holds block_samples / 2 - 1, and the tables are those above.
+DEPACK_SOURCE = {
+    'delta': """\
+; Fixed 4-bit delta. a2 = DELTA_STEPS as bytes
+depack_delta:
+        move.b  (a0)+,d0            ; predictor
+        addq.l  #1,a0               ; pad
+        moveq   #0,d1
+.loop:  move.b  (a0)+,d1
+        move.w  d1,d2
+        lsr.w   #4,d2               ; high nibble first
+        add.b   (a2,d2.w),d0        ; wraps, as _wrap_byte
+        move.b  d0,(a1)+
+        and.w   #$f,d1
+        add.b   (a2,d1.w),d0
+        move.b  d0,(a1)+
+        dbra    d7,.loop
+        rts
+""",
+    'adaptive': """\
+; Adaptive 4-bit delta. a2 = ADAPTIVE_STEPS as bytes, followed by ADAPTIVE_SHIFTS as bytes
+ADELTA  macro                       ; \\1 = register holding the code
+        move.b  (a2,\\1.w),d4
+        ext.w   d4
+        asl.w   d3,d4
+        add.w   d4,d0
+        cmp.w   #127,d0
+        ble.s   .low\\@
+        moveq   #127,d0
+.low\\@: cmp.w   #-128,d0
+        bge.s   .put\\@
+        moveq   #-128,d0
+.put\\@: move.b  d0,(a1)+
+        add.b   16(a2,\\1.w),d3
+        bpl.s   .max\\@
+        moveq   #0,d3
+.max\\@: cmp.b   #3,d3
+        ble.s   .done\\@
+        moveq   #3,d3
+.done\\@:
+        endm
+
+depack_adaptive:
+        move.b  (a0)+,d0            ; predictor
+        ext.w   d0
+        moveq   #0,d3
+        move.b  (a0)+,d3            ; shift
+        moveq   #0,d1
+.loop:  move.b  (a0)+,d1
+        move.w  d1,d2
+        lsr.w   #4,d2
+        ADELTA  d2
+        and.w   #$f,d1
+        ADELTA  d1
+        dbra    d7,.loop
+        rts
+""",
+    'ima': """\
+; IMA-style ADPCM. a2 = IMA_STEPS as words, a3 = IMA_INDEX as bytes
+IMA     macro                       ; \\1 = register holding the code
+        move.w  d3,d5
+        add.w   d5,d5
+        move.w  (a2,d5.w),d5        ; step
+        moveq   #0,d6
+        move.w  d5,d6
+        lsr.w   #3,d6               ; difference = step >> 3
+        btst    #2,\\1
+        beq.s   .half\\@
+        add.l   d5,d6
+.half\\@: lsr.w   #1,d5
+        btst    #1,\\1
+        beq.s   .quarter\\@
+        add.l   d5,d6
+.quarter\\@: lsr.w  #1,d5
+        btst    #0,\\1
+        beq.s   .sign\\@
+        add.l   d5,d6
+.sign\\@: btst    #3,\\1
+        beq.s   .add\\@
+        sub.l   d6,d0
+        cmp.l   #-32768,d0
+        bge.s   .put\\@
+        move.l  #-32768,d0
+        bra.s   .put\\@
+.add\\@: add.l   d6,d0
+        cmp.l   #32767,d0
+        ble.s   .put\\@
+        move.l  #32767,d0
+.put\\@: move.w  d0,d4
+        asr.w   #8,d4
+        move.b  d4,(a1)+            ; top byte of the predictor
+        add.b   (a3,\\1.w),d3
+        bpl.s   .max\\@
+        moveq   #0,d3
+.max\\@: cmp.b   #88,d3
+        ble.s   .done\\@
+        moveq   #88,d3
+.done\\@:
+        endm
+
+depack_ima:
+        move.w  (a0)+,d0            ; predictor
+        ext.l   d0
+        moveq   #0,d3
+        move.b  (a0)+,d3            ; step index
+        addq.l  #1,a0               ; pad
+        moveq   #0,d5
+        moveq   #0,d1
+.loop:  move.b  (a0)+,d1
+        move.w  d1,d2
+        lsr.w   #4,d2
+        IMA     d2
+        and.w   #$f,d1
+        IMA     d1
+        dbra    d7,.loop
+        rts
+""",
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="4-bit delta and ADPCM sample codecs.")
+    parser.add_argument('source', nargs='?', help="Raw 8-bit .SAM/.SPL sample to encode")
+    parser.add_argument('target', nargs='?', help="Packed output file")
+    parser.add_argument('--codec', choices=list(CODECS), default='ima', help="Codec (default ima)")
+    parser.add_argument('--depth', type=int, default=2, help="Codes searched ahead by the encoder (default 2)")
+    parser.add_argument('--block', type=int, default=BLOCK_SAMPLES, help=f"Samples per block (default {BLOCK_SAMPLES})")
+    parser.add_argument('--signed', action='store_true', help="The source is signed (default unsigned)")
+    parser.add_argument('--benchmark', action='store_true', help="Compare SNR and encode speed of every codec")
+    parser.add_argument('--asm', choices=list(CODECS), help="Print a codec's 68000 depack routine")
+    args = parser.parse_args(argv)
+
+    if args.asm:
+        print(DEPACK_SOURCE[args.asm])
+        return 0
+    if args.benchmark:
+        print(f"{'Codec':<9} {'Depth':>5} {'SNR dB':>7} {'Samples/s':>10} {'Ratio':>6}")
+        for result in benchmark(block_samples=args.block):
+            print(f"{result['codec']:<9} {result['depth']:>5} {result['snr_db']:>7.2f} "
+                  f"{result['samples_per_second']:>10.0f} {result['ratio']:>6.2f}")
+        return 0
+    if not args.source or not args.target:
+        parser.error("source and target are required unless --benchmark or --asm is given")
+
+    samples = np.fromfile(args.source, dtype=np.uint8)
+    if not args.signed:
+        samples ^= 0x80
+    result = encode(samples.view(np.int8), args.codec, args.depth, args.block)
+    with open(args.target, 'wb') as f:
+        f.write(result.data)
+    print(f"{args.target}: {len(samples)} samples -> {len(result.data)} bytes, SNR {result.snr_db:.2f} dB, "
+          f"encoded in {result.seconds:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Dithered, noise-shaped quantization to 8-bit and 4-bit Atari samples.
+
+Quantizer turns float blocks in -1.0..1.0 into signed or unsigned integer
+samples of 8 bits (DMA/replay samples) or 4 bits (YM volume levels and ADPCM
+input), one sample per byte. The dither is one of:
+
+    none    truncate, as the converter always has (unsigned floors, signed
+            truncates towards zero)
+    round   round to nearest
+    tpdf    add triangular dither of +/-1 LSB, then round
+
+and optional error-feedback noise shaping moves the requantization noise
+towards Nyquist, where an ST replay rate puts it furthest from the ear's most
+sensitive band:
+
+    none    flat noise
+    first   noise transfer function 1 - z^-1 (+6 dB per octave)
+    second  noise transfer function (1 - z^-1)^2 (+12 dB per octave)
+
+Shaping rounds, so it needs the round or tpdf dither.
+
+Error feedback looks sequential, but with integer coefficients it has a
+closed form: if F runs the feedback recurrence over the input alone
+(F[n] = x[n] + sum(c_k F[n-k]), started from the carried errors) then
+G = floor(F + dither + 0.5) runs it over the output, the output is G with the
+recurrence undone, and the errors are G - F. For (1 - z^-1)**order the
+recurrence is order cumulative sums, so a chunk is a few cumsums, one floor
+and a few differences, and its last errors carry over to the next
+chunk and block, so the result is the sequential loop's up to float64
+rounding. Only samples that clip at the rails break the closed form; those,
+and a short run after them, go through the sequential loop.
+
+Run with --benchmark to time a minute of stereo audio at 50066 Hz:
+
+    python sample_dither.py --benchmark
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+DITHER_MODES = ('none', 'round', 'tpdf')
+
+# Error feedback coefficients c_k: the noise transfer function is 1 - sum(c_k z^-k),
+# here (1 - z^-1)**order, which the closed form in Quantizer._shape relies on.
+NOISE_SHAPING = {
+    'none': (),
+    'first': (1.0,),
+    'second': (2.0, -1.0),
+}
+
+BIT_DEPTHS = (8, 4)
+
+# Samples per closed-form chunk; F grows with the square of the chunk length
+# for second-order shaping, so this keeps it well within float64 precision
+SHAPING_CHUNK = 1024
+
+# Samples run sequentially after the last one that clipped before the closed form resumes
+CLIP_RUN = 32
+
+# Feedback error is limited to this many LSBs so clipping at the rails cannot run away
+ERROR_LIMIT = 2.0
+
+
+def sample_range(bits, signed):
+    """(low, high) sample values for a bit depth and signedness."""
+    if signed:
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+
+class Quantizer:
+    """Streaming quantizer; the dither generator and feedback errors carry over between blocks."""
+
+    def __init__(self, bits=8, signed=False, dither='none', shaping='none', seed=0):
+        if bits not in BIT_DEPTHS:
+            raise ValueError(f"Unsupported bit depth {bits}, expected one of {', '.join(map(str, BIT_DEPTHS))}")
+        if dither not in DITHER_MODES:
+            raise ValueError(f"Unknown dither '{dither}', expected one of {', '.join(DITHER_MODES)}")
+        if shaping not in NOISE_SHAPING:
+            raise ValueError(f"Unknown noise shaping '{shaping}', expected one of {', '.join(NOISE_SHAPING)}")
+        if dither == 'none' and shaping != 'none':
+            raise ValueError("Noise shaping rounds, so it needs the round or tpdf dither rather than none")
+        self.bits = bits
+        self.signed = signed
+        self.dither = dither
+        self.coefficients = NOISE_SHAPING[shaping]
+        # -1.0..1.0 maps to +/-127 for 8 bits, as the converter has always scaled, or +/-7 for 4 bits
+        self.full_scale = float((1 << (bits - 1)) - 1)
+        self.offset = 0 if signed else 1 << (bits - 1)
+        self.low, self.high = sample_range(bits, True)
+        self.dtype = np.int8 if signed else np.uint8
+        self.rng = np.random.default_rng(seed)
+        # Feedback errors of each channel, newest first: (len(coefficients), channels)
+        self.errors = None
+
+    def _dither(self, shape):
+        if self.dither != 'tpdf':
+            return None
+        # The difference of two uniform variables is triangular over +/-1 LSB
+        noise = self.rng.random(shape, dtype=np.float32)
+        noise -= self.rng.random(shape, dtype=np.float32)
+        return noise
+
+    def process(self, block):
+        """Quantize a (frames, channels) float block, returning int8 or uint8 samples of the same shape."""
+        values = block.astype(np.float32) * self.full_scale
+        if self.coefficients:
+            quantized = self._shape(values)
+        elif self.dither == 'none':
+            quantized = np.floor(values) if not self.signed else np.trunc(values)
+        else:
+            noise = self._dither(values.shape)
+            if noise is not None:
+                values += noise
+            quantized = np.floor(values + 0.5)
+        np.clip(quantized, self.low, self.high, out=quantized)
+        if self.offset:
+            quantized += self.offset
+        return quantized.astype(self.dtype)
+
+    def _shape(self, values):
+        frames, channels = values.shape
+        if self.errors is None:
+            self.errors = np.zeros((len(self.coefficients), channels))
+        noise = self._dither(values.shape)
+        output = np.empty(values.shape, dtype=np.float32)
+        for channel in range(channels):
+            output[:, channel] = self._shape_channel(values[:, channel].astype(np.float64),
+                                                     None if noise is None else noise[:, channel], channel)
+        return output
+
+    def _shape_channel(self, values, noise, channel):
+        errors = self.errors[:, channel]
+        order = len(errors)
+        output = np.empty(len(values))
+        position = 0
+        while position < len(values):
+            end = min(position + SHAPING_CHUNK, len(values))
+            # The errors so far are G - F with G = 0 before the chunk, so F starts at -errors
+            f = _integrate(values[position:end], -errors)
+            target = f + 0.5
+            if noise is not None:
+                target += noise[position:end]
+            g = np.floor(target)
+            result = g.copy()
+            for k, coefficient in enumerate(self.coefficients, 1):
+                result[k:] -= coefficient * g[:-k]
+            clipped = np.flatnonzero((result < self.low) | (result > self.high))
+            count = clipped[0] if len(clipped) else len(result)
+            output[position:position + count] = result[:count]
+            if count:
+                errors = np.concatenate(((g - f)[:count][::-1][:order], errors))[:order]
+            position += count
+            if position < end:
+                position, errors = self._shape_clipped(values, noise, output, position, errors)
+        self.errors[:, channel] = errors
+        return output
+
+    def _shape_clipped(self, values, noise, output, position, errors):
+        """The sequential loop, from a sample that clips until CLIP_RUN samples pass without clipping."""
+        errors = list(errors)
+        last_clip = position
+        while position < len(values) and position - last_clip < CLIP_RUN:
+            target = values[position] - sum(c * e for c, e in zip(self.coefficients, errors))
+            result = np.floor(target + 0.5 + (noise[position] if noise is not None else 0.0))
+            if result < self.low or result > self.high:
+                result = min(max(result, self.low), self.high)
+                last_clip = position
+            output[position] = result
+            # The fed back error includes the dither, so the dither noise is shaped too
+            error = min(max(result - target, -ERROR_LIMIT), ERROR_LIMIT)
+            errors = [error] + errors[:-1]
+            position += 1
+        return position, np.array(errors)
+
+
+def _integrate(values, history):
+    """
+    F[n] = x[n] + sum(c_k F[n-k]) for the noise transfer function (1 - z^-1)**order,
+    given F's last order values, newest first: order cumulative sums, each
+    started from the matching backward difference of the history.
+    """
+    oldest_first = history[::-1]
+    result = values
+    for level in range(len(history) - 1, -1, -1):
+        result = np.diff(oldest_first, level)[-1] + np.cumsum(result)
+    return result
+
+
+def quantize_array(samples, bits=8, signed=False, dither='tpdf', shaping='none', seed=0):
+    """Quantize a whole 1-D or (frames, channels) float array in -1.0..1.0."""
+    frames = samples.reshape(len(samples), -1)
+    output = Quantizer(bits, signed, dither, shaping, seed).process(frames)
+    return output[:, 0] if samples.ndim == 1 else output
+
+
+def noise_spectrum(samples, quantized, bits, signed, bands=8):
+    """Requantization noise level in dBFS per band, from DC to Nyquist."""
+    offset = 0 if signed else 1 << (bits - 1)
+    error = (quantized.astype(np.float64) - offset) / ((1 << (bits - 1)) - 1) - samples
+    spectrum = np.abs(np.fft.rfft(error * np.hanning(len(error)))) ** 2
+    levels = [np.mean(band) for band in np.array_split(spectrum[1:], bands)]
+    return [10 * np.log10(level / len(error) + 1e-20) for level in levels]
+
+
+def benchmark(seconds=60.0, rate=50066, channels=2):
+    """Time every dither and shaping combination on a quiet stereo tone."""
+    t = np.arange(int(rate * seconds)) / rate
+    tone = (0.05 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    audio = np.repeat(tone[:, None], channels, axis=1)
+    results = []
+    for bits in BIT_DEPTHS:
+        for dither in DITHER_MODES:
+            for shaping in NOISE_SHAPING:
+                if dither == 'none' and shaping != 'none':
+                    continue
+                quantizer = Quantizer(bits, True, dither, shaping)
+                start = time.perf_counter()
+                output = np.concatenate([quantizer.process(audio[i:i + 65536]) for i in range(0, len(audio), 65536)])
+                elapsed = time.perf_counter() - start
+                spectrum = noise_spectrum(tone[:rate], output[:rate, 0], bits, True)
+                results.append({
+                    'bits': bits,
+                    'dither': dither,
+                    'shaping': shaping,
+                    'seconds': elapsed,
+                    'low_db': spectrum[0],
+                    'high_db': spectrum[-1],
+                })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dithered, noise-shaped 8-bit and 4-bit quantization.")
+    parser.add_argument('--benchmark', action='store_true', help="Time each mode on a minute of stereo audio")
+    parser.add_argument('--seconds', type=float, default=60.0, help="Length of the benchmark audio (default 60)")
+    parser.add_argument('--rate', type=int, default=50066, help="Sample rate of the benchmark audio (default 50066)")
+    args = parser.parse_args(argv)
+
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    print(f"{'Bits':>4} {'Dither':<7} {'Shaping':<8} {'Seconds':>8} {'Low band dB':>12} {'Top band dB':>12}")
+    for result in benchmark(args.seconds, args.rate):
+        print(f"{result['bits']:>4} {result['dither']:<7} {result['shaping']:<8} {result['seconds']:>8.3f} "
+              f"{result['low_db']:>12.1f} {result['high_db']:>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Loop point search for instrument samples.
+
+find_loops looks for a loop start in one window of the sample and a loop end
+in another, and ranks the pairs by how cleanly playback would jump from the end
+back to the start:
+
+1. The start window and end window are cross-correlated with one FFT. Each lag
+   is a loop length, and the correlation, normalized by the energy of the
+   overlapping parts, says how alike the waveform is one loop length apart.
+   The best local maxima give the candidate loop lengths.
+
+2. For each candidate length, every start in the window is scored at once:
+   the mismatch between the waveform around the start and around the end
+   (windowed sums of squared differences, from cumulative sums), the jump in
+   level at the splice, and the change in slope across it. Starts and ends
+   can be restricted to zero crossings in the same direction.
+
+The click score is the jump plus half the slope change, relative to the
+sample's peak level, and the overall score adds the waveform mismatch; lower
+is better for both. render_loop plays a candidate through a few times, to
+audition it as a WAV.
+
+Usage:
+    python sample_loops.py flute.sam --start 2000 8000 --end 14000 20000
+    python sample_loops.py flute.sam --signed --start 2000 8000 --end 14000 20000 --preview flute-loop.wav
+"""
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from sample_model import SampleModel
+from sample_pipeline import DEFAULT_RATE, write_wav
+
+LoopCandidate = namedtuple('LoopCandidate', ['start', 'end', 'score', 'click', 'mismatch', 'correlation'])
+
+# Samples either side of the splice compared when scoring a pair
+DEFAULT_CONTEXT = 256
+
+# Loop lengths taken from the cross-correlation for detailed scoring
+DEFAULT_LENGTHS = 32
+
+
+def _as_float(samples):
+    """Samples as float32 centred on zero; unsigned 8-bit samples are offset by 128."""
+    values = np.asarray(samples, dtype=np.float32)
+    if samples.dtype == np.uint8:
+        values = values - 128.0
+    return values
+
+
+def _window_sums(values, width):
+    """Sum of each run of `width` consecutive values, via a cumulative sum."""
+    totals = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return totals[width:] - totals[:-width]
+
+
+def correlate_lengths(x, start_window, end_window, min_overlap=DEFAULT_CONTEXT):
+    """
+    Normalized cross-correlation of the start window with the end window, as
+    (lengths, correlation): the correlation of the waveform with itself
+    `length` samples later, over the parts of the two windows that overlap.
+    """
+    a0, a1 = start_window
+    b0, b1 = end_window
+    a, b = x[a0:a1], x[b0:b1]
+    size = 1 << int(np.ceil(np.log2(len(a) + len(b))))
+    spectrum = np.conj(np.fft.rfft(a, size)) * np.fft.rfft(b, size)
+    circular = np.fft.irfft(spectrum, size)
+    # Lag l pairs a[i] with b[i + l], for l from -(len(a) - 1) to len(b) - 1
+    lags = np.arange(-(len(a) - 1), len(b))
+    correlation = circular[lags % size]
+
+    # Energy of the overlapping part of each window at each lag
+    first = np.maximum(0, -lags)
+    last = np.minimum(len(a), len(b) - lags)
+    energy_a = np.concatenate(([0.0], np.cumsum(np.square(a, dtype=np.float64))))
+    energy_b = np.concatenate(([0.0], np.cumsum(np.square(b, dtype=np.float64))))
+    overlap_a = energy_a[last] - energy_a[first]
+    overlap_b = energy_b[last + lags] - energy_b[first + lags]
+    normalized = correlation / np.sqrt(overlap_a * overlap_b + 1e-9)
+    normalized[last - first < min(min_overlap, len(a), len(b))] = -1.0
+    return b0 - a0 + lags, normalized
+
+
+def _zero_crossings(x, positions):
+    """+1 where the waveform rises through zero into each position, -1 where it falls, else 0."""
+    before, at = x[positions - 1], x[positions]
+    return np.where((before < 0) & (at >= 0), 1, np.where((before >= 0) & (at < 0), -1, 0))
+
+
+def _score_length(x, padded, context, length, starts, peak, zero_crossings):
+    """Score every start for one loop length; returns (index, score, click, mismatch) of the best, or None."""
+    ends = starts + length
+    # padded[i + context // 2] is x[i], so the context around start s is padded[s:s + context]
+    lo, hi = starts[0], starts[-1] + context
+    near_start = padded[lo:hi]
+    near_end = padded[lo + length:hi + length]
+    difference = _window_sums(np.square(near_start - near_end), context)
+    energy = _window_sums(np.square(near_start) + np.square(near_end), context)
+    mismatch = difference / (energy + 1e-9)
+
+    # Playback runs x[end - 1] then jumps to x[start], where it would have played x[end]
+    jump = np.abs(x[starts] - x[ends])
+    slope = np.abs((x[starts] - x[starts - 1]) - (x[ends] - x[ends - 1]))
+    click = (jump + 0.5 * slope) / peak
+    score = mismatch + click
+
+    if zero_crossings:
+        crossing = _zero_crossings(x, starts)
+        matched = (crossing != 0) & (crossing == _zero_crossings(x, ends))
+        if matched.any():
+            score = np.where(matched, score, np.inf)
+
+    best = int(np.argmin(score))
+    if not np.isfinite(score[best]):
+        return None
+    return best, float(score[best]), float(click[best]), float(mismatch[best])
+
+
+def find_loops(samples, start_window, end_window, count=10, context=DEFAULT_CONTEXT, lengths=DEFAULT_LENGTHS,
+               min_length=64, zero_crossings=True):
+    """
+    Ranked loop candidates with the start in start_window and the end in
+    end_window, both (first, stop) sample ranges. The loop plays
+    samples[start:end] repeatedly, so end is the first sample not played.
+    """
+    x = _as_float(samples)
+    n = len(x)
+    s0, s1 = max(1, int(start_window[0])), min(n - 1, int(start_window[1]))
+    e0, e1 = max(1, int(end_window[0])), min(n - 1, int(end_window[1]))
+    if s1 <= s0 or e1 <= e0:
+        raise ValueError("Loop start and end windows must each contain at least one sample")
+    peak = max(float(np.abs(x).max()), 1.0)
+    half = context // 2
+
+    loop_lengths, correlation = correlate_lengths(x, (s0, s1), (e0, e1), context)
+    valid = loop_lengths >= max(1, min_length)
+    # Local maxima of the correlation are the lengths where the waveform lines up
+    peaks = np.zeros_like(valid)
+    peaks[1:-1] = (correlation[1:-1] >= correlation[:-2]) & (correlation[1:-1] >= correlation[2:])
+    indices = np.flatnonzero(valid & peaks)
+    if not len(indices):
+        indices = np.flatnonzero(valid)
+    indices = indices[np.argsort(correlation[indices])[::-1][:lengths]]
+
+    padded = np.pad(x, (half, context))
+    candidates = []
+    for index in indices:
+        length = int(loop_lengths[index])
+        starts = np.arange(max(s0, e0 - length), min(s1, e1 - length))
+        if not len(starts):
+            continue
+        result = _score_length(x, padded, context, length, starts, peak, zero_crossings)
+        if result:
+            best, score, click, mismatch = result
+            start = int(starts[best])
+            candidates.append(LoopCandidate(start, start + length, score, click, mismatch,
+                                            float(correlation[index])))
+    candidates.sort(key=lambda candidate: candidate.score)
+    return candidates[:count]
+
+
+def render_loop(samples, start, end, repeats=4):
+    """The sample up to the loop end followed by `repeats` more passes of the loop."""
+    return np.concatenate((samples[:end], np.tile(samples[start:end], repeats)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find loop points in an 8-bit raw sample.")
+    parser.add_argument('sample', help="Raw .SAM/.SPL sample")
+    parser.add_argument('--signed', action='store_true', help="The sample is signed (default unsigned)")
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help=f"Sample rate for the preview (default {DEFAULT_RATE})")
+    parser.add_argument('--start', type=int, nargs=2, required=True, metavar=('FIRST', 'STOP'),
+                        help="Range to search for the loop start")
+    parser.add_argument('--end', type=int, nargs=2, required=True, metavar=('FIRST', 'STOP'),
+                        help="Range to search for the loop end")
+    parser.add_argument('--count', type=int, default=10, help="Candidates to list (default 10)")
+    parser.add_argument('--context', type=int, default=DEFAULT_CONTEXT,
+                        help=f"Samples compared around the splice (default {DEFAULT_CONTEXT})")
+    parser.add_argument('--any-point', action='store_true', help="Do not restrict the splice to zero crossings")
+    parser.add_argument('--preview', help="Write the best loop, played a few times, to this WAV file")
+    args = parser.parse_args(argv)
+
+    model = SampleModel.open(args.sample, args.rate, args.signed, mode='r')
+    began = time.perf_counter()
+    candidates = find_loops(model.data, args.start, args.end, args.count, args.context,
+                            zero_crossings=not args.any_point)
+    elapsed = time.perf_counter() - began
+
+    print(f"{'Start':>8} {'End':>8} {'Length':>7} {'Score':>7} {'Click':>7} {'Mismatch':>8} {'Corr':>6}")
+    for candidate in candidates:
+        print(f"{candidate.start:>8} {candidate.end:>8} {candidate.end - candidate.start:>7} {candidate.score:>7.4f} "
+              f"{candidate.click:>7.4f} {candidate.mismatch:>8.4f} {candidate.correlation:>6.3f}")
+    print(f"Searched in {elapsed:.3f} s")
+
+    if args.preview and candidates:
+        best = candidates[0]
+        write_wav([render_loop(model.data, best.start, best.end)], args.preview, args.rate, args.signed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
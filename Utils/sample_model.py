@@ -0,0 +1,162 @@
+"""
+Memory-mapped 8-bit sample data, for working with regions of large dumps.
+
+SampleModel wraps a 1-D int8 (signed) or uint8 (unsigned) array, which is
+normally a np.memmap over the file rather than a copy of it, so opening a
+multi-hundred-MB disk or RAM dump costs nothing until pages are touched. A
+selection marks the region of interest; selecting, cropping and exporting all
+work on views of the map, and exports are written a chunk at a time.
+
+Signedness conversion flips the top bit of every byte in place, a chunk at a
+time, and reinterprets the same memory with the other dtype. Files are mapped
+copy-on-write by default, so only the converted pages are copied into memory
+and the file on disk is never changed; open with mode='r+' to convert the file
+itself. Crop to the region of interest first to convert just that part.
+
+Usage:
+    python sample_model.py dump.bin region.wav --offset 0x3a000 --length 48000 --rate 12517
+    python sample_model.py dump.bin region.sam --offset 0x3a000 --length 48000 --signed --to-unsigned
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from sample_pipeline import DEFAULT_RATE, write_raw, write_wav
+
+# Samples converted or written at a time
+CHUNK_SAMPLES = 1 << 20
+
+MAP_MODES = ('r', 'c', 'r+')
+
+
+def _dtype(signed):
+    return np.int8 if signed else np.uint8
+
+
+class SampleModel:
+    """8-bit sample data, its replay rate and signedness, and a selected region."""
+
+    def __init__(self, data, sample_rate=DEFAULT_RATE, signed=False, path=None):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.signed = signed
+        self.path = path
+        self.selection = None
+
+    @classmethod
+    def open(cls, path, sample_rate=DEFAULT_RATE, signed=False, offset=0, length=None, mode='c'):
+        """
+        Map `length` bytes of a file from `offset` (to the end of the file if
+        None). mode is 'r' (read-only), 'c' (copy-on-write, the default) or 'r+'
+        (changes are written back to the file).
+        """
+        if mode not in MAP_MODES:
+            raise ValueError(f"Unknown map mode '{mode}', expected one of {', '.join(MAP_MODES)}")
+        size = os.path.getsize(path)
+        if offset < 0 or offset > size:
+            raise ValueError(f"Offset {offset} is outside the file ({size} bytes)")
+        available = size - offset
+        length = available if length is None else length
+        if length < 0 or length > available:
+            raise ValueError(f"Cannot read {length} bytes from offset {offset}, the file has {available}")
+        if length == 0:
+            # np.memmap cannot map an empty range
+            data = np.zeros(0, dtype=_dtype(signed))
+        else:
+            data = np.memmap(path, dtype=_dtype(signed), mode=mode, offset=offset, shape=(length,))
+        return cls(data, sample_rate, signed, path)
+
+    def __len__(self):
+        return len(self.data)
+
+    def select(self, start, stop):
+        """Select samples[start:stop], clamped to the data; an empty range clears the selection."""
+        start = max(0, min(len(self.data), int(start)))
+        stop = max(start, min(len(self.data), int(stop)))
+        self.selection = (start, stop) if stop > start else None
+
+    def clear_selection(self):
+        self.selection = None
+
+    @property
+    def region(self):
+        """(start, stop) of the selection, or of all the data if nothing is selected."""
+        return self.selection or (0, len(self.data))
+
+    def selected(self):
+        """The selected samples, as a view of the data rather than a copy."""
+        start, stop = self.region
+        return self.data[start:stop]
+
+    def crop(self):
+        """Make the selection the whole of the data. The result is still a view of the map."""
+        self.data = self.selected()
+        self.selection = None
+
+    def convert_signedness(self):
+        """Convert between signed and unsigned in place, a chunk at a time."""
+        if not self.data.flags.writeable:
+            raise ValueError("Sample data is read-only; open it copy-on-write ('c') or 'r+' to convert it")
+        raw = self.data.view(np.uint8)
+        for start in range(0, len(raw), CHUNK_SAMPLES):
+            raw[start:start + CHUNK_SAMPLES] ^= 0x80
+        self.signed = not self.signed
+        self.data = raw.view(_dtype(self.signed))
+
+    def flush(self):
+        """Write converted data back to the file when it was opened with mode 'r+'."""
+        if isinstance(self.data, np.memmap) and self.data.mode == 'r+':
+            self.data.flush()
+
+    def blocks(self, start=None, stop=None, signed=None):
+        """
+        Yield the samples from start to stop (the selection by default) in chunks,
+        converted to `signed` if given. Only one chunk is ever copied.
+        """
+        if start is None or stop is None:
+            start, stop = self.region
+        convert = signed is not None and signed != self.signed
+        for offset in range(start, stop, CHUNK_SAMPLES):
+            chunk = self.data[offset:min(offset + CHUNK_SAMPLES, stop)]
+            if convert:
+                chunk = (chunk.view(np.uint8) ^ 0x80).view(_dtype(signed))
+            yield chunk
+
+    def save_raw(self, path, signed=None):
+        """Write the selection to a raw .SAM/.SPL file. Returns the number of samples written."""
+        return write_raw(self.blocks(signed=signed), path)
+
+    def save_wav(self, path):
+        """Write the selection to an 8-bit WAV file. Returns the number of samples written."""
+        return write_wav(self.blocks(), path, self.sample_rate, self.signed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract an 8-bit sample region from a file to WAV or raw.")
+    parser.add_argument('source', help="File containing the samples, such as a disk or memory dump")
+    parser.add_argument('target', help="Output .SAM/.SPL raw sample, or .WAV")
+    parser.add_argument('--offset', type=lambda text: int(text, 0), default=0,
+                        help="Byte offset of the region (decimal, or 0x hex)")
+    parser.add_argument('--length', type=lambda text: int(text, 0), help="Length of the region (default to the end)")
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help=f"Sample rate for WAV output (default {DEFAULT_RATE})")
+    parser.add_argument('--signed', action='store_true', help="The source samples are signed (default unsigned)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--to-signed', dest='target_signed', action='store_const', const=True,
+                        help="Write signed raw samples")
+    target.add_argument('--to-unsigned', dest='target_signed', action='store_const', const=False,
+                        help="Write unsigned raw samples")
+    args = parser.parse_args(argv)
+
+    model = SampleModel.open(args.source, args.rate, args.signed, args.offset, args.length, mode='r')
+    if args.target.lower().endswith('.wav'):
+        count = model.save_wav(args.target)
+    else:
+        count = model.save_raw(args.target, args.target_signed)
+    print(f"{args.target}: {count} samples from offset {args.offset:#x}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
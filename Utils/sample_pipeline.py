@@ -0,0 +1,278 @@
+"""
+Streaming conversion of audio files to Atari ST 8-bit samples.
+
+Each stage is a generator over fixed-size blocks of frames, so memory use stays
+at a few blocks however long the input is:
+
+    read -> mixdown -> resample -> scale -> quantize -> write
+
+Blocks are float32 arrays of shape (frames, channels) in -1.0..1.0 until
+quantization (see sample_dither.py for the dither and noise shaping), which
+yields 1-D int8 (signed) or uint8 (unsigned) arrays for mono output, or
+(frames, channels) arrays when the channels are kept. 4-bit output, for YM
+volume levels or ADPCM encoding, is one level per byte. The resampler (see
+sample_resampler.py) carries its filter state from one block to the next, so
+block boundaries are seamless.
+
+WAV files are read with the wave module. Other formats are decoded by streaming
+16-bit PCM from ffmpeg (the converter pydub is configured with); if ffmpeg
+fails, as on a corrupt or truncated file, the stream raises ValueError with
+its error message rather than ending early.
+
+Usage:
+    python sample_pipeline.py input.wav output.sam --rate 15650
+    python sample_pipeline.py input.flac output.wav --rate 12517 --signed --mono first
+    python sample_pipeline.py input.wav output.sam --dither tpdf --shaping first
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from sample_resampler import DEFAULT_QUALITY, QUALITIES, make_resampler
+from sample_dither import BIT_DEPTHS, DITHER_MODES, NOISE_SHAPING, Quantizer
+
+DEFAULT_RATE = 15650
+BLOCK_FRAMES = 65536
+
+MONO_POLICIES = ('mix', 'first', 'keep')
+
+AudioInfo = namedtuple('AudioInfo', ['rate', 'channels', 'sample_width', 'frames'])
+ConversionResult = namedtuple('ConversionResult', ['frames_in', 'frames_out', 'rate', 'channels', 'peak'])
+
+
+def _is_wav(path):
+    try:
+        with wave.open(path, 'rb'):
+            return True
+    except (wave.Error, EOFError):
+        return False
+
+
+def read_info(path):
+    """Sample rate, channel count, sample width and length (None if unknown) of an audio file."""
+    if _is_wav(path):
+        with wave.open(path, 'rb') as wav_file:
+            return AudioInfo(wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getnframes())
+    from pydub.utils import mediainfo
+    info = mediainfo(path)
+    return AudioInfo(int(info['sample_rate']), int(info['channels']), 2, None)
+
+
+def decode_pcm(data, sample_width, channels):
+    """Convert little-endian PCM bytes to float32 frames in -1.0..1.0."""
+    if sample_width == 1:
+        # 8-bit WAV data is unsigned
+        samples = np.frombuffer(data, dtype=np.uint8).astype(np.float32)
+        samples -= 128.0
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8)
+                   | (raw[:, 2].astype(np.int8).astype(np.int32) << 16)).astype(np.float32)
+    else:
+        samples = np.frombuffer(data, dtype=f'<i{sample_width}').astype(np.float32)
+    samples *= 1.0 / float(2 ** (8 * sample_width - 1))
+    return samples.reshape(-1, channels)
+
+
+def _ffmpeg_stream(path, channels, block_frames):
+    from pydub import AudioSegment
+    command = [AudioSegment.converter, '-v', 'error', '-i', path, '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+    block_bytes = block_frames * 2 * channels
+    # Errors go to a file rather than a pipe, which ffmpeg could fill and block on while we read stdout
+    with tempfile.TemporaryFile() as errors:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors) as process:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                yield data
+            process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            message = errors.read().decode(errors='replace').strip().splitlines()
+            raise ValueError(f"ffmpeg could not decode '{path}' (exit status {process.returncode})"
+                             + (f": {message[-1]}" if message else ""))
+
+
+def read_blocks(path, block_frames=BLOCK_FRAMES):
+    """Yield float32 blocks of shape (frames, channels) from an audio file."""
+    info = read_info(path)
+    if _is_wav(path):
+        with wave.open(path, 'rb') as wav_file:
+            while True:
+                data = wav_file.readframes(block_frames)
+                if not data:
+                    break
+                yield decode_pcm(data, info.sample_width, info.channels)
+    else:
+        for data in _ffmpeg_stream(path, info.channels, block_frames):
+            yield decode_pcm(data, 2, info.channels)
+
+
+def mixdown(blocks, policy='mix'):
+    """
+    Reduce blocks to one channel: 'mix' averages the channels, 'first' keeps the
+    first channel, and 'keep' passes every channel through unchanged.
+    """
+    if policy not in MONO_POLICIES:
+        raise ValueError(f"Unknown mono policy '{policy}', expected one of {', '.join(MONO_POLICIES)}")
+    for block in blocks:
+        if policy == 'keep' or block.shape[1] == 1:
+            yield block
+        elif policy == 'first':
+            yield block[:, :1]
+        else:
+            yield block.mean(axis=1, dtype=np.float32, keepdims=True)
+
+
+def resample(blocks, source_rate, target_rate, quality=DEFAULT_QUALITY):
+    """Resample a stream of blocks, carrying filter state across block boundaries."""
+    if source_rate == target_rate:
+        yield from blocks
+        return
+    resampler = make_resampler(source_rate, target_rate, quality)
+    for block in blocks:
+        output = resampler.process(block)
+        if len(output):
+            yield output
+    tail = resampler.flush()
+    if len(tail):
+        yield tail
+
+
+def scale(blocks, gain=1.0):
+    """Apply a gain to blocks in place."""
+    for block in blocks:
+        if not block.flags.writeable:
+            block = block.copy()
+        block *= gain
+        yield block
+
+
+def quantize(blocks, signed=False, bits=8, dither='none', shaping='none', seed=0):
+    """Convert float blocks to int8 or uint8 samples, one channel per column."""
+    quantizer = Quantizer(bits, signed, dither, shaping, seed)
+    for block in blocks:
+        samples = quantizer.process(block)
+        yield samples[:, 0] if samples.shape[1] == 1 else samples
+
+
+def write_raw(blocks, file_path):
+    """Write sample blocks to a raw .SAM/.SPL file. Returns the number of frames written."""
+    frames = 0
+    with open(file_path, 'wb') as f:
+        for samples in blocks:
+            f.write(samples.tobytes())
+            frames += len(samples)
+    return frames
+
+
+def write_wav(blocks, file_path, sample_rate, signed=False, channels=1, bits=8):
+    """
+    Write sample blocks to an 8-bit WAV file, which is always unsigned.
+    4-bit samples are expanded to 8 bits so the result can be auditioned.
+    """
+    frames = 0
+    with wave.open(file_path, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(1)
+        wav_file.setframerate(sample_rate)
+        for samples in blocks:
+            if bits == 4:
+                samples = samples * np.array(16 if signed else 17, dtype=samples.dtype)
+            if signed:
+                samples = (samples.view(np.uint8) ^ 0x80)
+            wav_file.writeframes(samples.tobytes())
+            frames += len(samples)
+    return frames
+
+
+def collect(blocks):
+    """Concatenate a block stream into one array, for callers that need all the data."""
+    blocks = list(blocks)
+    if not blocks:
+        return np.zeros(0, dtype=np.uint8)
+    return np.concatenate(blocks)
+
+
+class _Meter:
+    """Passes blocks through while counting frames and tracking the peak level."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.frames = 0
+        self.peak = 0.0
+
+    def __iter__(self):
+        for block in self.blocks:
+            self.frames += len(block)
+            if len(block):
+                self.peak = max(self.peak, float(np.abs(block).max()))
+            yield block
+
+
+def pipeline(file_path, sample_rate=DEFAULT_RATE, signed=False, mono='mix', gain=1.0,
+             block_frames=BLOCK_FRAMES, quality=DEFAULT_QUALITY, bits=8, dither='none', shaping='none'):
+    """Build the block generator chain for a file; nothing is read until it is iterated."""
+    info = read_info(file_path)
+    blocks = read_blocks(file_path, block_frames)
+    blocks = mixdown(blocks, mono)
+    blocks = resample(blocks, info.rate, sample_rate, quality)
+    blocks = scale(blocks, gain)
+    return quantize(blocks, signed, bits, dither, shaping)
+
+
+def convert_file(source_path, target_path, sample_rate=DEFAULT_RATE, signed=False, mono='mix',
+                 gain=1.0, block_frames=BLOCK_FRAMES, quality=DEFAULT_QUALITY, bits=8, dither='none',
+                 shaping='none'):
+    """
+    Convert an audio file to a raw Atari sample, or an 8-bit WAV if the target
+    ends in .wav. Returns a ConversionResult; peak is the input level, 0.0 to 1.0.
+    """
+    info = read_info(source_path)
+    source = _Meter(read_blocks(source_path, block_frames))
+    blocks = mixdown(source, mono)
+    blocks = resample(blocks, info.rate, sample_rate, quality)
+    blocks = quantize(scale(blocks, gain), signed, bits, dither, shaping)
+    channels = info.channels if mono == 'keep' else 1
+    if target_path.lower().endswith('.wav'):
+        frames = write_wav(blocks, target_path, sample_rate, signed, channels, bits)
+    else:
+        frames = write_raw(blocks, target_path)
+    return ConversionResult(source.frames, frames, sample_rate, channels, source.peak)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert audio to Atari ST 8-bit samples, streaming in blocks.")
+    parser.add_argument('source', help="Input audio file (WAV, or anything ffmpeg can decode)")
+    parser.add_argument('target', help="Output .SAM/.SPL raw sample, or .WAV")
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help=f"Target sample rate (default {DEFAULT_RATE})")
+    parser.add_argument('--signed', action='store_true', help="Write signed samples (default unsigned)")
+    parser.add_argument('--mono', choices=MONO_POLICIES, default='mix',
+                        help="Mix channels down, keep the first, or keep them all (default mix)")
+    parser.add_argument('--quality', choices=QUALITIES, default=DEFAULT_QUALITY,
+                        help=f"Resampler quality (default {DEFAULT_QUALITY})")
+    parser.add_argument('--bits', type=int, choices=BIT_DEPTHS, default=8,
+                        help="Sample depth; 4 gives one YM/ADPCM level per byte (default 8)")
+    parser.add_argument('--dither', choices=DITHER_MODES, default='none',
+                        help="Dither before quantizing (default none, which truncates)")
+    parser.add_argument('--shaping', choices=list(NOISE_SHAPING), default='none',
+                        help="Error-feedback noise shaping (default none)")
+    parser.add_argument('--block', type=int, default=BLOCK_FRAMES, help=f"Frames per block (default {BLOCK_FRAMES})")
+    args = parser.parse_args(argv)
+
+    result = convert_file(args.source, args.target, args.rate, args.signed, args.mono,
+                          block_frames=args.block, quality=args.quality, bits=args.bits,
+                          dither=args.dither, shaping=args.shaping)
+    print(f"{args.source}: {result.frames_in} frames -> {result.frames_out} frames at {result.rate} Hz, "
+          f"{result.channels} channel(s), input peak {result.peak:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
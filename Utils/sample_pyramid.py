@@ -0,0 +1,137 @@
+"""
+Multi-resolution summary of a sample for fast waveform drawing.
+
+WaveformPyramid reduces the samples once into levels of min, max, mean,
+absolute mean and mean square per bin, with bins of 32, 64, 128... samples. A
+view of any range is then drawn from the finest level whose bins still cover
+at least a pixel each, so the work per redraw depends on the width of the plot
+rather than the length of the sample. Views zoomed in closer than the first
+level read the samples directly, which is again at most a few thousand values.
+
+The first level is built in chunks, so the samples can be a memory-mapped file.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Samples per bin at the finest level; closer views read the samples themselves
+BASE_BIN = 32
+
+# Samples reduced at a time when building the first level
+_CHUNK = 1 << 20
+
+Level = namedtuple('Level', ['bin', 'minimum', 'maximum', 'mean', 'mean_abs', 'mean_square'])
+
+# What a view needs to draw any of the aggregation methods: x is the sample
+# number at the centre of each point, the rest are per point.
+Envelope = namedtuple('Envelope', ['x', 'minimum', 'maximum', 'mean', 'mean_abs', 'rms'])
+
+
+def _reduce(minimum, maximum, mean, mean_abs, mean_square, factor):
+    """Combine each run of `factor` bins into one, dropping any incomplete run at the end."""
+    count = len(minimum) // factor
+    size = count * factor
+    return (
+        minimum[:size].reshape(count, factor).min(axis=1),
+        maximum[:size].reshape(count, factor).max(axis=1),
+        mean[:size].reshape(count, factor).mean(axis=1),
+        mean_abs[:size].reshape(count, factor).mean(axis=1),
+        mean_square[:size].reshape(count, factor).mean(axis=1),
+    )
+
+
+def _summarize(samples, factor):
+    """Per-bin statistics of raw samples, `factor` samples to a bin."""
+    count = len(samples) // factor
+    raw = samples[:count * factor].reshape(count, factor)
+    block = raw.astype(np.float32)
+    # Extremes stay in the sample type, which keeps 8-bit pyramids small
+    return (
+        raw.min(axis=1),
+        raw.max(axis=1),
+        block.mean(axis=1),
+        np.abs(block).mean(axis=1),
+        np.square(block).mean(axis=1),
+    )
+
+
+class WaveformPyramid:
+    """Power-of-two levels of per-bin statistics, computed once per load."""
+
+    def __init__(self, samples, base=BASE_BIN):
+        self.samples = samples
+        self.length = len(samples)
+        self.base = base
+        self.levels = []
+
+        count = self.length // base
+        if count == 0:
+            return
+        parts = []
+        step = max(base, _CHUNK - _CHUNK % base)
+        for start in range(0, count * base, step):
+            parts.append(_summarize(self.samples[start:min(start + step, count * base)], base))
+        stats = tuple(np.concatenate(column) for column in zip(*parts))
+        bin_size = base
+        while True:
+            self.levels.append(Level(bin_size, *stats))
+            if len(stats[0]) < 2:
+                break
+            if len(stats[0]) % 2:
+                # Repeat the last bin so the end of the sample still shows at coarse levels
+                stats = tuple(np.append(column, column[-1:]) for column in stats)
+            stats = _reduce(*stats, 2)
+            bin_size *= 2
+
+    @property
+    def limits(self):
+        """(minimum, maximum) sample value over the whole sample."""
+        if self.levels:
+            top = self.levels[-1]
+            low, high = float(top.minimum.min()), float(top.maximum.max())
+            # The coarsest level can miss a tail shorter than the first bin
+            tail = self.samples[len(self.levels[0].minimum) * self.base:]
+            if len(tail):
+                low, high = min(low, float(tail.min())), max(high, float(tail.max()))
+            return low, high
+        if self.length:
+            return float(self.samples.min()), float(self.samples.max())
+        return 0.0, 0.0
+
+    def window(self, start, stop, pixels):
+        """Envelope of samples[start:stop] at roughly one point per pixel."""
+        start = max(0, int(start))
+        stop = min(self.length, int(stop))
+        pixels = max(1, int(pixels))
+        count = stop - start
+        if count <= 0:
+            empty = np.zeros(0, dtype=np.float32)
+            return Envelope(empty, empty, empty, empty, empty, empty)
+
+        per_pixel = count / pixels
+        if per_pixel < 2:
+            # Close enough to see individual samples
+            values = self.samples[start:stop].astype(np.float32)
+            return Envelope(np.arange(start, stop, dtype=np.float64), values, values, values,
+                            np.abs(values), np.abs(values))
+
+        if per_pixel < self.base or not self.levels:
+            factor = int(per_pixel)
+            stats = _summarize(self.samples[start:stop], factor)
+            bin_size = factor
+            first = start
+        else:
+            index = min(len(self.levels) - 1, int(np.log2(per_pixel / self.base)))
+            level = self.levels[index]
+            first_bin = start // level.bin
+            last_bin = min(len(level.minimum), -(-stop // level.bin))
+            stats = tuple(column[first_bin:last_bin] for column in level[1:])
+            factor = max(1, (last_bin - first_bin) // pixels)
+            if factor > 1:
+                stats = _reduce(*stats, factor)
+            bin_size = level.bin * factor
+            first = first_bin * level.bin
+
+        minimum, maximum, mean, mean_abs, mean_square = stats
+        x = np.minimum(first + (np.arange(len(minimum)) + 0.5) * bin_size, stop)
+        return Envelope(x, minimum, maximum, mean, mean_abs, np.sqrt(mean_square))
@@ -0,0 +1,225 @@
+"""
+Spectral and level analysis of an audio file before converting it.
+
+analyze streams the file through the pipeline's reader and mixdown, cuts it
+into Hann-windowed frames with 50% overlap and transforms a whole block of
+frames with one rfft. It keeps the mean power spectrum, the peak and RMS level
+and, in dB as float16, every frame's spectrum for drawing a spectrogram, so a
+five minute track is analysed in one pass and a couple of seconds.
+
+report turns that into what the converter's rate and level choices cost:
+
+    above Nyquist   share of the energy above each ST/STE rate's Nyquist
+                    frequency, which the resampler's filter removes (or
+                    which aliases back with linear resampling)
+    peak / RMS      in dBFS, with the crest factor between them
+    SNR             8-bit quantization SNR at the file's level, as
+                    converted (full scale maps to +/-127), with TPDF dither
+                    (three times the noise power), and if normalized to peak
+    bandwidth       frequency below which 99.9% of the energy lies
+
+Usage:
+    python sample_spectrum.py input.wav
+    python sample_spectrum.py input.flac --fft 4096 --png spectrogram.png
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from sample_pipeline import BLOCK_FRAMES, read_blocks, read_info, mixdown
+from sample_resampler import ATARI_RATES
+
+DEFAULT_FFT = 2048
+
+# Share of the energy the reported bandwidth covers
+BANDWIDTH_ENERGY = 0.999
+
+# Power floor for logarithms, well below the 16-bit noise floor
+_FLOOR = 1e-12
+
+RateReport = namedtuple('RateReport', ['rate', 'nyquist', 'above_db', 'above_percent'])
+LevelReport = namedtuple('LevelReport', ['peak_db', 'rms_db', 'crest_db', 'snr_db', 'snr_tpdf_db',
+                                         'snr_normalized_db', 'bandwidth'])
+
+
+def _db(power):
+    return 10 * np.log10(max(power, _FLOOR))
+
+
+class SpectrumAnalysis:
+    """Mean spectrum, levels and spectrogram frames of a mono mix of a file."""
+
+    def __init__(self, rate, fft_size=DEFAULT_FFT):
+        self.rate = rate
+        self.fft_size = fft_size
+        self.hop = fft_size // 2
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.frequencies = np.fft.rfftfreq(fft_size, 1.0 / rate)
+        self.power_sum = np.zeros(len(self.frequencies), dtype=np.float64)
+        self.frame_count = 0
+        self.samples = 0
+        self.peak = 0.0
+        self.square_sum = 0.0
+        self.columns = []
+        self.carry = np.zeros(0, dtype=np.float32)
+
+    def add(self, samples, keep_spectrogram=True):
+        """Analyse the next 1-D block of samples."""
+        self.samples += len(samples)
+        if len(samples):
+            self.peak = max(self.peak, float(np.abs(samples).max()))
+            self.square_sum += float(np.dot(samples, samples))
+        buffer = np.concatenate((self.carry, samples))
+        if len(buffer) < self.fft_size:
+            self.carry = buffer
+            return
+        frames = sliding_window_view(buffer, self.fft_size)[::self.hop]
+        self._transform(frames, keep_spectrogram)
+        self.carry = buffer[len(frames) * self.hop:]
+
+    def finish(self, keep_spectrogram=True):
+        """Analyse the samples left over at the end, padded with silence to a full frame."""
+        if len(self.carry) > self.hop or self.frame_count == 0:
+            frame = np.zeros(self.fft_size, dtype=np.float32)
+            frame[:len(self.carry)] = self.carry[:self.fft_size]
+            self._transform(frame[None, :], keep_spectrogram)
+        self.carry = np.zeros(0, dtype=np.float32)
+
+    def _transform(self, frames, keep_spectrogram):
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        self.power_sum += power.sum(axis=0)
+        self.frame_count += len(frames)
+        if keep_spectrogram:
+            self.columns.append((10 * np.log10(power + _FLOOR)).astype(np.float16))
+
+    @property
+    def spectrogram(self):
+        """Frame spectra in dB, shape (frames, bins)."""
+        if len(self.columns) > 1:
+            self.columns = [np.concatenate(self.columns)]
+        return self.columns[0] if self.columns else np.zeros((0, len(self.frequencies)), dtype=np.float16)
+
+    @property
+    def mean_power(self):
+        return self.power_sum / max(1, self.frame_count)
+
+    @property
+    def rms(self):
+        return np.sqrt(self.square_sum / max(1, self.samples))
+
+    def energy_above(self, frequency):
+        """Share of the energy above a frequency, 0.0 to 1.0."""
+        total = self.power_sum.sum()
+        return float(self.power_sum[self.frequencies > frequency].sum() / total) if total else 0.0
+
+    def bandwidth(self, share=BANDWIDTH_ENERGY):
+        """Frequency below which `share` of the energy lies."""
+        cumulative = np.cumsum(self.power_sum)
+        if not cumulative[-1]:
+            return 0.0
+        return float(self.frequencies[np.searchsorted(cumulative, share * cumulative[-1])])
+
+
+def analyze(file_path, fft_size=DEFAULT_FFT, mono='mix', keep_spectrogram=True, block_frames=BLOCK_FRAMES):
+    """Analyse an audio file, mixed down as the converter would ('mix' or 'first')."""
+    if mono not in ('mix', 'first'):
+        raise ValueError(f"Unknown mono policy '{mono}', expected one of mix, first")
+    analysis = SpectrumAnalysis(read_info(file_path).rate, fft_size)
+    for block in mixdown(read_blocks(file_path, block_frames), mono):
+        analysis.add(block[:, 0], keep_spectrogram)
+    analysis.finish(keep_spectrogram)
+    return analysis
+
+
+def rate_report(analysis, rates=ATARI_RATES):
+    """Energy above the Nyquist frequency of each rate."""
+    reports = []
+    for rate in rates:
+        share = analysis.energy_above(rate / 2)
+        reports.append(RateReport(rate, rate / 2, _db(share), 100.0 * share))
+    return reports
+
+
+def level_report(analysis, bits=8):
+    """Peak, RMS, crest factor and quantization SNR at the given bit depth."""
+    peak_db = 20 * np.log10(max(analysis.peak, 1e-6))
+    rms_db = 20 * np.log10(max(analysis.rms, 1e-6))
+    # Full scale is +/-127 steps for 8 bits; rounding noise is a twelfth of a step squared
+    step = 1.0 / ((1 << (bits - 1)) - 1)
+    noise_db = _db(step * step / 12)
+    snr_db = rms_db - noise_db
+    return LevelReport(peak_db, rms_db, peak_db - rms_db, snr_db, snr_db - 10 * np.log10(3),
+                       snr_db - peak_db, analysis.bandwidth())
+
+
+def spectrogram_image(analysis, columns=1000, max_frequency=None):
+    """
+    The spectrogram reduced to at most `columns` time columns, taking the loudest
+    frame in each group so transients survive, as (bins, columns) dB plus the
+    (time_start, time_end, frequency_low, frequency_high) extent.
+    """
+    frames = analysis.spectrogram.astype(np.float32)
+    bins = len(analysis.frequencies)
+    if max_frequency is not None:
+        bins = int(np.searchsorted(analysis.frequencies, max_frequency, side='right'))
+        frames = frames[:, :bins]
+    group = max(1, -(-len(frames) // columns))
+    count = -(-len(frames) // group)
+    padded = np.full((count * group, frames.shape[1]), -120.0, dtype=np.float32)
+    padded[:len(frames)] = frames
+    image = padded.reshape(count, group, -1).max(axis=1).T
+    duration = analysis.samples / analysis.rate
+    return image, (0.0, duration, 0.0, float(analysis.frequencies[bins - 1]))
+
+
+def format_report(analysis, rates=ATARI_RATES):
+    """The analysis as lines of text, as the CLI prints it and the converter shows it."""
+    levels = level_report(analysis)
+    lines = [
+        f"{analysis.samples / analysis.rate:.1f} s at {analysis.rate} Hz",
+        f"Peak {levels.peak_db:.1f} dBFS, RMS {levels.rms_db:.1f} dBFS, crest factor {levels.crest_db:.1f} dB",
+        f"8-bit SNR {levels.snr_db:.1f} dB ({levels.snr_tpdf_db:.1f} dB with TPDF dither, "
+        f"{levels.snr_normalized_db:.1f} dB normalized to peak)",
+        f"99.9% of the energy is below {levels.bandwidth:.0f} Hz",
+        "",
+        f"{'Rate':>6} {'Nyquist':>8} {'Above dB':>9} {'Above %':>8}",
+    ]
+    for report in rate_report(analysis, rates):
+        lines.append(f"{report.rate:>6} {report.nyquist:>8.0f} {report.above_db:>9.1f} {report.above_percent:>8.3f}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the spectrum and levels of audio before converting it.")
+    parser.add_argument('source', help="Input audio file")
+    parser.add_argument('--fft', type=int, default=DEFAULT_FFT, help=f"FFT frame size (default {DEFAULT_FFT})")
+    parser.add_argument('--mono', choices=('mix', 'first'), default='mix', help="Mono policy (default mix)")
+    parser.add_argument('--png', help="Save the spectrogram to this image (needs matplotlib)")
+    args = parser.parse_args(argv)
+
+    analysis = analyze(args.source, args.fft, args.mono, keep_spectrogram=bool(args.png))
+    print("\n".join(format_report(analysis)))
+
+    if args.png:
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib.figure import Figure
+        image, extent = spectrogram_image(analysis)
+        fig = Figure(figsize=(12, 6), dpi=100)
+        ax = fig.add_subplot(111)
+        ax.imshow(image, origin='lower', aspect='auto', extent=extent, cmap='magma', vmin=image.max() - 90)
+        for rate in ATARI_RATES:
+            ax.axhline(rate / 2, color='cyan', linewidth=0.5)
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Frequency (Hz)")
+        fig.tight_layout()
+        fig.savefig(args.png)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
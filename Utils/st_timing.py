@@ -0,0 +1,220 @@
+"""
+Atari ST bus timing model layered on the 68000 cycle table.
+
+The ST's shared bus only gives the CPU a memory slot every 4 cycles, so an
+instruction that would end 2 cycles past a slot is stretched to the next
+multiple of 4. A few instruction pairs can share that wait (the first ends
+misaligned, the second starts with an internal cycle), in which case the pair
+is rounded as a whole. The cycle table's figures are already ST-rounded, so
+pairs are costed from the true 68000 times of the instructions involved.
+Results are reported in NOPs, 4 cycles each, which is
+the unit that sync-scroll and fullscreen code is counted in.
+"""
+from collections import namedtuple
+
+from cycle_table import CycleTable, EAMode, SHIFT_MNEMONICS, parse_instruction, operand_mode, canonical_mnemonic
+
+NOP_CYCLES = 4
+SCANLINE_NOPS = 128
+SCANLINE_CYCLES = SCANLINE_NOPS * NOP_CYCLES
+
+# Cycles per frame: 313 lines of 512 cycles at 50 Hz, 263 lines of 508 at 60 Hz
+VBL_CYCLES = {50: 313 * 512, 60: 263 * 508}
+
+BUDGETS = {
+    'Scanline': SCANLINE_CYCLES,
+    'VBL 50 Hz': VBL_CYCLES[50],
+    'VBL 60 Hz': VBL_CYCLES[60],
+}
+
+# Bus access granularity in cycles. The STE's CPU bus timing matches the ST;
+# '68000' applies no rounding of its own, though the shipped table's figures
+# are mostly ST-rounded already.
+MACHINES = {
+    '68000': 1,
+    'ST': 4,
+    'STE': 4,
+}
+
+# Instructions that can end on a misaligned internal cycle and pair with the next.
+# MULU/DIVU and friends also end misaligned, but by an amount that depends on
+# the data, so they are not paired.
+PAIRING_FIRST = {'exg', 'cmpa', 'adda', 'suba'} | SHIFT_MNEMONICS
+
+# Addressing modes that begin with an internal cycle the pair can absorb
+PAIRING_SECOND_MODES = {EAMode.INDEX, EAMode.PC_INDEX}
+
+# 68000 effective address times (byte/word, long). The table holds ST-rounded
+# figures, so pairing works from these instead.
+EA_CYCLES = {
+    EAMode.DN: (0, 0), EAMode.AN: (0, 0), EAMode.IND: (4, 8), EAMode.POSTINC: (4, 8),
+    EAMode.PREDEC: (6, 10), EAMode.DISP: (8, 12), EAMode.INDEX: (10, 14), EAMode.ABS_W: (8, 12),
+    EAMode.ABS_L: (12, 16), EAMode.PC_DISP: (8, 12), EAMode.PC_INDEX: (10, 14), EAMode.IMM: (4, 8),
+}
+
+# An indexed EA takes 10 or 14 cycles, 2 past a bus slot, which the table rounds up
+INDEX_ROUNDING = 2
+
+
+def _immediate(operand):
+    """Value of an immediate operand such as #3 or #$3, or None."""
+    text = operand.strip().lstrip('#')
+    try:
+        return int(text[1:], 16) if text.startswith('$') else int(text)
+    except ValueError:
+        return None
+
+
+def pairing_first_cycles(instruction):
+    """
+    True 68000 cycles of an instruction that can open a pair, or None when it
+    cannot: exg 6, register shifts 6+2n (8+2n for longs), cmpa and adda/suba
+    6 or 8 plus the source EA time.
+    """
+    mnemonic, size, operands = parse_instruction(instruction)
+    modes = [operand_mode(op) for op in operands]
+    mnemonic = canonical_mnemonic(mnemonic, modes)
+    if mnemonic not in PAIRING_FIRST:
+        return None
+    if mnemonic == 'exg':
+        return 6
+    if mnemonic in SHIFT_MNEMONICS:
+        # Memory shifts are even in bus slots, and register counts depend on the data
+        if len(operands) != 2 or modes[0] != EAMode.IMM:
+            return None
+        count = _immediate(operands[0])
+        if count is None:
+            return None
+        return (8 if size == 'l' else 6) + 2 * count
+    if len(modes) != 2 or modes[0] not in EA_CYCLES:
+        return None
+    long = size == 'l'
+    ea = EA_CYCLES[modes[0]][long]
+    if mnemonic == 'cmpa':
+        return 6 + ea
+    # ADDA.L and SUBA.L take 8 from a register or immediate, 6 plus the EA otherwise
+    if long and modes[0] in (EAMode.DN, EAMode.AN, EAMode.IMM):
+        return 8 + ea
+    return (6 if long else 8) + ea
+
+
+def pairing_second_cycles(instruction, cycles):
+    """
+    True 68000 cycles of an instruction that can close a pair, given its table
+    figure, or None: it must have exactly one indexed operand.
+    """
+    _, _, operands = parse_instruction(instruction)
+    if sum(operand_mode(op) in PAIRING_SECOND_MODES for op in operands) != 1:
+        return None
+    return cycles - INDEX_ROUNDING if cycles % NOP_CYCLES == 0 else cycles
+
+
+Entry = namedtuple('Entry', ['instruction', 'raw', 'cycles', 'paired'])
+
+
+def to_nops(cycles):
+    return cycles / NOP_CYCLES
+
+
+class SequenceTiming:
+    """Timing of a straight-line instruction sequence under a machine model."""
+
+    def __init__(self, machine, entries):
+        self.machine = machine
+        self.entries = entries
+
+    @property
+    def unknown(self):
+        return [entry.instruction for entry in self.entries if entry.cycles is None]
+
+    @property
+    def raw_cycles(self):
+        return sum(entry.raw for entry in self.entries if entry.raw is not None)
+
+    @property
+    def cycles(self):
+        return sum(entry.cycles for entry in self.entries if entry.cycles is not None)
+
+    @property
+    def nops(self):
+        return to_nops(self.cycles)
+
+    @property
+    def scanlines(self):
+        return self.cycles / SCANLINE_CYCLES
+
+    def check_budget(self, budget_cycles):
+        """Return (fits, remaining NOPs); remaining is negative when over budget."""
+        remaining = budget_cycles - self.cycles
+        return remaining >= 0, to_nops(remaining)
+
+
+class TimingModel:
+    """Applies a machine's bus rounding and pairing rules to table timings."""
+
+    def __init__(self, machine='ST', table=None, pairing=True):
+        if machine not in MACHINES:
+            raise ValueError(f"Unknown machine '{machine}', expected one of {', '.join(MACHINES)}")
+        self.machine = machine
+        self.granularity = MACHINES[machine]
+        self.pairing = pairing and self.granularity > 1
+        self.table = table if table is not None else CycleTable.load()
+
+    def round(self, cycles):
+        if cycles is None:
+            return None
+        return -(-cycles // self.granularity) * self.granularity
+
+    def _pair_cycles(self, first, second, second_cycles):
+        """Rounded cycles of the two instructions run as a pair, or None if they do not pair."""
+        first_raw = pairing_first_cycles(first)
+        second_raw = pairing_second_cycles(second, second_cycles)
+        if first_raw is None or second_raw is None:
+            return None
+        if first_raw % self.granularity == 0 or second_raw % self.granularity == 0:
+            return None
+        return self.round(first_raw + second_raw)
+
+    def adjust(self, timed):
+        """
+        Round a sequence of (instruction, Timing) pairs for this machine.
+        Timing may be None for unknown instructions. Returns the adjusted Timings,
+        with any pairing saving taken off the second instruction of the pair.
+        """
+        adjusted = []
+        previous = None
+        for instruction, timing in timed:
+            if timing is None:
+                adjusted.append(None)
+                previous = None
+                continue
+            cycles = self.round(timing.cycles)
+            paired = None
+            if self.pairing and previous is not None and timing.not_taken is None:
+                paired = self._pair_cycles(previous[0], instruction, timing.cycles)
+            if paired is not None:
+                cycles -= self.round(previous[1]) + cycles - paired
+                # An instruction can only belong to one pair
+                previous = None
+            else:
+                previous = (instruction, timing.cycles)
+            adjusted.append(timing._replace(cycles=cycles, not_taken=self.round(timing.not_taken)))
+        return adjusted
+
+    def time_sequence(self, instructions):
+        """Cost a list of instruction strings, taking the worst case of any branch."""
+        timed = [(text, self.table.lookup(text)) for text in instructions]
+        entries = []
+        for (text, raw), timing in zip(timed, self.adjust(timed)):
+            if timing is None:
+                entries.append(Entry(text, None, None, False))
+                continue
+            raw_cycles = raw.cycles if raw.not_taken is None else max(raw.cycles, raw.not_taken)
+            cycles = timing.cycles if timing.not_taken is None else max(timing.cycles, timing.not_taken)
+            entries.append(Entry(text, raw_cycles, cycles, cycles < self.round(raw.cycles)))
+        return SequenceTiming(self.machine, entries)
+
+
+def time_sequence(instructions, machine='ST', table=None):
+    """Convenience wrapper: time a list of instruction strings on a machine."""
+    return TimingModel(machine, table).time_sequence(instructions)
@@ -0,0 +1,144 @@
+"""
+Export audio as STE DMA sound at several replay rates in one pass.
+
+The STE DMA chip plays signed 8-bit samples, mono or stereo interleaved (left
+byte first), at 6258, 12517, 25033 or 50066 Hz. The hardware rates are
+50066 Hz divided by 1, 2, 4 and 8, so rather than resampling the source once per
+rate, the source is decoded and resampled once, to the highest rate wanted, and
+each lower rate is a decimation by two of the one above it. Decoding, mixdown
+and the expensive odd-ratio filter are shared, and every further rate costs a
+short half-band filter on half as many frames as the rate above it.
+
+Each rate is quantized separately (with its own dither state) and written to
+its own raw file. DMA frame buffers must start and end on a word boundary, so
+mono output with an odd number of frames is padded with one byte of silence.
+
+Usage:
+    python ste_dma.py input.wav drum --rates 12517 25033
+    python ste_dma.py input.wav music --stereo --rates 25033 50066 --dither tpdf
+
+writes drum.12517.SPL and drum.25033.SPL, and reports what each rate costs in
+bytes per second.
+"""
+import argparse
+import os
+import sys
+from collections import namedtuple
+
+from sample_pipeline import BLOCK_FRAMES, read_blocks, read_info, mixdown
+from sample_resampler import DEFAULT_QUALITY, QUALITIES, make_resampler
+from sample_dither import DITHER_MODES, NOISE_SHAPING, Quantizer
+
+STE_RATES = (6258, 12517, 25033, 50066)
+
+DmaExport = namedtuple('DmaExport', ['rate', 'path', 'frames', 'bytes', 'bytes_per_second', 'seconds'])
+
+
+class _DmaWriter:
+    """Quantizes blocks at one rate to signed 8-bit DMA frames and writes them."""
+
+    def __init__(self, path, rate, channels, dither, shaping, gain):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.gain = gain
+        self.quantizer = Quantizer(8, True, dither, shaping)
+        self.file = open(path, 'wb')
+        self.frames = 0
+        self.bytes = 0
+
+    def write(self, block):
+        if not len(block):
+            return
+        samples = self.quantizer.process(block * self.gain)
+        # (frames, 2) int8 rows are already left/right interleaved
+        self.file.write(samples.tobytes())
+        self.frames += len(samples)
+        self.bytes += samples.size
+
+    def close(self):
+        if self.bytes % 2:
+            self.file.write(b'\0')
+            self.bytes += 1
+        self.file.close()
+        return DmaExport(self.rate, self.path, self.frames, self.bytes, self.rate * self.channels,
+                         self.frames / self.rate)
+
+
+def export_rates(source_path, prefix, rates=STE_RATES, stereo=False, quality=DEFAULT_QUALITY, dither='none',
+                 shaping='none', gain=1.0, block_frames=BLOCK_FRAMES):
+    """
+    Write prefix.<rate>.SPL for each STE rate in `rates`, from a single decode of
+    the source. Returns a DmaExport per rate, highest rate first.
+    """
+    rates = sorted(set(rates), reverse=True)
+    for rate in rates:
+        if rate not in STE_RATES:
+            raise ValueError(f"Unsupported STE rate {rate}, expected one of {', '.join(map(str, STE_RATES))}")
+    # Every hardware rate from the highest wanted down to the lowest, each half the one above
+    chain = [rate for rate in sorted(STE_RATES, reverse=True) if rates[-1] <= rate <= rates[0]]
+
+    info = read_info(source_path)
+    channels = 2 if stereo else 1
+    blocks = read_blocks(source_path, block_frames)
+    if stereo:
+        if info.channels == 1:
+            # Mono sources play the same sample on both sides
+            blocks = (block.repeat(2, axis=1) for block in blocks)
+        else:
+            blocks = (block[:, :2] for block in blocks)
+    else:
+        blocks = mixdown(blocks, 'mix')
+
+    first = None if info.rate == chain[0] else make_resampler(info.rate, chain[0], quality)
+    halvers = [make_resampler(2, 1, quality) for _ in chain[1:]]
+    writers = [_DmaWriter(f"{prefix}.{rate}.SPL", rate, channels, dither, shaping, gain) if rate in rates else None
+               for rate in chain]
+
+    def push(level, block):
+        while level < len(chain) and len(block):
+            if writers[level]:
+                writers[level].write(block)
+            if level + 1 < len(chain):
+                block = halvers[level].process(block)
+            level += 1
+
+    try:
+        for block in blocks:
+            push(0, first.process(block) if first else block)
+        if first:
+            push(0, first.flush())
+        # Each halver has seen all its input once the levels above it are flushed
+        for level, halver in enumerate(halvers):
+            push(level + 1, halver.flush())
+    finally:
+        results = [writer.close() for writer in writers if writer]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export audio as STE DMA samples at several rates in one pass.")
+    parser.add_argument('source', help="Input audio file")
+    parser.add_argument('prefix', help="Output prefix; each rate is written to PREFIX.RATE.SPL")
+    parser.add_argument('--rates', type=int, nargs='+', choices=STE_RATES, default=list(STE_RATES),
+                        help="STE rates to export (default all)")
+    parser.add_argument('--stereo', action='store_true', help="Write interleaved stereo (default mono mixdown)")
+    parser.add_argument('--quality', choices=QUALITIES, default=DEFAULT_QUALITY,
+                        help=f"Resampler quality (default {DEFAULT_QUALITY})")
+    parser.add_argument('--dither', choices=DITHER_MODES, default='none', help="Dither (default none)")
+    parser.add_argument('--shaping', choices=list(NOISE_SHAPING), default='none', help="Noise shaping (default none)")
+    parser.add_argument('--gain', type=float, default=1.0, help="Gain applied before quantizing (default 1.0)")
+    args = parser.parse_args(argv)
+
+    results = export_rates(args.source, args.prefix, args.rates, args.stereo, args.quality, args.dither,
+                           args.shaping, args.gain)
+    print(f"{'Rate':>6} {'Frames':>9} {'Bytes':>9} {'Bytes/s':>8} {'Seconds':>8}  File")
+    for result in results:
+        print(f"{result.rate:>6} {result.frames:>9} {result.bytes:>9} {result.bytes_per_second:>8} "
+              f"{result.seconds:>8.2f}  {os.path.basename(result.path)}")
+    print(f"Total {sum(result.bytes for result in results)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Build many lookup tables from one bundle config, as one binary with an offset
+header, an assembler include and a C header.
+
+A bundle config is JSON with a name and a list of tables, each with the
+settings of a function table generator .cfg (function, expression, ranges,
+scale, entries, size) plus:
+
+    name        identifier for the table's label, equates and C array
+    signed      whether entries are signed (default true)
+    align       byte alignment of the table's start (default 1 for 8-bit
+                entries, 2 otherwise, as the 68000 needs for word reads)
+
+    {"name": "demo", "tables": [
+        {"name": "sine", "function": "SIN", "range_min": 0, "range_max": 359.6484375,
+         "entries": 1024, "scale": 32767, "size": 16},
+        {"name": "recip", "function": "Expression", "expression": "65536 / x",
+         "range_min": 1, "range_max": 256, "entries": 256, "scale": 1, "size": 32, "signed": false}
+    ]}
+
+The binary starts with a word count of tables and a long offset to each table
+from the start of the binary, then the tables, padded to their alignment.
+Each table is converted with one big-endian astype and tobytes, so a bundle
+of dozens of tables builds in milliseconds. A value that does not fit its
+entry size is an error rather than being clipped.
+
+The assembler include holds the same bytes as dc.b/dc.w/dc.l with a label
+per table, and the C header holds offset and size defines and an array per
+table.
+
+Usage:
+    python table_bundle.py demo.json --output demo
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from function_tables import generate
+
+ENTRY_SIZES = (8, 16, 32)
+
+# Values per line of the assembler and C output
+LINE_VALUES = 16
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_ASM_DIRECTIVES = {8: 'dc.b', 16: 'dc.w', 32: 'dc.l'}
+_C_TYPES = {(8, True): 'signed char', (8, False): 'unsigned char', (16, True): 'short',
+            (16, False): 'unsigned short', (32, True): 'long', (32, False): 'unsigned long'}
+
+BundleTable = namedtuple('BundleTable', ['name', 'values', 'size', 'signed', 'align', 'offset', 'data'])
+
+
+def entry_dtype(size, signed=True):
+    """Big-endian dtype of an entry size in bits."""
+    if size not in ENTRY_SIZES:
+        raise ValueError(f"Unknown entry size {size}, expected one of {', '.join(map(str, ENTRY_SIZES))}")
+    return np.dtype(f"{'>i' if signed else '>u'}{size // 8}")
+
+
+def table_bytes(values, size, signed=True, name='table'):
+    """The table's entries as big-endian bytes, rows first for a 2-D table."""
+    dtype = entry_dtype(size, signed)
+    limits = np.iinfo(dtype)
+    if values.size and (values.min() < limits.min or values.max() > limits.max):
+        raise ValueError(f"Table '{name}' has values {values.min()}..{values.max()}, "
+                         f"outside the {limits.min}..{limits.max} of {'signed' if signed else 'unsigned'} "
+                         f"{size}-bit entries")
+    return values.astype(dtype).tobytes()
+
+
+def load_bundle(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def build(bundle):
+    """Generate every table of a bundle config. Returns (binary, [BundleTable])."""
+    definitions = bundle['tables']
+    names = [definition['name'] for definition in definitions]
+    for name in names:
+        if not _IDENTIFIER.match(name):
+            raise ValueError(f"Table name '{name}' is not a valid identifier")
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate table names: {', '.join(sorted(duplicates))}")
+
+    header_size = 2 + 4 * len(definitions)
+    position = header_size
+    tables = []
+    for definition in definitions:
+        size = int(definition.get('size', 16))
+        signed = bool(definition.get('signed', True))
+        align = int(definition.get('align', 1 if size == 8 else 2))
+        if align < 1 or align & (align - 1):
+            raise ValueError(f"Table '{definition['name']}' alignment must be a power of two, got {align}")
+        values, _, _ = generate(definition)
+        data = table_bytes(values, size, signed, definition['name'])
+        position += -position % align
+        tables.append(BundleTable(definition['name'], values, size, signed, align, position, data))
+        position += len(data)
+
+    binary = bytearray(position)
+    binary[:header_size] = (np.array([len(tables)], dtype='>u2').tobytes()
+                            + np.array([table.offset for table in tables], dtype='>u4').tobytes())
+    for table in tables:
+        binary[table.offset:table.offset + len(table.data)] = table.data
+    return bytes(binary), tables
+
+
+def _value_lines(values, prefix, separator=','):
+    flat = values.ravel().tolist()
+    return [prefix + separator.join(map(str, flat[start:start + LINE_VALUES]))
+            for start in range(0, len(flat), LINE_VALUES)]
+
+
+def asm_source(bundle_name, tables):
+    """The bundle as an assembler include, byte for byte the same as the binary."""
+    lines = [f"; {bundle_name}: {len(tables)} tables, generated by table_bundle.py", ""]
+    # Table alignment is relative to the start of the bundle, so align that to the largest
+    largest = max([table.align for table in tables] + [2])
+    lines.extend([f"        cnop    0,{largest}", f"{bundle_name}:", f"        dc.w    {len(tables)}"])
+    lines.extend(f"        dc.l    {table.name}-{bundle_name}" for table in tables)
+    for table in tables:
+        shape = ' x '.join(map(str, table.values.shape))
+        lines.append("")
+        if table.align > 1:
+            lines.append(f"        cnop    0,{table.align}")
+        lines.append(f"{table.name}:    ; {shape} {'signed' if table.signed else 'unsigned'} {table.size}-bit")
+        lines.extend(_value_lines(table.values, f"        {_ASM_DIRECTIVES[table.size]}    "))
+    return '\n'.join(lines) + '\n'
+
+
+def c_header(bundle_name, tables):
+    """The bundle as a C header: offsets into the binary, sizes and an array per table."""
+    guard = f"{bundle_name.upper()}_TABLES_H"
+    lines = [f"/* {bundle_name}: {len(tables)} tables, generated by table_bundle.py */",
+             f"#ifndef {guard}", f"#define {guard}", ""]
+    for table in tables:
+        define = f"{bundle_name}_{table.name}".upper()
+        lines.append(f"#define {define}_OFFSET {table.offset}")
+        lines.append(f"#define {define}_ENTRIES {table.values.size}")
+    for table in tables:
+        dimensions = ''.join(f"[{length}]" for length in table.values.shape)
+        lines.append("")
+        lines.append(f"static const {_C_TYPES[(table.size, table.signed)]} {table.name}{dimensions} = {{")
+        lines.extend(line + ',' for line in _value_lines(table.values, "    ", ', '))
+        lines.append("};")
+    lines.extend(["", f"#endif /* {guard} */"])
+    return '\n'.join(lines) + '\n'
+
+
+def write_bundle(bundle, prefix):
+    """Build a bundle and write prefix.bin, prefix.s and prefix.h. Returns (binary, tables, seconds)."""
+    start = time.perf_counter()
+    binary, tables = build(bundle)
+    elapsed = time.perf_counter() - start
+    with open(prefix + '.bin', 'wb') as f:
+        f.write(binary)
+    with open(prefix + '.s', 'w') as f:
+        f.write(asm_source(bundle['name'], tables))
+    with open(prefix + '.h', 'w') as f:
+        f.write(c_header(bundle['name'], tables))
+    return binary, tables, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a bundle of lookup tables from one config.")
+    parser.add_argument('config', help="Bundle config (.json)")
+    parser.add_argument('--output', help="Output prefix for .bin, .s and .h (default: the config's name)")
+    args = parser.parse_args(argv)
+
+    bundle = load_bundle(args.config)
+    if not _IDENTIFIER.match(bundle.get('name', '')):
+        parser.error("The bundle needs a name that is a valid identifier")
+    prefix = args.output or os.path.splitext(args.config)[0]
+    binary, tables, elapsed = write_bundle(bundle, prefix)
+    print(f"{'Table':<20} {'Offset':>8} {'Bytes':>8} {'Entries':>10} {'Size':>5}")
+    for table in tables:
+        print(f"{table.name:<20} {table.offset:>8} {len(table.data):>8} "
+              f"{'x'.join(map(str, table.values.shape)):>10} {table.size:>5}")
+    print(f"{prefix}.bin: {len(binary)} bytes, {len(tables)} tables built in {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
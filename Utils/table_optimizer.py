@@ -0,0 +1,383 @@
+"""
+Choose the entries, entry size and fixed-point shift of a lookup table from
+an error bound and a memory budget.
+
+A table of f over [range_min, range_max] stores round(f(x) * 2**shift) at
+np.linspace(range_min, range_max, entries), in 8, 16 or 32 bits, signed when
+f goes negative. For every candidate the search uses the largest shift whose
+values still fit the entry size, since a smaller one only adds error, and
+measures the error against f on a dense grid:
+
+    plain         the entry nearest x
+    interpolate   linear interpolation between the two entries around x,
+                  with an 8-bit fraction, computed in integers exactly as
+                  the 68000 routine does (muls, then asr.l #8)
+
+Every entry size, and both lookups, are measured together for each entry
+count, which are 2**k + 1 so the table's ends and midpoint fall on entries.
+
+Each candidate is priced with the LOOKUP_SOURCE routine that can address
+it: tables whose byte offsets fit (d8,An,Dn.w) and whose index fits a word
+use the word-index routines, larger ones the long-index routines. An
+interpolating lookup takes an 8.8 index in a word only up to 257 entries
+(before folding), and a 24.8 index in a long beyond.
+muls multiplies 16 bits, so only 8-bit and 16-bit tables are interpolated.
+
+Symmetry folding stores only part of the table when f is symmetric about the
+middle of its range (odd, like sine over a period, or even, like cosine), and
+a quarter when each half is symmetric about its own middle too. Folding
+reproduces the same entries, so it only changes the size and the cycles.
+
+The winner is the smallest table within the error bound and budget, then the
+cheapest lookup. Lookup costs come from the 68000 routines in LOOKUP_SOURCE,
+timed with the ST cycle table, so the report says whether interpolation earns
+its extra cycles: it is needed when no plain table fits, and otherwise the
+bytes it saves are set against its cycles per lookup.
+
+Usage:
+    python table_optimizer.py "sin(deg2rad(x))" --range 0 360 --max-error 0.0005 --budget 2048
+    python table_optimizer.py --config table.cfg --max-error 0.01 --budget 512 --emit best.cfg
+"""
+import argparse
+import json
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from function_tables import EXPRESSION, evaluate, is_2d, load_config, table_expression
+
+BIT_WIDTHS = (8, 16, 32)
+
+# Entry counts searched: 2**k + 1
+MIN_ENTRIES_LOG2 = 4
+MAX_ENTRIES_LOG2 = 16
+
+# Fraction bits of the interpolating lookup
+FRACTION_BITS = 8
+
+# Relative tolerance for detecting symmetry
+SYMMETRY_TOLERANCE = 1e-9
+
+Candidate = namedtuple('Candidate', ['entries', 'stored', 'bits', 'signed', 'shift', 'fold', 'symmetry',
+                                     'interpolate', 'bytes', 'max_error', 'rms_error', 'cycles', 'routine'])
+
+# Entry sizes muls can interpolate
+INTERPOLATE_WIDTHS = (8, 16)
+
+# Largest byte offset (d8,An,Dn.w) reaches, and most entries an 8.8 index addresses
+WORD_OFFSET = 0x7FFF
+WORD_INTERPOLATE_ENTRIES = (1 << FRACTION_BITS) + 1
+
+# 68000 lookups, a0 = table, d0 = entry index: a word for the plain routines and an
+# 8.8 fixed-point word for the interpolating ones, a long (24.8 when interpolating)
+# for the _long routines. Each costs what its section takes; a fold section, word or
+# long to match, is added to either lookup. 8-bit tables are shown signed: unsigned
+# ones clear d0 and d2 with moveq #0 before the reads instead of ext.w after, at the
+# same cost.
+LOOKUP_SOURCE = """\
+plain_8:
+        move.b  (a0,d0.w),d0
+plain_16:
+        add.w   d0,d0
+        move.w  (a0,d0.w),d0
+plain_32:
+        add.w   d0,d0
+        add.w   d0,d0
+        move.l  (a0,d0.w),d0
+plain_8_long:
+        move.b  (a0,d0.l),d0
+plain_16_long:
+        add.l   d0,d0
+        move.w  (a0,d0.l),d0
+plain_32_long:
+        add.l   d0,d0
+        add.l   d0,d0
+        move.l  (a0,d0.l),d0
+interpolate_8:
+        moveq   #0,d1
+        move.b  d0,d1               ; fraction
+        lsr.w   #8,d0
+        move.b  (a0,d0.w),d2
+        move.b  1(a0,d0.w),d0
+        ext.w   d2
+        ext.w   d0
+        sub.w   d2,d0
+        muls    d1,d0
+        asr.l   #8,d0
+        add.w   d2,d0
+interpolate_16:
+        moveq   #0,d1
+        move.b  d0,d1               ; fraction
+        lsr.w   #8,d0
+        add.w   d0,d0
+        move.w  (a0,d0.w),d2
+        move.w  2(a0,d0.w),d0
+        sub.w   d2,d0
+        muls    d1,d0
+        asr.l   #8,d0
+        add.w   d2,d0
+interpolate_8_long:
+        moveq   #0,d1
+        move.b  d0,d1               ; fraction
+        lsr.l   #8,d0
+        move.b  (a0,d0.l),d2
+        move.b  1(a0,d0.l),d0
+        ext.w   d2
+        ext.w   d0
+        sub.w   d2,d0
+        muls    d1,d0
+        asr.l   #8,d0
+        add.w   d2,d0
+interpolate_16_long:
+        moveq   #0,d1
+        move.b  d0,d1               ; fraction
+        lsr.l   #8,d0
+        add.l   d0,d0
+        move.w  (a0,d0.l),d2
+        move.w  2(a0,d0.l),d0
+        sub.w   d2,d0
+        muls    d1,d0
+        asr.l   #8,d0
+        add.w   d2,d0
+half:   cmp.w   d3,d0               ; d3 = middle index, d4 = last index
+        bls.s   .near
+        neg.w   d0
+        add.w   d4,d0               ; mirrored index
+        moveq   #-1,d5              ; negate the result if odd
+.near:
+quarter:
+        cmp.w   d6,d0               ; d6 = quarter index, d3 = middle index
+        bls.s   .near
+        neg.w   d0
+        add.w   d3,d0
+.near:
+half_long:
+        cmp.l   d3,d0
+        bls.s   .near
+        neg.l   d0
+        add.l   d4,d0
+        moveq   #-1,d5
+.near:
+quarter_long:
+        cmp.l   d6,d0
+        bls.s   .near
+        neg.l   d0
+        add.l   d3,d0
+.near:
+"""
+
+
+def lookup_routine(entries, stored, bits, interpolate):
+    """
+    Name of the LOOKUP_SOURCE section that reads a table of entries, stored
+    entries of them after folding; None if none can. The index covers the whole
+    table, since folding happens after it is formed.
+    """
+    if interpolate and bits not in INTERPOLATE_WIDTHS:
+        return None
+    word = (stored - 1) * bits // 8 <= WORD_OFFSET
+    if interpolate:
+        word = word and entries <= WORD_INTERPOLATE_ENTRIES
+    else:
+        word = word and entries - 1 <= 0xFFFF
+    return f"{'interpolate' if interpolate else 'plain'}_{bits}{'' if word else '_long'}"
+
+
+def _section_cycles():
+    """Worst-case cycles of each global label's section in LOOKUP_SOURCE."""
+    from cycle_annotate import annotate
+    _, blocks, _ = annotate(LOOKUP_SOURCE.splitlines())
+    return {block['name']: block['worst'] for block in blocks if not block['name'].startswith('.')}
+
+
+def symmetry(values):
+    """'odd', 'even' or None: how values mirror about their middle entry."""
+    scale = max(float(np.abs(values).max()), 1.0) * SYMMETRY_TOLERANCE
+    mirrored = values[::-1]
+    if np.all(np.abs(values + mirrored) <= scale):
+        return 'odd'
+    if np.all(np.abs(values - mirrored) <= scale):
+        return 'even'
+    return None
+
+
+def folds(values):
+    """[(fold, symmetry)] that values allow: always (1, None), then halves and quarters."""
+    options = [(1, None)]
+    whole = symmetry(values)
+    if whole and len(values) % 2:
+        options.append((2, whole))
+        half = values[:len(values) // 2 + 1]
+        part = symmetry(half)
+        if part and len(half) % 2:
+            options.append((4, f"{whole}/{part}"))
+    return options
+
+
+def max_shift(peak, bits, signed):
+    """Largest shift that keeps round(peak * 2**shift) within the entry size."""
+    limit = (1 << (bits - 1)) - 1 if signed else (1 << bits) - 1
+    if peak <= 0:
+        return 0
+    shift = int(np.floor(np.log2((limit + 0.5) / peak)))
+    # Rounding can still carry the peak over the limit
+    while np.round(peak * 2.0 ** shift) > limit:
+        shift -= 1
+    return shift
+
+
+def search(expression, x_range, entry_counts=None, reference=None):
+    """Every candidate table of the expression, with its errors and costs."""
+    if entry_counts is None:
+        entry_counts = [(1 << k) + 1 for k in range(MIN_ENTRIES_LOG2, MAX_ENTRIES_LOG2 + 1)]
+    reference = reference or max(1 << 16, 4 * max(entry_counts))
+    exact, x, _ = evaluate(expression, x_range, reference)
+    if not np.isfinite(exact).all():
+        raise ValueError(f"The function is not finite at x = {x[np.argmax(~np.isfinite(exact))]:g}")
+    signed = bool(exact.min() < 0)
+    peak = float(np.abs(exact).max())
+    shifts = np.array([max_shift(peak, bits, signed) for bits in BIT_WIDTHS])
+    scales = 2.0 ** shifts[:, None]
+    cycles = _section_cycles()
+    position = (x - x_range[0]) / (x_range[1] - x_range[0])
+
+    candidates = []
+    for entries in entry_counts:
+        values, _, _ = evaluate(expression, x_range, entries)
+        # Every entry size at once: (widths, entries) of the stored integers
+        stored = np.round(values[None, :] * scales)
+        index = position * (entries - 1)
+        nearest = np.rint(index).astype(np.intp)
+        below = np.minimum(np.floor(index).astype(np.intp), entries - 2)
+        fraction = np.floor((index - below) * (1 << FRACTION_BITS))
+        low = stored[:, below]
+        lookups = {
+            False: stored[:, nearest] / scales,
+            # muls, then asr.l floors the product
+            True: (low + np.floor((stored[:, below + 1] - low) * fraction / (1 << FRACTION_BITS))) / scales,
+        }
+        for interpolate, result in lookups.items():
+            error = result - exact
+            max_errors = np.abs(error).max(axis=1)
+            rms_errors = np.sqrt(np.mean(error * error, axis=1))
+            for fold, kind in folds(values):
+                count = (entries - 1) // fold + 1
+                for width, bits in enumerate(BIT_WIDTHS):
+                    routine = lookup_routine(entries, count, bits, interpolate)
+                    if routine is None:
+                        continue
+                    suffix = '_long' if routine.endswith('_long') else ''
+                    cost = cycles[routine] + {1: 0, 2: cycles['half' + suffix],
+                                              4: cycles['half' + suffix] + cycles['quarter' + suffix]}[fold]
+                    candidates.append(Candidate(entries, count, bits, signed, int(shifts[width]), fold, kind,
+                                                interpolate, count * bits // 8, float(max_errors[width]),
+                                                float(rms_errors[width]), cost, routine))
+    return candidates
+
+
+def best(candidates, max_error, budget, interpolate=None):
+    """The smallest candidate within the error bound and budget, then the cheapest; None if none fit."""
+    fitting = [candidate for candidate in candidates
+               if candidate.max_error <= max_error and candidate.bytes <= budget
+               and (interpolate is None or candidate.interpolate == interpolate)]
+    return min(fitting, key=lambda c: (c.bytes, c.cycles, c.max_error), default=None)
+
+
+def interpolation_verdict(candidates, max_error, budget):
+    """Whether linear interpolation is worth its cycles, as one line of text."""
+    plain = best(candidates, max_error, budget, interpolate=False)
+    interpolated = best(candidates, max_error, budget, interpolate=True)
+    if interpolated is None:
+        return "Interpolation does not help: no interpolated table meets the bound within the budget"
+    if plain is None:
+        return "Interpolation is needed: no plain table meets the bound within the budget"
+    saved = plain.bytes - interpolated.bytes
+    extra = interpolated.cycles - plain.cycles
+    if saved <= 0:
+        return "Interpolation is not worth it: it saves no memory"
+    return f"Interpolation saves {saved} bytes ({plain.bytes} to {interpolated.bytes}) for {extra} more cycles per lookup"
+
+
+def candidate_config(candidate, expression, x_range):
+    """A generator .cfg for the stored part of a candidate table."""
+    span = (x_range[1] - x_range[0]) / candidate.fold
+    return {
+        'function': EXPRESSION,
+        'expression': expression,
+        'range_min': str(x_range[0]),
+        'range_max': str(x_range[0] + span),
+        'y_range_min': '0',
+        'y_range_max': '0',
+        'y_entries': '',
+        'scale': str(2.0 ** candidate.shift),
+        'entries': str(candidate.stored),
+        'size': str(candidate.bits),
+        'signed': candidate.signed,
+        'shift': candidate.shift,
+        'fold': candidate.fold,
+        'symmetry': candidate.symmetry,
+        'interpolate': candidate.interpolate,
+        'routine': candidate.routine,
+    }
+
+
+def format_candidate(candidate):
+    return (f"{candidate.entries:>6} {candidate.stored:>6} {candidate.bits:>4} {candidate.shift:>5} "
+            f"{candidate.fold:>4} {'yes' if candidate.interpolate else 'no':>6} {candidate.bytes:>7} "
+            f"{candidate.max_error:>11.3g} {candidate.rms_error:>11.3g} {candidate.cycles:>6} {candidate.routine}")
+
+
+CANDIDATE_HEADER = (f"{'Entries':>6} {'Stored':>6} {'Bits':>4} {'Shift':>5} {'Fold':>4} {'Interp':>6} "
+                    f"{'Bytes':>7} {'Max error':>11} {'RMS error':>11} {'Cycles':>6} Routine")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Choose a lookup table's size and precision.")
+    parser.add_argument('expression', nargs='?', help="Expression of x, as in function_tables")
+    parser.add_argument('--config', help="Generator .cfg to take the function and range from")
+    parser.add_argument('--range', type=float, nargs=2, default=(0.0, 360.0), metavar=('MIN', 'MAX'),
+                        help="Range of x (default 0 360)")
+    parser.add_argument('--max-error', type=float, required=True, help="Largest error allowed, in the function's units")
+    parser.add_argument('--budget', type=int, required=True, help="Most bytes the table may take")
+    parser.add_argument('--top', type=int, default=10, help="Candidates to list (default 10)")
+    parser.add_argument('--emit', help="Write the winner as a generator .cfg")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config = load_config(args.config)
+        if is_2d(config):
+            parser.error("Only 1-D tables can be optimized")
+        expression = table_expression(config)
+        x_range = (float(config['range_min']), float(config['range_max']))
+    elif args.expression:
+        expression, x_range = args.expression, tuple(args.range)
+    else:
+        parser.error("Give an expression or --config")
+
+    candidates = search(expression, x_range)
+    fitting = sorted((candidate for candidate in candidates
+                      if candidate.max_error <= args.max_error and candidate.bytes <= args.budget),
+                     key=lambda c: (c.bytes, c.cycles, c.max_error))
+    print(f"{expression} over {x_range[0]:g}..{x_range[1]:g}: {len(fitting)} of {len(candidates)} candidates fit "
+          f"max error {args.max_error:g} in {args.budget} bytes")
+    if fitting:
+        print(CANDIDATE_HEADER)
+        for candidate in fitting[:args.top]:
+            print(format_candidate(candidate))
+    print(interpolation_verdict(candidates, args.max_error, args.budget))
+
+    winner = fitting[0] if fitting else None
+    if winner is None:
+        closest = min(candidates, key=lambda c: c.max_error)
+        print(f"Nothing fits; the most precise table has max error {closest.max_error:.3g} in {closest.bytes} bytes")
+        return 1
+    if args.emit:
+        with open(args.emit, 'w') as f:
+            json.dump(candidate_config(winner, expression, x_range), f, indent=4)
+        print(f"{args.emit}: {winner.stored} entries of {winner.bits} bits, shift {winner.shift}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
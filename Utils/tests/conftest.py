@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The utilities are standalone scripts that import each other from Utils
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
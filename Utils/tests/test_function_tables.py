@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from function_tables import evaluate
+
+
+def test_constant_powers_overflow_instead_of_hanging():
+    values, _, _ = evaluate("x + 9**9**9**9", (0, 1), 4)
+    assert np.isinf(values).all()
+
+
+@pytest.mark.parametrize('text', ["__import__('os')", "x.real", "__float64__(x)", "'a'"])
+def test_rejected_expressions(text):
+    with pytest.raises(ValueError):
+        evaluate(text, (0, 1), 4)
+
+
+@pytest.mark.parametrize('text', ["floor(x, x)", "sqrt(x, x)", "sqrt(x, i)", "clip(x, 0, 1, x)", "sqrt()",
+                                  "where(x > 0)", "arctan2(x)"])
+def test_wrong_argument_counts(text):
+    with pytest.raises(ValueError, match="argument"):
+        evaluate(text, (0, 1), 4)
+
+
+def test_domain_is_not_overwritten():
+    values, x, _ = evaluate("floor(x) + clip(x, 0, 0.5) + where(x > 0.5, x, 0)", (0, 1), 5)
+    np.testing.assert_array_equal(x, np.linspace(0, 1, 5))
+    np.testing.assert_allclose(values, [0, 0.25, 0.5, 1.25, 2.5])
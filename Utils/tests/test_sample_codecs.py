@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import sample_codecs
+from sample_codecs import ADAPTIVE_SHIFTS, ADAPTIVE_STEPS, CODECS, DELTA_STEPS, FILE_HEADER, IMA_INDEX, IMA_STEPS
+
+
+def byte(value):
+    """A register's low byte, signed, as .b instructions see it."""
+    return ((value + 128) & 255) - 128
+
+
+def word(value):
+    return ((value + 32768) & 65535) - 32768
+
+
+def depack_delta(block, codes, output):
+    d0 = byte(block[0])                     # move.b (a0)+,d0
+    for code in codes:
+        d0 = byte(d0 + int(DELTA_STEPS[code]))  # add.b (a2,dn.w),d0
+        output.append(d0)                   # move.b d0,(a1)+
+
+
+def depack_adaptive(block, codes, output):
+    d0 = byte(block[0])                     # move.b (a0)+,d0; ext.w d0
+    d3 = block[1]                           # move.b (a0)+,d3
+    for code in codes:
+        d4 = word(int(ADAPTIVE_STEPS[code]) << d3)  # move.b; ext.w; asl.w d3,d4
+        d0 = word(d0 + d4)                  # add.w d4,d0
+        d0 = min(max(d0, -128), 127)        # cmp.w #127 / cmp.w #-128
+        output.append(d0)
+        d3 = byte(d3 + int(ADAPTIVE_SHIFTS[code]))  # add.b 16(a2,dn.w),d3
+        d3 = min(max(d3, 0), 3)             # bpl / cmp.b #3
+
+
+def depack_ima(block, codes, output):
+    d0 = word((block[0] << 8) | block[1])   # move.w (a0)+,d0; ext.l d0
+    d3 = block[2]                           # move.b (a0)+,d3
+    for code in codes:
+        d5 = int(IMA_STEPS[d3])             # move.w (a2,d5.w),d5
+        d6 = d5 >> 3                        # lsr.w #3,d6
+        if code & 4:
+            d6 += d5
+        d5 >>= 1
+        if code & 2:
+            d6 += d5
+        d5 >>= 1
+        if code & 1:
+            d6 += d5
+        if code & 8:
+            d0 = max(d0 - d6, -32768)       # sub.l d6,d0; cmp.l #-32768,d0
+        else:
+            d0 = min(d0 + d6, 32767)        # add.l d6,d0; cmp.l #32767,d0
+        output.append(byte(word(d0) >> 8))  # move.w d0,d4; asr.w #8,d4; move.b d4,(a1)+
+        d3 = byte(d3 + int(IMA_INDEX[code]))  # add.b (a3,dn.w),d3
+        d3 = min(max(d3, 0), 88)            # bpl / cmp.b #88
+
+
+DEPACK = {'delta': (depack_delta, 2), 'adaptive': (depack_adaptive, 2), 'ima': (depack_ima, 4)}
+
+
+def depack(data):
+    """Decode a packed file one block and one nibble at a time, as the 68000 routines do."""
+    count, block_samples, number = FILE_HEADER.unpack_from(data)
+    name = sample_codecs.CODEC_NUMBERS[number].name
+    routine, header_size = DEPACK[name]
+    block_bytes = header_size + block_samples // 2
+    output = []
+    for offset in range(FILE_HEADER.size, len(data), block_bytes):
+        block = data[offset:offset + block_bytes]
+        codes = [code for packed in block[header_size:] for code in (packed >> 4, packed & 15)]
+        routine(block, codes, output)
+    return np.array(output[:count], dtype=np.int8)
+
+
+@pytest.mark.parametrize('codec', list(CODECS))
+@pytest.mark.parametrize('length', [0, 1, 511, 512, 1500])
+def test_decode_matches_depack_routine(codec, length):
+    rate = 12517
+    t = np.arange(length) / rate
+    signal = 0.8 * np.sin(2 * np.pi * 440 * t) + np.random.default_rng(length).normal(0, 0.1, length)
+    samples = np.clip(np.round(signal * 127), -128, 127).astype(np.int8)
+    result = sample_codecs.encode(samples, codec)
+    np.testing.assert_array_equal(result.decoded, depack(result.data))
+    assert len(result.decoded) == length
+
+
+def test_empty_sample_is_header_only():
+    result = sample_codecs.encode(np.zeros(0, np.int8), 'ima')
+    assert result.data == FILE_HEADER.pack(0, sample_codecs.BLOCK_SAMPLES, CODECS['ima'].number)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from sample_dither import ERROR_LIMIT, NOISE_SHAPING, Quantizer
+
+BLOCK = 3001
+
+
+def sequential(signal, bits, signed, dither, shaping):
+    """Error-feedback quantization one sample at a time, drawing the dither in the same blocks."""
+    quantizer = Quantizer(bits, signed, dither, 'none')
+    values = signal.astype(np.float32) * quantizer.full_scale
+    noise = [quantizer._dither(values[i:i + BLOCK].shape) for i in range(0, len(values), BLOCK)]
+    noise = None if noise[0] is None else np.concatenate(noise)
+    coefficients = NOISE_SHAPING[shaping]
+    output = np.empty(values.shape)
+    for channel in range(values.shape[1]):
+        errors = [0.0] * len(coefficients)
+        for n in range(len(values)):
+            target = float(values[n, channel]) - sum(c * e for c, e in zip(coefficients, errors))
+            result = np.floor(target + 0.5 + (float(noise[n, channel]) if noise is not None else 0.0))
+            result = min(max(result, quantizer.low), quantizer.high)
+            output[n, channel] = result
+            errors = [min(max(result - target, -ERROR_LIMIT), ERROR_LIMIT)] + errors[:-1]
+    return (output + quantizer.offset).astype(quantizer.dtype)
+
+
+@pytest.mark.parametrize('bits', [8, 4])
+@pytest.mark.parametrize('signed', [True, False])
+@pytest.mark.parametrize('dither', ['round', 'tpdf'])
+@pytest.mark.parametrize('shaping', ['first', 'second'])
+def test_shaping_matches_sequential_loop(bits, signed, dither, shaping):
+    signal = np.random.default_rng(1).uniform(-1.05, 1.05, (12000, 2)).astype(np.float32)
+    # A quiet stretch runs the closed form over whole chunks; the rest clips often
+    signal[3000:8000] *= 0.02
+    quantizer = Quantizer(bits, signed, dither, shaping)
+    output = np.concatenate([quantizer.process(signal[i:i + BLOCK]) for i in range(0, len(signal), BLOCK)])
+    np.testing.assert_array_equal(output, sequential(signal, bits, signed, dither, shaping))
+
+
+def test_shaping_needs_rounding():
+    with pytest.raises(ValueError):
+        Quantizer(8, True, 'none', 'first')
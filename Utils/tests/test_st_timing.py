@@ -0,0 +1,35 @@
+import pytest
+
+from st_timing import TimingModel, time_sequence
+
+
+@pytest.mark.parametrize('first, second, paired', [
+    ('exg d0,d1', 'move.w 0(a0,d0.w),d1', 20),
+    ('exg d0,d1', 'move.w 2(pc,d0.w),d1', 20),
+    ('lsl.w #2,d0', 'move.w 0(a0,d0.w),d1', 24),
+    ('asr.l #1,d0', 'move.l 0(a0,d0.w),d1', 28),
+    ('cmpa.w d0,a0', 'move.w 0(a0,d1.w),d2', 20),
+])
+def test_pairs(first, second, paired):
+    assert time_sequence([first, second]).cycles == paired
+    assert TimingModel(pairing=False).time_sequence([first, second]).cycles == paired + 4
+
+
+@pytest.mark.parametrize('sequence', [
+    ['exg d0,d1', 'move.w (a0),d1'],                # no indexed operand
+    ['lsl.w #1,d0', 'move.w 0(a0,d0.w),d1'],        # 8 cycles, already aligned
+    ['lsl.w d2,d0', 'move.w 0(a0,d0.w),d1'],        # count depends on the data
+    ['move.w d0,d1', 'move.w 0(a0,d0.w),d1'],       # not a pairing instruction
+])
+def test_no_pair(sequence):
+    assert time_sequence(sequence).cycles == TimingModel(pairing=False).time_sequence(sequence).cycles
+
+
+def test_one_pair_per_instruction():
+    timing = time_sequence(['exg d0,d1', 'move.w 0(a0,d0.w),d1', 'move.w 0(a0,d0.w),d2'])
+    assert [entry.paired for entry in timing.entries] == [False, True, False]
+    assert timing.cycles == 36
+
+
+def test_68000_has_no_pairing():
+    assert time_sequence(['exg d0,d1', 'move.w 0(a0,d0.w),d1'], machine='68000').cycles == 24
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from trig_tables import LAYOUTS, build, lookup, report, verify
+
+SIZES = [4, 8, 16, 64, 256, 1024, 4096, 65536]
+SCALES = [1, 127, 32767, 2 ** 31 - 1, 100.5]
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('entries', SIZES)
+@pytest.mark.parametrize('scale', SCALES)
+def test_exact_reconstruction(layout, entries, scale):
+    table = build(layout, entries, scale)
+    indices = np.arange(entries)
+    angles = 2 * np.pi * indices / entries
+    np.testing.assert_array_equal(lookup(layout, table, entries, indices),
+                                  np.round(np.sin(angles) * scale).astype(np.int64))
+    np.testing.assert_array_equal(lookup(layout, table, entries, indices, cosine=True),
+                                  np.round(np.cos(angles) * scale).astype(np.int64))
+    assert verify(layout, entries, scale)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_indices_wrap(layout):
+    entries = 256
+    table = build(layout, entries, 32767)
+    indices = np.arange(-entries, 2 * entries)
+    for cosine in (False, True):
+        np.testing.assert_array_equal(lookup(layout, table, entries, indices, cosine),
+                                      np.tile(lookup(layout, table, entries, np.arange(entries), cosine), 3))
+
+
+@pytest.mark.parametrize('entries', SIZES)
+def test_table_sizes(entries):
+    sizes = {layout: len(build(layout, entries, 1)) for layout in LAYOUTS}
+    assert sizes == {'full': 2 * entries, 'half': entries // 2, 'quarter': entries // 4 + 1,
+                     'sincos': entries + entries // 4}
+
+
+def test_bad_entries():
+    for entries in (2, 6, 100):
+        with pytest.raises(ValueError, match="power of two"):
+            build('full', entries, 1)
+
+
+def test_report_prices_the_entry_size():
+    cycles = {bits: {layout.layout: layout.sin_cycles for layout in report(1024, 1, bits)} for bits in (8, 16, 32)}
+    # A byte table needs no index scaling, a long table one more add.w d0,d0 and a longer read
+    assert cycles[8]['full'] < cycles[16]['full'] < cycles[32]['full']
+    assert cycles[16] == {'full': 28, 'half': 68, 'quarter': 104, 'sincos': 28}
+
+
+@pytest.mark.parametrize('entries, bits, priced', [
+    (16384, 16, {'full', 'half', 'quarter', 'sincos'}),
+    (32768, 16, {'half', 'quarter'}),
+    (16384, 32, {'half', 'quarter'}),
+    (65536, 8, {'half', 'quarter'}),
+])
+def test_report_reach(entries, bits, priced):
+    layouts = report(entries, 1, bits)
+    assert {layout.layout for layout in layouts if layout.sin_cycles is not None} == priced
+    assert all((layout.cos_cycles is None) == (layout.sin_cycles is None) for layout in layouts)
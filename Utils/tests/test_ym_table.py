@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from ym_table import BYTES_PER_CHANNEL, ENTRIES, YmSampleTable
+
+
+def random_table(channels):
+    table = YmSampleTable.empty(channels)
+    # The 1-byte layout implies channel n writes register 8 + n
+    table.writes['register'] = 8 + np.arange(channels)
+    table.writes['value'] = np.random.default_rng(channels).integers(0, 16, (ENTRIES, channels))
+    return table
+
+
+@pytest.mark.parametrize('channels', [1, 2, 3, 4])
+@pytest.mark.parametrize('layout', BYTES_PER_CHANNEL)
+@pytest.mark.parametrize('padded', [True, False])
+def test_save_load_round_trip(channels, layout, padded):
+    table = random_table(channels)
+    data = table.to_bytes(layout, None if padded else channels)
+    loaded = YmSampleTable.from_bytes(data, channels)
+    np.testing.assert_array_equal(loaded.writes, table.writes)
+
+
+def test_truncated_table():
+    with pytest.raises(ValueError, match="truncated"):
+        YmSampleTable.from_bytes(bytes(ENTRIES * 2), 3)
+    with pytest.raises(ValueError, match="truncated"):
+        YmSampleTable.from_bytes(bytes(ENTRIES * 4), 3, bytes_per_channel=2)
@@ -0,0 +1,252 @@
+"""
+Sine and cosine tables folded by symmetry.
+
+An angle is an index into a period of N entries (N a power of two, so the
+angle wraps with and.w #N-1), and a full table holds round(sin(2 pi i / N) *
+scale) for every index. Storing sin and cos in full takes two such tables;
+the layouts here take less:
+
+    full        sin and cos tables of N entries each, for comparison
+    half        N/2 entries of sin; the second half of the period is the
+                first half negated
+    quarter     N/4 + 1 entries of sin; each quarter is the first mirrored
+                and/or negated
+    sincos      N + N/4 entries: 1.25 periods of sin, so cos(i) is the same
+                table read at i + N/4, with no extra storage or work per
+                lookup once a second base register points N/4 entries on
+
+Every entry is computed from its angle reduced to the first quarter, so the
+folds are exact: verify reconstructs sin and cos for every index from each
+layout, as the 68000 lookups in LOOKUP_SOURCE do, and compares them with the
+full tables. report gives each layout's size, saving against full sin and
+cos tables, and the cycles of its lookups for the entry size.
+
+(d8,An,Xn) addressing has only an 8-bit displacement, so the cos tables of
+the full and sincos layouts cannot be reached as a displacement from a0;
+the lookups read them through a1, loaded once outside the lookup. The full
+layout's cos table can be more than 32 KB on, past lea's 16-bit
+displacement, so a1 is set with adda.l. The index is a word, so a lookup
+reads at most 32 KB on from its base: up to N = 32768 byte, 16384 word or
+8192 long entries per period for the full and sincos layouts, and twice
+that for half and quarter. report gives no cycles beyond that.
+
+Usage:
+    python trig_tables.py --entries 1024 --bits 16 --report
+    python trig_tables.py --entries 512 --scale 127 --bits 8 --layout quarter --output sin8.dat
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+LAYOUTS = ('full', 'half', 'quarter', 'sincos')
+
+# Function names the table generator and bundles use for the folded layouts, with
+# the entries setting as the entries per period
+TRIG_FUNCTIONS = {
+    'SIN half': 'half',
+    'SIN quarter': 'quarter',
+    'SIN/COS': 'sincos',
+}
+
+# Size suffix of each entry size, in bits
+ENTRY_SIZES = {8: 'b', 16: 'w', 32: 'l'}
+
+# Largest offset a word index reaches
+WORD_OFFSET = 0x7FFF
+
+LayoutReport = namedtuple('LayoutReport', ['layout', 'entries', 'bytes', 'saving', 'sin_cycles', 'cos_cycles',
+                                           'exact'])
+
+# 68000 lookups: d0.w = angle index, a0 = table, N = entries per period, .S the
+# entry size and SCALE_INDEX turns the index into a byte offset for it.
+# Each lookup's cost is its worst case: the conditional mirror and negate taken.
+# The setup sections run once, before any lookups, and are not counted in them.
+LOOKUP_SOURCE = """\
+full_setup:
+        movea.l a0,a1
+        adda.l  #N*BYTES,a1         ; cos table
+sincos_setup:
+        lea     N/4*BYTES(a0),a1    ; N/4 entries on
+full_sin:
+        and.w   #N-1,d0
+SCALE_INDEX
+        move.S  (a0,d0.w),d0
+half_sin:
+        and.w   #N-1,d0
+        move.w  d0,d1               ; keep the half bit
+        and.w   #N/2-1,d0
+SCALE_INDEX
+        move.S  (a0,d0.w),d0
+        btst    #HALF_BIT,d1
+        beq.s   .done
+        neg.S   d0
+.done:
+quarter_sin:
+        and.w   #N-1,d0
+        move.w  d0,d1               ; keep the quarter bits
+        and.w   #N/4-1,d0
+        btst    #QUARTER_BIT,d1
+        beq.s   .rising
+        neg.w   d0
+        add.w   #N/4,d0             ; falling quarter: mirror
+.rising:
+SCALE_INDEX
+        move.S  (a0,d0.w),d0
+        btst    #HALF_BIT,d1
+        beq.s   .done
+        neg.S   d0
+.done:
+sincos_sin:
+        and.w   #N-1,d0
+SCALE_INDEX
+        move.S  (a0,d0.w),d0
+sincos_cos:
+        and.w   #N-1,d0
+SCALE_INDEX
+        move.S  (a1,d0.w),d0
+cos_offset:
+        add.w   #N/4,d0             ; half and quarter: cos(i) = sin(i + N/4)
+"""
+
+
+def _check_entries(entries):
+    if entries < 4 or entries & (entries - 1):
+        raise ValueError(f"Entries per period must be a power of two of at least 4, got {entries}")
+
+
+def sine(entries, scale, indices):
+    """round(sin(2 pi i / entries) * scale) at each index, computed from the first quarter."""
+    _check_entries(entries)
+    quarter = entries // 4
+    indices = np.asarray(indices) & (entries - 1)
+    within = indices % quarter
+    # Index into the first quarter: rising quarters count up, falling ones down
+    reduced = np.where((indices // quarter) % 2 == 1, quarter - within, within)
+    values = np.round(np.sin(np.pi / 2 * reduced / quarter) * scale).astype(np.int64)
+    return np.where(indices >= entries // 2, -values, values)
+
+
+def build(layout, entries, scale):
+    """The stored table of a layout; for 'full', the sin table followed by the cos table."""
+    _check_entries(entries)
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {', '.join(LAYOUTS)}")
+    count = {'full': entries, 'half': entries // 2, 'quarter': entries // 4 + 1, 'sincos': entries + entries // 4}
+    table = sine(entries, scale, np.arange(count[layout]))
+    if layout == 'full':
+        table = np.concatenate((table, sine(entries, scale, np.arange(entries) + entries // 4)))
+    return table
+
+
+def lookup(layout, table, entries, indices, cosine=False):
+    """sin (or cos) at each index, read from a layout's table as its 68000 lookup does."""
+    indices = (np.asarray(indices) + (entries // 4 if cosine and layout in ('half', 'quarter') else 0)) & (entries - 1)
+    if layout == 'full':
+        return table[indices + (entries if cosine else 0)]
+    if layout == 'sincos':
+        return table[indices + (entries // 4 if cosine else 0)]
+    if layout == 'half':
+        half = entries // 2
+        values = table[indices & (half - 1)]
+        return np.where(indices & half, -values, values)
+    quarter = entries // 4
+    within = indices & (quarter - 1)
+    mirrored = np.where(indices & quarter, quarter - within, within)
+    values = table[mirrored]
+    return np.where(indices & (entries // 2), -values, values)
+
+
+def verify(layout, entries, scale):
+    """Whether the layout reproduces the full sin and cos tables exactly, at every index."""
+    table = build(layout, entries, scale)
+    indices = np.arange(entries)
+    full_sin = np.round(np.sin(2 * np.pi * indices / entries) * scale).astype(np.int64)
+    full_cos = np.round(np.cos(2 * np.pi * indices / entries) * scale).astype(np.int64)
+    # Folding must also agree with the tables computed directly, not only with itself
+    return (np.array_equal(lookup(layout, table, entries, indices), full_sin)
+            and np.array_equal(lookup(layout, table, entries, indices, cosine=True), full_cos))
+
+
+def _lookup_cycles(entries, bits=16):
+    """Worst-case cycles of each lookup in LOOKUP_SOURCE, for entries of the given bits."""
+    from cycle_annotate import annotate
+    size = bits // 8
+    scale = '\n'.join(['        add.w   d0,d0'] * (size.bit_length() - 1))
+    symbols = {'N*BYTES': str(entries * size), 'N/4*BYTES': str(entries // 4 * size), 'N/2': str(entries // 2),
+               'N/4': str(entries // 4), 'N-1': str(entries - 1), '.S ': f'.{ENTRY_SIZES[bits]} ',
+               'QUARTER_BIT': str(entries.bit_length() - 3), 'HALF_BIT': str(entries.bit_length() - 2)}
+    source = LOOKUP_SOURCE.replace('SCALE_INDEX\n', scale + '\n' if scale else '')
+    for symbol, value in symbols.items():
+        source = source.replace(symbol, value)
+    _, blocks, _ = annotate(source.splitlines())
+    return {block['name']: block['worst'] for block in blocks if not block['name'].startswith('.')}
+
+
+def report(entries, scale, bits=16):
+    """
+    LayoutReport for every layout, with savings against full sin and cos tables.
+    Cycles are None for a layout whose lookups are beyond the word index's reach.
+    """
+    cycles = _lookup_cycles(entries, bits)
+    full_bytes = 2 * entries * bits // 8
+    reports = []
+    for layout in LAYOUTS:
+        table = build(layout, entries, scale)
+        size = len(table) * bits // 8
+        # The full and sincos cos entries are read from a1, no further on than the sin entries
+        reachable = (min(len(table), entries) - 1) * bits // 8 <= WORD_OFFSET
+        sin_cycles = cycles['sincos_sin' if layout == 'sincos' else f'{layout}_sin'] if reachable else None
+        if not reachable:
+            cos_cycles = None
+        elif layout == 'sincos':
+            cos_cycles = cycles['sincos_cos']
+        elif layout == 'full':
+            # The same lookup through a1, which points at the cos table
+            cos_cycles = sin_cycles
+        else:
+            cos_cycles = sin_cycles + cycles['cos_offset']
+        reports.append(LayoutReport(layout, len(table), size, 1.0 - size / full_bytes, sin_cycles, cos_cycles,
+                                    verify(layout, entries, scale)))
+    return reports
+
+
+def _cycles(cycles):
+    return '-' if cycles is None else cycles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sine and cosine tables folded by symmetry.")
+    parser.add_argument('--entries', type=int, default=1024, help="Entries per period, a power of two (default 1024)")
+    parser.add_argument('--scale', type=float, help="Amplitude (default the largest the entry size holds)")
+    parser.add_argument('--bits', type=int, choices=(8, 16, 32), default=16, help="Entry size in bits (default 16)")
+    parser.add_argument('--layout', choices=LAYOUTS, default='sincos', help="Table layout (default sincos)")
+    parser.add_argument('--output', help="Write the layout's table as big-endian binary")
+    parser.add_argument('--report', action='store_true', help="Compare the size and lookup cost of every layout")
+    args = parser.parse_args(argv)
+
+    scale = args.scale if args.scale is not None else (1 << (args.bits - 1)) - 1
+    if args.report:
+        print(f"{args.entries} entries per period, scale {scale:g}, {args.bits}-bit entries")
+        print(f"{'Layout':<8} {'Entries':>8} {'Bytes':>7} {'Saving':>7} {'Sin cycles':>11} {'Cos cycles':>11} {'Exact':>6}")
+        for layout in report(args.entries, scale, args.bits):
+            print(f"{layout.layout:<8} {layout.entries:>8} {layout.bytes:>7} {layout.saving:>7.1%} "
+                  f"{_cycles(layout.sin_cycles):>11} {_cycles(layout.cos_cycles):>11} "
+                  f"{'yes' if layout.exact else 'NO':>6}")
+            if layout.sin_cycles is None:
+                print(f"  {layout.layout}: no cycles, the table is beyond the reach of a word index")
+
+    if args.output:
+        from table_bundle import table_bytes
+        if not verify(args.layout, args.entries, scale):
+            raise RuntimeError(f"The {args.layout} layout does not reproduce the full tables")
+        table = build(args.layout, args.entries, scale)
+        with open(args.output, 'wb') as f:
+            f.write(table_bytes(table, args.bits, signed=True))
+        print(f"{args.output}: {len(table)} entries, {len(table) * args.bits // 8} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Families of volume-scaled YM sample-out tables for in-game volume control.
+
+A family holds one table per volume, 16 or 32 of them, with volume 0 silent
+and the top volume the full table. Each table is either
+
+    remapped      entry i of the table at factor f is entry int(i * f) of
+                  the full table, as the viewer's Scale Volume does, or
+    optimized     chosen afresh by ym_volume for the lower output level,
+                  which uses the DAC's finer steps near silence rather than
+                  repeating entries of the full table
+
+Remapping gathers every table with one fancy index, and optimization chooses
+every table in one pass of optimize_family.
+
+The family is written as one binary: an index of offsets from the start of the
+file, one per volume, then the tables in the usual TAB layout. The index is
+words when every table starts within 32 KB of the start of the file, so with
+d0 holding volume * 2:
+
+        lea     family(pc),a0
+        move.w  (a0,d0.w),d0
+        add.w   d0,a0                   ; a0 = table for this volume
+
+and longs otherwise (d0 = volume * 4):
+
+        lea     family(pc),a0
+        move.l  (a0,d0.w),d0
+        add.l   d0,a0
+
+(d8,PC,Xn) addressing has only an 8-bit displacement, so the shorter
+move.w family(pc,d0.w),d0 works only when the family sits within 128 bytes
+of the lookup code.
+
+A 3-channel table in the default 2-byte layout is 2048 bytes, so a 16-volume
+family (32 KB of tables) just fits a word index and a 32-volume one needs
+longs; the 1-byte layout (--layout 1) halves the tables, which gives a
+32-volume family a word index too.
+
+Usage:
+    python ym_family.py family.bin --count 16
+    python ym_family.py family.bin --count 32 --table ym3.tab --channels 3 --optimize --monotonic
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from ym_table import BYTES_PER_CHANNEL, YmSampleTable, saved_slots
+from ym_volume import METRICS, optimize_family, report, table_outputs
+
+FAMILY_SIZES = (16, 32)
+
+INDEX_TYPES = ('auto', 'word', 'long')
+
+
+def scale_factors(count):
+    """Output factor of each volume: 0 (silent) up to 1 (the full table)."""
+    return np.arange(count) / (count - 1)
+
+
+def remapped_family(table, count):
+    """Writes (count, entries, channels): each volume's table index-remapped from the full table."""
+    entries = len(table.writes)
+    indices = (np.arange(entries)[None, :] * scale_factors(count)[:, None]).astype(np.intp)
+    return table.writes[indices]
+
+
+def optimized_family(count, channels=3, metric='rms', monotonic=False, gain=1.0, **model):
+    """Writes and modelled outputs for each volume, each table optimized for its own level."""
+    return optimize_family(scale_factors(count) * gain, channels, metric, monotonic, **model)
+
+
+def pack_family(writes, bytes_per_channel=2, slots=None, index='auto'):
+    """The family as one binary: offset index, then every table. Returns (data, index_type)."""
+    count, entries, channels = writes.shape
+    slots = slots or saved_slots(channels)
+    tables = YmSampleTable(writes.reshape(count * entries, channels)).to_bytes(bytes_per_channel, slots)
+    table_size = len(tables) // count
+    if index not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index}', expected one of {', '.join(INDEX_TYPES)}")
+    if index == 'auto':
+        # A word offset is sign-extended when added to an address register
+        index = 'word' if count * 2 + (count - 1) * table_size <= 0x7FFF else 'long'
+    offset_dtype = np.dtype('>u2' if index == 'word' else '>u4')
+    offsets = offset_dtype.itemsize * count + np.arange(count) * table_size
+    if index == 'word' and offsets[-1] > 0x7FFF:
+        raise ValueError(f"The family is {offsets[-1] + table_size} bytes, too large for a word index")
+    return offsets.astype(offset_dtype).tobytes() + tables, index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a family of volume-scaled YM sample-out tables.")
+    parser.add_argument('output', help="Binary to write: offset index followed by the tables")
+    parser.add_argument('--count', type=int, default=16, help=f"Volumes in the family, e.g. {' or '.join(map(str, FAMILY_SIZES))} (default 16)")
+    parser.add_argument('--table', help="Full-volume table to scale (default: generate one from the YM model)")
+    parser.add_argument('--channels', type=int, default=3, help="Channels per entry (default 3)")
+    parser.add_argument('--optimize', action='store_true', help="Re-optimize each volume instead of remapping entries")
+    parser.add_argument('--metric', choices=METRICS, default='rms', help="Error to minimize when optimizing (default rms)")
+    parser.add_argument('--monotonic', action='store_true', help="Keep each optimized table's output rising")
+    parser.add_argument('--layout', type=int, choices=BYTES_PER_CHANNEL, default=2, help="Bytes per channel (default 2)")
+    parser.add_argument('--index', choices=INDEX_TYPES, default='auto', help="Offset size in the index (default auto)")
+    args = parser.parse_args(argv)
+    if args.count < 2:
+        parser.error("A family needs at least 2 volumes")
+
+    table = YmSampleTable.load(args.table, args.channels) if args.table else None
+    if table is None or args.optimize:
+        # Scale relative to what the given table plays at full volume
+        gain = float(table_outputs(table).max()) if table is not None else 1.0
+        writes, outputs = optimized_family(args.count, args.channels, args.metric, args.monotonic, gain)
+    else:
+        writes = remapped_family(table, args.count)
+        outputs = np.stack([table_outputs(YmSampleTable(volume)) for volume in writes])
+
+    data, index = pack_family(writes, args.layout, index=args.index)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+
+    print(f"{args.output}: {args.count} tables, {len(data)} bytes, {index} index")
+    if index == 'long' and args.index == 'auto' and args.layout > 1:
+        smaller, smaller_index = pack_family(writes, 1)
+        if smaller_index == 'word':
+            print(f"The {args.layout}-byte layout is too large for a word index; "
+                  f"--layout 1 gives {len(smaller)} bytes with one")
+    print(f"{'Volume':>6} {'Factor':>7} {'Max error':>10} {'RMS error':>10}")
+    top = outputs[-1].max()
+    for volume, (factor, volume_outputs) in enumerate(zip(scale_factors(args.count), outputs)):
+        if factor:
+            result = report(volume_outputs, factor * top)
+            print(f"{volume:>6} {factor:>7.3f} {result.max_error:>10.2f} {result.rms_error:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Render an 8-bit sample through a YM sample-out table, to hear it before the ST does.
+
+Each sample value selects a table entry, and the entry's register writes set
+the channel volumes. Volumes hold until they are written again, so a table
+that only writes some channels on some entries is emulated correctly: each
+channel's volume is carried forward from the last sample that wrote it, with
+a cumulative maximum over the indices of the writes rather than a loop. The
+three volumes then index the mixed DAC output model from ym_volume (the
+logarithmic DAC and channel mixing, or a measured curve) in one lookup.
+
+The result is written as a 16-bit WAV at the replay rate, and compared with
+the ideal output, the 8-bit sample itself, after fitting the best gain and
+offset between them, since tables rarely use the DAC's full range:
+
+    SNR         ideal signal against the rendering error, in dB
+    RMS / max   rendering error in 8-bit steps
+
+Usage:
+    python ym_render.py drum.sam ym3.tab drum-ym.wav --channels 3 --rate 12517
+    python ym_render.py drum.sam ym2.tab drum-ym.wav --channels 2 --ideal drum-ideal.wav
+"""
+import argparse
+import sys
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from ym_table import VOLUME_REGISTERS, BYTES_PER_CHANNEL, YmSampleTable
+from ym_volume import DEFAULT_COMPRESSION, dac_levels, load_curve, mixed_outputs
+
+RenderReport = namedtuple('RenderReport', ['snr_db', 'rms_error', 'max_error', 'gain', 'seconds'])
+
+
+def channel_volumes(table, samples):
+    """Volume of each YM channel at each sample, shape (samples, 3), carrying unwritten volumes forward."""
+    written = table.register_values()[:, list(VOLUME_REGISTERS)]
+    # -1 where an entry leaves a channel's volume alone
+    written = np.where(np.isnan(written), -1, written).astype(np.int16)
+    per_sample = written[samples]
+    positions = np.arange(len(samples))[:, None]
+    last = np.maximum.accumulate(np.where(per_sample >= 0, positions, -1), axis=0)
+    volumes = np.take_along_axis(per_sample, np.maximum(last, 0), axis=0)
+    # Volumes start at 0; bit 4 (envelope mode) is ignored
+    return np.where(last >= 0, volumes & 0x0F, 0)
+
+
+def render(samples, table, levels=None, compression=DEFAULT_COMPRESSION, curve=None):
+    """YM output for unsigned 8-bit samples through a table, 0.0 to 1.0."""
+    volumes = channel_volumes(table, np.asarray(samples, dtype=np.uint8))
+    outputs = mixed_outputs(3, levels, compression, curve)
+    return outputs[volumes[:, 0], volumes[:, 1], volumes[:, 2]]
+
+
+def compare(samples, rendered):
+    """RenderReport (without timing) for a rendering against the ideal linear output of the samples."""
+    ideal = np.asarray(samples, dtype=np.float64)
+    design = np.stack((ideal, np.ones_like(ideal)), axis=1)
+    (gain, offset), *_ = np.linalg.lstsq(design, rendered, rcond=None)
+    if not gain:
+        return RenderReport(float('-inf'), float('inf'), float('inf'), 0.0, 0.0)
+    # The error in 8-bit steps, mapping the rendering back onto the sample scale
+    error = (rendered - offset) / gain - ideal
+    noise = np.mean(error * error)
+    signal = np.var(ideal)
+    snr_db = 10 * np.log10(signal / noise) if noise else float('inf')
+    return RenderReport(snr_db, float(np.sqrt(noise)), float(np.abs(error).max()), float(gain), 0.0)
+
+
+def write_wav16(path, values, sample_rate):
+    """Write -1.0..1.0 floats as a mono 16-bit WAV."""
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.clip(np.round(values * 32767), -32768, 32767).astype('<i2').tobytes())
+
+
+def render_file(sample_path, table, output_path, sample_rate, signed=False, ideal_path=None, levels=None,
+                compression=DEFAULT_COMPRESSION, curve=None):
+    """Render a raw sample file to a WAV and return the RenderReport."""
+    samples = np.fromfile(sample_path, dtype=np.uint8)
+    if signed:
+        # Signed samples index the table from their unsigned equivalent
+        samples ^= 0x80
+    start = time.perf_counter()
+    rendered = render(samples, table, levels, compression, curve)
+    elapsed = time.perf_counter() - start
+    result = compare(samples, rendered)._replace(seconds=elapsed)
+    # Centre the output and use the full range for listening
+    centred = rendered - rendered.mean()
+    peak = np.abs(centred).max() or 1.0
+    write_wav16(output_path, centred / peak, sample_rate)
+    if ideal_path:
+        ideal = samples.astype(np.float64) - samples.mean()
+        write_wav16(ideal_path, ideal / (np.abs(ideal).max() or 1.0), sample_rate)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render an 8-bit sample through a YM sample-out table.")
+    parser.add_argument('sample', help="Raw 8-bit .SAM/.SPL sample")
+    parser.add_argument('table', help="Sample-out table (.TAB/.DAT/.BIN)")
+    parser.add_argument('output', help="16-bit WAV to write")
+    parser.add_argument('--channels', type=int, default=3, help="Channels per table entry (default 3)")
+    parser.add_argument('--layout', type=int, choices=BYTES_PER_CHANNEL, help="Bytes per channel (default detect)")
+    parser.add_argument('--rate', type=int, default=12517, help="Replay rate (default 12517)")
+    parser.add_argument('--signed', action='store_true', help="The sample is signed (default unsigned)")
+    parser.add_argument('--ideal', help="Also write the ideal linear output to this WAV, for A/B comparison")
+    parser.add_argument('--step-db', type=float, help="DAC step between volumes in dB (default 3.0)")
+    parser.add_argument('--compression', type=float, default=DEFAULT_COMPRESSION,
+                        help=f"Mixing compression (default {DEFAULT_COMPRESSION})")
+    parser.add_argument('--curve', help="Measured curve: 16 channel levels or 4096 mixed outputs")
+    args = parser.parse_args(argv)
+
+    table = YmSampleTable.load(args.table, args.channels, args.layout)
+    levels = dac_levels(args.step_db) if args.step_db else None
+    curve = load_curve(args.curve) if args.curve else None
+    result = render_file(args.sample, table, args.output, args.rate, args.signed, args.ideal, levels,
+                         args.compression, curve)
+    print(f"{args.output}: SNR {result.snr_db:.1f} dB, RMS error {result.rms_error:.2f}, "
+          f"max error {result.max_error:.2f} (8-bit steps), rendered in {result.seconds:.3f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
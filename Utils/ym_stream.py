@@ -0,0 +1,435 @@
+"""
+YM register streams: the per-VBL register dumps that music is replayed from.
+
+A stream holds the 14 sound registers (16 in YM5/YM6 files, the last two
+being effect data) for every frame. Dumps come in two orders:
+
+    non-interleaved   frame by frame, 14 bytes per frame
+    interleaved       register by register, all frames of register 0 first,
+                      as YM files store them because it packs far better
+
+RegisterStream loads either (or an uncompressed YM2/YM3/YM5/YM6 file), and
+reports per-register statistics and change maps over all frames at once.
+
+Two packed formats are made for a VBL player that depacks one frame at a time
+into a 14 byte register shadow:
+
+    mask    each frame is a word holding which registers changed, then the new
+            values; a word with bit 15 set is a run of that many unchanged
+            frames. Register 13 (envelope shape) restarts the envelope when
+            written, so as in YM files 0xFF means it is not written: it is
+            stored whenever it is not 0xFF, and the depacker sets it to 0xFF
+            otherwise.
+    rle     each register is a stream of (frames, value) byte pairs, with
+            a counter per register; a frame costs the same 14 counter
+            decrements however much changes.
+
+Both formats start with a header of the frame count, register count and
+format; rle follows it with a word offset from the start of the data to each
+register's stream. The depack cost of each frame is counted from the 68000
+routines in DEPACK_SOURCE with the ST cycle table, so a tune's packed size
+can be weighed against its worst and average cycles per VBL.
+
+Usage:
+    python ym_stream.py tune.ym
+    python ym_stream.py tune.dmp --registers 14 --interleaved --pack tune.ymp --format rle
+    python ym_stream.py tune.ym --benchmark
+    python ym_stream.py --asm mask
+"""
+import argparse
+import struct
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from ym_table import REGISTER_DESCRIPTIONS
+
+STREAM_REGISTERS = 14
+ENVELOPE_SHAPE = 13
+
+# Register 13 value that means "not written this frame"
+NO_WRITE = 0xFF
+
+DEFAULT_RATE = 50
+
+FORMATS = ('mask', 'rle')
+FORMAT_NUMBERS = {name: number for number, name in enumerate(FORMATS)}
+
+# frames, registers, format
+PACK_HEADER = struct.Struct('>IBBxx')
+
+# Longest run a mask word or an rle pair can hold
+MAX_MASK_RUN = 0x7FFF
+MAX_RLE_RUN = 0xFF
+
+_YM_HEADER = struct.Struct('>IIHIHIH')
+
+RegisterStats = namedtuple('RegisterStats', ['register', 'minimum', 'maximum', 'distinct', 'changes',
+                                             'change_rate', 'longest_hold'])
+PackCost = namedtuple('PackCost', ['format', 'bytes', 'ratio', 'mean_cycles', 'worst_cycles', 'vbl_percent'])
+
+
+class RegisterStream:
+    """Register values per frame, shape (frames, registers) of uint8."""
+
+    def __init__(self, frames, rate=DEFAULT_RATE, loop=0):
+        self.frames = frames
+        self.rate = rate
+        self.loop = loop
+
+    @classmethod
+    def from_bytes(cls, data, registers=STREAM_REGISTERS, interleaved=False, rate=DEFAULT_RATE):
+        """Parse a raw dump; any trailing partial frame is ignored."""
+        count = len(data) // registers
+        values = np.frombuffer(data, dtype=np.uint8, count=count * registers)
+        if interleaved:
+            return cls(np.ascontiguousarray(values.reshape(registers, count).T), rate)
+        return cls(values.reshape(count, registers).copy(), rate)
+
+    @classmethod
+    def from_ym(cls, data):
+        """Parse an uncompressed YM2, YM3, YM3b, YM5 or YM6 file."""
+        if data[2:5] == b'-lh':
+            raise ValueError("The YM file is LHA-compressed; extract it with lha first")
+        tag = data[:4]
+        if tag in (b'YM2!', b'YM3!'):
+            return cls.from_bytes(data[4:], STREAM_REGISTERS, interleaved=True)
+        if tag == b'YM3b':
+            stream = cls.from_bytes(data[4:-4], STREAM_REGISTERS, interleaved=True)
+            stream.loop = struct.unpack('<I', data[-4:])[0]
+            return stream
+        if tag not in (b'YM5!', b'YM6!') or data[4:12] != b'LeOnArD!':
+            raise ValueError(f"Unknown YM file type {tag!r}, expected one of YM2!, YM3!, YM3b, YM5!, YM6!")
+        count, attributes, drums, _, rate, loop, skip = _YM_HEADER.unpack_from(data, 12)
+        position = 12 + _YM_HEADER.size + skip
+        for _ in range(drums):
+            position += 4 + struct.unpack_from('>I', data, position)[0]
+        # Song name, author and comment
+        for _ in range(3):
+            position = data.index(b'\0', position) + 1
+        stream = cls.from_bytes(data[position:position + count * 16], 16, bool(attributes & 1), rate)
+        stream.loop = loop
+        return stream
+
+    @classmethod
+    def load(cls, path, registers=STREAM_REGISTERS, interleaved=False):
+        """Load a YM file, detected from its header, or a raw dump."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:2] == b'YM' or data[2:5] == b'-lh':
+            return cls.from_ym(data)
+        return cls.from_bytes(data, registers, interleaved)
+
+    def to_bytes(self, interleaved=False):
+        return (self.frames.T if interleaved else self.frames).tobytes()
+
+    @property
+    def registers(self):
+        return self.frames.shape[1]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def change_map(self):
+        """(frames, registers) bool: whether each register differs from the frame before; all of frame 0."""
+        changed = np.ones(self.frames.shape, dtype=bool)
+        changed[1:] = self.frames[1:] != self.frames[:-1]
+        return changed
+
+    def write_map(self):
+        """
+        (frames, registers) bool: whether the player writes each register, which is
+        when it changes, and for the envelope shape whenever it is not NO_WRITE.
+        """
+        written = self.change_map()
+        if self.registers > ENVELOPE_SHAPE:
+            written[:, ENVELOPE_SHAPE] = self.frames[:, ENVELOPE_SHAPE] != NO_WRITE
+        return written
+
+    def stats(self):
+        """RegisterStats for each register."""
+        count, registers = self.frames.shape
+        changed = self.change_map()
+        columns = np.arange(registers)
+        seen = np.bincount((columns * 256 + self.frames).ravel(), minlength=registers * 256)
+        distinct = (seen.reshape(registers, 256) > 0).sum(axis=1)
+        # Frames of each hold, keyed by register and hold number
+        holds = np.cumsum(changed, axis=0) + columns * (count + 1)
+        longest = np.bincount(holds.ravel(), minlength=registers * (count + 1)).reshape(registers, -1).max(axis=1)
+        changes = changed[1:].sum(axis=0)
+        return [
+            RegisterStats(register, int(self.frames[:, register].min()), int(self.frames[:, register].max()),
+                          int(distinct[register]), int(changes[register]),
+                          float(changes[register] / max(1, count - 1)), int(longest[register]))
+            for register in range(registers)
+        ] if count else []
+
+
+def _exclusive_cumsum(values):
+    offsets = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(values[:-1], out=offsets[1:])
+    return offsets
+
+
+def _mask_tokens(stream):
+    """The token word of each frame, 0 where a run token covers it, and the write map."""
+    written = stream.write_map()
+    masks = (written * (1 << np.arange(stream.registers))).sum(axis=1).astype(np.uint32)
+    unchanged = masks == 0
+    index = np.arange(len(masks))
+    # Position in each run of unchanged frames, and the frame that ends it
+    previous = np.maximum.accumulate(np.where(unchanged, -1, index))
+    position = index - previous - 1
+    following = np.minimum.accumulate(np.where(unchanged, len(masks), index)[::-1])[::-1]
+    starts = unchanged & (position % MAX_MASK_RUN == 0)
+    runs = np.minimum(following - index, MAX_MASK_RUN)
+    tokens = np.where(unchanged, np.where(starts, 0x8000 | runs, 0), masks)
+    return tokens, written
+
+
+def pack_mask(stream):
+    """Pack in the mask format: a change mask word and the changed values per frame."""
+    if stream.registers > 15:
+        raise ValueError(f"The mask format holds at most 15 registers, got {stream.registers}")
+    tokens, written = _mask_tokens(stream)
+    present = tokens != 0
+    counts = written.sum(axis=1)
+    sizes = 2 * present + counts
+    offsets = _exclusive_cumsum(sizes) + PACK_HEADER.size
+    data = np.zeros(PACK_HEADER.size + int(sizes.sum()), dtype=np.uint8)
+    data[:PACK_HEADER.size] = np.frombuffer(PACK_HEADER.pack(len(stream), stream.registers, FORMAT_NUMBERS['mask']),
+                                            dtype=np.uint8)
+    data[offsets[present]] = tokens[present] >> 8
+    data[offsets[present] + 1] = tokens[present] & 0xFF
+    # Values follow their frame's word in register order, which is the order frames[written] takes them
+    within = np.arange(int(counts.sum())) - np.repeat(_exclusive_cumsum(counts), counts)
+    data[np.repeat(offsets + 2, counts) + within] = stream.frames[written]
+    return data.tobytes()
+
+
+def pack_rle(stream):
+    """Pack in the rle format: (frames, value) pairs per register."""
+    count, registers = stream.frames.shape
+    changed = stream.change_map()
+    index = np.arange(count)
+    streams = []
+    for register in range(registers):
+        starts = index[changed[:, register]]
+        # Split holds longer than a count byte allows
+        lengths = np.diff(np.append(starts, count))
+        pieces = -(-lengths // MAX_RLE_RUN)
+        split = np.repeat(starts, pieces) + MAX_RLE_RUN * (np.arange(pieces.sum()) - np.repeat(_exclusive_cumsum(pieces), pieces))
+        pairs = np.empty((len(split), 2), dtype=np.uint8)
+        pairs[:, 0] = np.diff(np.append(split, count))
+        pairs[:, 1] = stream.frames[split, register]
+        streams.append(pairs.tobytes())
+    header = PACK_HEADER.pack(count, registers, FORMAT_NUMBERS['rle'])
+    offsets = PACK_HEADER.size + 2 * registers + _exclusive_cumsum(np.array([len(data) for data in streams]))
+    if registers and offsets[-1] > 0xFFFF:
+        raise ValueError("The packed streams are too large for word offsets")
+    return header + offsets.astype('>u2').tobytes() + b''.join(streams)
+
+
+def pack(stream, format='mask'):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}', expected one of {', '.join(FORMATS)}")
+    return pack_mask(stream) if format == 'mask' else pack_rle(stream)
+
+
+def unpack(data):
+    """Unpack either format back to a RegisterStream."""
+    count, registers, number = PACK_HEADER.unpack_from(data)
+    if number >= len(FORMATS):
+        raise ValueError(f"Unknown packed format {number}")
+    frames = np.zeros((count, registers), dtype=np.uint8)
+    if FORMATS[number] == 'rle':
+        offsets = np.frombuffer(data, dtype='>u2', count=registers, offset=PACK_HEADER.size)
+        ends = list(offsets[1:]) + [len(data)]
+        for register, (start, end) in enumerate(zip(offsets, ends)):
+            pairs = np.frombuffer(data[start:end], dtype=np.uint8).reshape(-1, 2)
+            frames[:, register] = np.repeat(pairs[:, 1], pairs[:, 0])
+        return RegisterStream(frames)
+
+    # Walk the tokens to place the values, then carry each register forward
+    written = np.zeros((count, registers), dtype=bool)
+    position = PACK_HEADER.size
+    frame = 0
+    while frame < count:
+        token = data[position] << 8 | data[position + 1]
+        position += 2
+        if token & 0x8000:
+            frame += token & 0x7FFF
+            continue
+        for register in range(registers):
+            if token >> register & 1:
+                frames[frame, register] = data[position]
+                written[frame, register] = True
+                position += 1
+        frame += 1
+    carried = written.copy()
+    if registers > ENVELOPE_SHAPE:
+        carried[:, ENVELOPE_SHAPE] = True
+        frames[:, ENVELOPE_SHAPE] = np.where(written[:, ENVELOPE_SHAPE], frames[:, ENVELOPE_SHAPE], NO_WRITE)
+    last = np.maximum.accumulate(np.where(carried, np.arange(count)[:, None], 0), axis=0)
+    return RegisterStream(np.take_along_axis(frames, last, axis=0))
+
+
+# 68000 depack routines, called once per VBL to update the register shadow.
+# The section labels are what depack_cycles times.
+DEPACK_SOURCE = {
+    'mask': """\
+; a0 = packed frames (after the header), a1 = register shadow,
+; d6.w = unchanged frames left in the current run, 0 to start
+ym_depack_mask:
+        st      13(a1)              ; envelope shape not written unless the mask says so
+        tst.w   d6
+        bne.s   .hold
+.frame: move.b  (a0)+,d0
+        bmi.s   .run
+.mask:  lsl.w   #8,d0
+        move.b  (a0)+,d0            ; change mask, register 0 in bit 0
+        move.l  a1,a2
+.reg:   lsr.w   #1,d0
+        bcc.s   .same
+.write: move.b  (a0)+,(a2)
+.same:  addq.w  #1,a2
+        tst.w   d0
+        bne.s   .reg
+.done:  rts
+.run:   and.w   #$7f,d0
+        lsl.w   #8,d0
+        move.b  (a0)+,d0
+        subq.w  #1,d0               ; this frame is the first of the run
+        move.w  d0,d6
+        rts
+.hold:  subq.w  #1,d6
+        rts
+""",
+    'rle': """\
+; a1 = register shadow, a3 = stream pointer per register (longs),
+; a4 = frames left per register (bytes, 1 to start); all reloaded every VBL
+ym_depack_rle:
+        moveq   #13,d7
+.reg:   subq.b  #1,(a4)+
+        bne.s   .hold
+.next:  move.l  (a3),a0
+        move.b  (a0)+,-1(a4)        ; frames this value holds for
+        move.b  (a0)+,(a1)
+        move.l  a0,(a3)
+.hold:  addq.w  #1,a1
+        addq.w  #4,a3
+        dbra    d7,.reg
+.done:  rts
+""",
+}
+
+
+def _section_cycles(format, machine='ST'):
+    """{label: (taken, not_taken)} cycles of each labelled section of a depack routine."""
+    from cycle_annotate import annotate
+    lines, _, _ = annotate(DEPACK_SOURCE[format].splitlines(), machine=machine)
+    sections = {}
+    name = None
+    for line in lines:
+        if line.label:
+            name = line.label
+            sections[name] = [0, 0]
+        if line.unknown:
+            raise ValueError(f"No timing for '{line.instruction}' in the {format} depacker")
+        if line.timing is not None:
+            # A section's branch is its last instruction; everything before it costs the same either way
+            not_taken = line.timing.not_taken if line.timing.not_taken is not None else line.timing.cycles
+            sections[name][0] += line.timing.cycles
+            sections[name][1] += not_taken
+    return {name: tuple(cycles) for name, cycles in sections.items()}
+
+
+def depack_cycles(stream, format='mask', machine='ST'):
+    """Cycles the depacker takes on each frame, from the stream's changes and the routine's timing."""
+    s = _section_cycles(format, machine)
+    taken, not_taken = 0, 1
+    if format == 'rle':
+        changed = stream.change_map()
+        # Values that hold for longer than a count byte reload the same value
+        index = np.arange(len(stream))[:, None]
+        hold = index - np.maximum.accumulate(np.where(changed, index, 0), axis=0)
+        starts = (changed | (hold % MAX_RLE_RUN == 0)).sum(axis=1)
+        registers = stream.registers
+        return (s['ym_depack_rle'][taken] + registers * s['.hold'][taken] - s['.hold'][taken] + s['.hold'][not_taken]
+                + (registers - starts) * s['.reg'][taken] + starts * (s['.reg'][not_taken] + s['.next'][taken])
+                + s['.done'][taken])
+
+    tokens, written = _mask_tokens(stream)
+    entry = s['ym_depack_mask']
+    hold = entry[taken] + s['.hold'][taken]
+    run = entry[not_taken] + s['.frame'][taken] + s['.run'][taken]
+    # Registers tested: up to the highest that changed
+    tested = np.where(written.any(axis=1), stream.registers - np.argmax(written[:, ::-1], axis=1), 0)
+    count = written.sum(axis=1)
+    frame = (entry[not_taken] + s['.frame'][not_taken] + s['.mask'][taken]
+             + (tested - count) * s['.reg'][taken] + count * (s['.reg'][not_taken] + s['.write'][taken])
+             + (tested - 1) * s['.same'][taken] + s['.same'][not_taken] + s['.done'][taken])
+    return np.where(tokens == 0, hold, np.where(tokens & 0x8000, run, frame))
+
+
+def benchmark(stream, machine='ST'):
+    """PackCost of each format against the raw non-interleaved dump."""
+    from st_timing import VBL_CYCLES
+    budget = VBL_CYCLES.get(stream.rate, VBL_CYCLES[50])
+    results = []
+    for format in FORMATS:
+        data = pack(stream, format)
+        cycles = depack_cycles(stream, format, machine)
+        results.append(PackCost(format, len(data), stream.frames.size / len(data), float(cycles.mean()),
+                                int(cycles.max()), float(100.0 * cycles.max() / budget)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse and pack YM register streams.")
+    parser.add_argument('source', nargs='?', help="YM file or raw register dump")
+    parser.add_argument('--registers', type=int, default=STREAM_REGISTERS,
+                        help=f"Registers per frame in a raw dump (default {STREAM_REGISTERS})")
+    parser.add_argument('--interleaved', action='store_true', help="The raw dump is stored register by register")
+    parser.add_argument('--pack', help="Write the packed stream to this file")
+    parser.add_argument('--format', choices=FORMATS, default='mask', help="Packed format (default mask)")
+    parser.add_argument('--benchmark', action='store_true', help="Compare the size and depack cost of every format")
+    parser.add_argument('--machine', choices=('68000', 'ST', 'STE'), default='ST', help="Timing model (default ST)")
+    parser.add_argument('--asm', choices=FORMATS, help="Print a format's 68000 depack routine")
+    args = parser.parse_args(argv)
+
+    if args.asm:
+        print(DEPACK_SOURCE[args.asm])
+        return 0
+    if not args.source:
+        parser.error("A source file is needed unless --asm is given")
+
+    stream = RegisterStream.load(args.source, args.registers, args.interleaved)
+    stream.frames = stream.frames[:, :min(stream.registers, STREAM_REGISTERS)]
+    print(f"{args.source}: {len(stream)} frames at {stream.rate} Hz, {stream.frames.size} bytes")
+    print(f"{'Reg':>3} {'Name':<24} {'Min':>4} {'Max':>4} {'Values':>6} {'Changes':>8} {'Rate':>6} {'Hold':>6}")
+    for stats in stream.stats():
+        print(f"{stats.register:>3} {REGISTER_DESCRIPTIONS.get(stats.register, 'Unknown'):<24} "
+              f"{stats.minimum:>4} {stats.maximum:>4} {stats.distinct:>6} {stats.changes:>8} "
+              f"{stats.change_rate:>6.1%} {stats.longest_hold:>6}")
+
+    if args.benchmark:
+        print()
+        print(f"{'Format':<6} {'Bytes':>8} {'Ratio':>6} {'Mean cycles':>12} {'Worst':>7} {'VBL %':>6}")
+        for cost in benchmark(stream, args.machine):
+            print(f"{cost.format:<6} {cost.bytes:>8} {cost.ratio:>6.2f} {cost.mean_cycles:>12.0f} "
+                  f"{cost.worst_cycles:>7} {cost.vbl_percent:>6.2f}")
+
+    if args.pack:
+        data = pack(stream, args.format)
+        if not np.array_equal(unpack(data).frames, stream.frames):
+            raise RuntimeError("The packed stream does not unpack to the original")
+        with open(args.pack, 'wb') as f:
+            f.write(data)
+        print(f"{args.pack}: {len(data)} bytes, ratio {stream.frames.size / len(data):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+YM2149 sample-out tables as NumPy structured arrays.
+
+A sample-out table has one entry per 8-bit sample value (256 entries), each
+giving the YM register writes that play that sample: a register number and a
+value per channel. Three binary layouts are in use:
+
+    1 byte per channel    value only; channel n writes register 8 + n
+    2 bytes per channel   register byte, value byte
+    4 bytes per channel   register word, value word (the high byte of each
+                          is used, so the words can be moved straight into
+                          the YM's select and write registers)
+
+Entries may be padded beyond the channels they hold; 3-channel tables are
+saved with a fourth, empty slot in every layout so each entry is a power of
+two in size, and are recognised when loaded either padded or not.
+
+YmSampleTable parses any layout with one np.frombuffer, using a dtype whose
+itemsize is the entry stride, and serializes with one tobytes, so tables load
+and save without a Python loop over the entries.
+
+Usage:
+    python ym_table.py table.tab --channels 3
+    python ym_table.py table.tab --channels 2 --convert 4 --output table4.tab
+"""
+import argparse
+import sys
+
+import numpy as np
+
+ENTRIES = 256
+YM_REGISTERS = 16
+
+# Register numbers of the three channel volumes
+VOLUME_REGISTERS = (8, 9, 10)
+
+# Mapping of register numbers to descriptions
+REGISTER_DESCRIPTIONS = {
+    0: 'Channel A Fine Tune',
+    1: 'Channel A Coarse Tune',
+    2: 'Channel B Fine Tune',
+    3: 'Channel B Coarse Tune',
+    4: 'Channel C Fine Tune',
+    5: 'Channel C Coarse Tune',
+    6: 'Noise Period',
+    7: 'Mixer Control',
+    8: 'Channel A Volume',
+    9: 'Channel B Volume',
+    10: 'Channel C Volume',
+    11: 'Envelope Period Fine',
+    12: 'Envelope Period Coarse',
+    13: 'Envelope Shape/Cycle',
+    14: 'I/O Port A',
+    15: 'I/O Port B',
+}
+
+BYTES_PER_CHANNEL = (1, 2, 4)
+
+# A register write, as the model holds it
+WRITE_DTYPE = np.dtype([('register', 'u1'), ('value', 'u1')])
+
+# One channel as stored in each layout
+_CHANNEL_DTYPES = {
+    1: np.dtype([('value', 'u1')]),
+    2: np.dtype([('register', 'u1'), ('value', 'u1')]),
+    4: np.dtype([('register', '>u2'), ('value', '>u2')]),
+}
+
+
+def entry_dtype(channels, bytes_per_channel, stride=None):
+    """Structured dtype of one stored entry: fields c0, c1... at their offsets, padded to stride bytes."""
+    if bytes_per_channel not in BYTES_PER_CHANNEL:
+        raise ValueError(f"Unsupported layout of {bytes_per_channel} bytes per channel, "
+                         f"expected one of {', '.join(map(str, BYTES_PER_CHANNEL))}")
+    channel = _CHANNEL_DTYPES[bytes_per_channel]
+    stride = stride or channels * channel.itemsize
+    return np.dtype({
+        'names': [f'c{n}' for n in range(channels)],
+        'formats': [channel] * channels,
+        'offsets': [n * channel.itemsize for n in range(channels)],
+        'itemsize': stride,
+    })
+
+
+def saved_slots(channels):
+    """Channels stored per entry: 3-channel tables are padded to 4."""
+    return 4 if channels == 3 else channels
+
+
+def detect_layout(size, channels, entries=ENTRIES):
+    """
+    (bytes_per_channel, stride) for a file of `size` bytes. Entries of exactly
+    channels or saved_slots(channels) slots in any layout are recognised;
+    other strides are guessed as the table viewer always has.
+    """
+    stride = size // entries
+    if stride < channels:
+        raise ValueError(f"Table is truncated: {size} bytes cannot hold {entries} entries of {channels} channels")
+    for bytes_per_channel in BYTES_PER_CHANNEL:
+        if stride in (channels * bytes_per_channel, saved_slots(channels) * bytes_per_channel):
+            return bytes_per_channel, stride
+    if stride > channels:
+        return 2, stride
+    return 1, stride
+
+
+class YmSampleTable:
+    """Register writes per sample value, shape (entries, channels) of WRITE_DTYPE."""
+
+    def __init__(self, writes):
+        self.writes = writes
+
+    @classmethod
+    def empty(cls, channels, entries=ENTRIES):
+        writes = np.zeros((entries, channels), dtype=WRITE_DTYPE)
+        writes['register'] = np.array(VOLUME_REGISTERS[:channels] if channels <= 3 else range(channels))
+        return cls(writes)
+
+    @classmethod
+    def from_bytes(cls, data, channels, bytes_per_channel=None, entries=ENTRIES):
+        """Parse a binary table; the layout is detected from its size unless given."""
+        detected, stride = detect_layout(len(data), channels, entries)
+        bytes_per_channel = bytes_per_channel or detected
+        if stride < channels * bytes_per_channel:
+            raise ValueError(f"Table is truncated: {len(data)} bytes cannot hold {entries} entries of "
+                             f"{channels} channels at {bytes_per_channel} bytes per channel")
+        stored = np.frombuffer(data, dtype=entry_dtype(channels, bytes_per_channel, stride), count=entries)
+        writes = np.empty((entries, channels), dtype=WRITE_DTYPE)
+        for n in range(channels):
+            field = stored[f'c{n}']
+            if bytes_per_channel == 1:
+                writes['register'][:, n] = 8 + n
+                writes['value'][:, n] = field['value']
+            elif bytes_per_channel == 2:
+                writes['register'][:, n] = field['register'] & 0x0F
+                writes['value'][:, n] = field['value']
+            else:
+                writes['register'][:, n] = (field['register'] >> 8) & 0x0F
+                writes['value'][:, n] = field['value'] >> 8
+        return cls(writes)
+
+    @classmethod
+    def load(cls, path, channels, bytes_per_channel=None):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read(), channels, bytes_per_channel)
+
+    def to_bytes(self, bytes_per_channel=2, slots=None):
+        """Serialize in a layout; slots beyond the table's channels are written as zeros."""
+        slots = slots or saved_slots(self.channels)
+        stored = np.zeros(len(self.writes), dtype=entry_dtype(slots, bytes_per_channel))
+        for n in range(self.channels):
+            field = stored[f'c{n}']
+            if bytes_per_channel == 1:
+                field['value'] = self.writes['value'][:, n]
+            elif bytes_per_channel == 2:
+                field['register'] = self.writes['register'][:, n]
+                field['value'] = self.writes['value'][:, n]
+            else:
+                field['register'] = self.writes['register'][:, n].astype(np.uint16) << 8
+                field['value'] = self.writes['value'][:, n].astype(np.uint16) << 8
+        return stored.tobytes()
+
+    def save(self, path, bytes_per_channel=2, slots=None):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes(bytes_per_channel, slots))
+
+    @classmethod
+    def from_text(cls, text):
+        """Parse the viewer's text format: index, then register (decimal) and value (hex) per channel."""
+        lines = [line.strip() for line in text.splitlines()[1:] if line.strip()]
+        if not lines:
+            return cls(np.zeros((0, 0), dtype=WRITE_DTYPE))
+        channels = (len(lines[0].split(',')) - 1) // 2
+        fields = np.array([line.split(',') for line in lines if len(line.split(',')) == channels * 2 + 1])
+        writes = np.empty((len(fields), channels), dtype=WRITE_DTYPE)
+        writes['register'] = fields[:, 1::2].astype(np.uint8)
+        writes['value'] = np.vectorize(lambda value: int(value, 16), otypes=[np.uint8])(fields[:, 2::2])
+        return cls(writes)
+
+    def to_text(self):
+        header = ['index'] + [name for n in range(self.channels) for name in (f'reg{n + 1}', f'val{n + 1}')]
+        lines = [','.join(header)]
+        for index, row in enumerate(self.writes):
+            fields = [str(index)]
+            for register, value in row.tolist():
+                fields.extend([str(register), f"{value:02X}"])
+            lines.append(','.join(fields))
+        return '\n'.join(lines) + '\n'
+
+    @property
+    def channels(self):
+        return self.writes.shape[1]
+
+    def __len__(self):
+        return len(self.writes)
+
+    def scaled(self, factor):
+        """The table with entry i taken from entry int(i * factor), for 0 < factor <= 1."""
+        if factor <= 0 or factor > 1:
+            raise ValueError("Scale factor must be between 0 and 1")
+        indices = (np.arange(len(self.writes)) * factor).astype(np.intp)
+        return YmSampleTable(self.writes[indices])
+
+    def register_values(self):
+        """
+        (entries, 16) float array of the value each entry writes to each register,
+        NaN where it does not write it. A later channel overrides an earlier one.
+        """
+        values = np.full((len(self.writes), YM_REGISTERS), np.nan)
+        rows = np.repeat(np.arange(len(self.writes)), self.channels)
+        values[rows, self.writes['register'].reshape(-1) & 0x0F] = self.writes['value'].reshape(-1)
+        return values
+
+    def register_timelines(self):
+        """
+        (entries, 16) float array of each register's value after each entry, as the
+        chip holds it: carried forward from the last entry that wrote it, NaN before
+        the first write.
+        """
+        values = self.register_values()
+        written = ~np.isnan(values)
+        last = np.maximum.accumulate(np.where(written, np.arange(len(values))[:, None], 0), axis=0)
+        return np.take_along_axis(values, last, axis=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or convert a YM sample-out table.")
+    parser.add_argument('table', help="Binary table (.TAB/.DAT/.BIN)")
+    parser.add_argument('--channels', type=int, default=2, help="Channels per entry (default 2)")
+    parser.add_argument('--layout', type=int, choices=BYTES_PER_CHANNEL, help="Bytes per channel (default detect)")
+    parser.add_argument('--convert', type=int, choices=BYTES_PER_CHANNEL, help="Write in this layout to --output")
+    parser.add_argument('--output', help="Output file for --convert, or text when it ends in .txt")
+    args = parser.parse_args(argv)
+
+    table = YmSampleTable.load(args.table, args.channels, args.layout)
+    if args.output and args.output.lower().endswith('.txt'):
+        with open(args.output, 'w') as f:
+            f.write(table.to_text())
+    elif args.output:
+        table.save(args.output, args.convert or 2)
+    else:
+        for register in np.unique(table.writes['register']):
+            values = table.writes['value'][table.writes['register'] == register]
+            print(f"Register {register:2} ({REGISTER_DESCRIPTIONS.get(int(register), 'Unknown')}): "
+                  f"{len(values)} writes, values {values.min()}..{values.max()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Optimal YM2149 sample-out tables from a model of the chip's volume DAC.
+
+Playing samples through the YM sets the volumes of up to three channels per
+sample, and the table maps each 8-bit sample value to the volume combination
+whose mixed output is closest to it. The output model is:
+
+    DAC         each 4-bit volume is a logarithmic level, step_db apart
+                (about 3 dB: each fixed volume is every other step of the
+                32-step envelope DAC), or a measured curve of 16 levels
+    mixing      the channels share one output resistor, so the sum is
+                compressed as it rises: mixed = sum / (1 + compression * sum),
+                normalized to 1.0 at full volume on every channel
+
+A measured curve can instead give all 4096 mixed outputs (16 x 16 x 16, in
+a, b, c order), which replaces both parts of the model.
+
+Every combination is evaluated at once and each of the 256 sample levels is
+matched against all of them. With monotonic=True the entries are chosen by a
+dynamic programme over the combinations sorted by output, so the table's output
+never falls as the sample rises; the programme is one prefix minimum per entry.
+The error metric is 'rms' (sum of squared errors) or 'max' (largest error).
+
+Usage:
+    python ym_volume.py ym3.tab
+    python ym_volume.py ym3.tab --metric max --monotonic --layout 4
+    python ym_volume.py ym2.tab --channels 2 --curve measured.txt
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from ym_table import ENTRIES, VOLUME_REGISTERS, BYTES_PER_CHANNEL, WRITE_DTYPE, YmSampleTable
+
+LEVELS = 16
+DEFAULT_STEP_DB = 3.0
+
+# Rough compression of the shared output resistor; measure a curve for accuracy
+DEFAULT_COMPRESSION = 0.3
+
+METRICS = ('rms', 'max')
+
+TableReport = namedtuple('TableReport', ['max_error', 'rms_error', 'monotonic', 'inversions', 'distinct'])
+
+
+def dac_levels(step_db=DEFAULT_STEP_DB):
+    """Output of one channel at each volume, 0.0 to 1.0, for a logarithmic DAC; volume 0 is silent."""
+    levels = 10.0 ** (-(LEVELS - 1 - np.arange(LEVELS)) * step_db / 20.0)
+    levels[0] = 0.0
+    return levels
+
+
+def load_curve(path):
+    """
+    A measured curve: whitespace or comma separated numbers, either 16 channel
+    levels or 4096 mixed outputs. Returned as given; it is normalized when used.
+    """
+    with open(path) as f:
+        values = np.array([float(value) for value in f.read().replace(',', ' ').split()])
+    if len(values) not in (LEVELS, LEVELS ** 3):
+        raise ValueError(f"A curve needs {LEVELS} levels or {LEVELS ** 3} mixed outputs, got {len(values)}")
+    return values
+
+
+def mixed_outputs(channels=3, levels=None, compression=DEFAULT_COMPRESSION, curve=None):
+    """
+    Output of every volume combination, shape (16,) * channels, normalized to
+    0.0..1.0. curve, if given, is a measured curve from load_curve.
+    """
+    if curve is not None and len(curve) == LEVELS ** 3:
+        if channels != 3:
+            raise ValueError("A measured curve of mixed outputs only describes 3-channel tables")
+        outputs = np.asarray(curve, dtype=np.float64).reshape(LEVELS, LEVELS, LEVELS)
+    else:
+        if curve is not None:
+            levels = np.asarray(curve, dtype=np.float64)
+        elif levels is None:
+            levels = dac_levels()
+        levels = (levels - levels.min()) / (levels.max() - levels.min())
+        total = np.zeros((LEVELS,) * channels)
+        for axis in range(channels):
+            shape = [1] * channels
+            shape[axis] = LEVELS
+            total = total + levels.reshape(shape)
+        outputs = total / (1.0 + compression * total)
+    return (outputs - outputs.min()) / (outputs.max() - outputs.min())
+
+
+def _error(targets, outputs, metric):
+    difference = targets - outputs
+    return np.abs(difference) if metric == 'max' else difference * difference
+
+
+def _choose_nearest(targets, sorted_outputs):
+    """Index of the nearest sorted output to each target, the first of any equal outputs."""
+    above = np.searchsorted(sorted_outputs, targets).clip(1, len(sorted_outputs) - 1)
+    below = above - 1
+    nearer = np.where(targets - sorted_outputs[below] <= sorted_outputs[above] - targets, below, above)
+    return np.searchsorted(sorted_outputs, sorted_outputs[nearer])
+
+
+def _choose_monotonic(targets, sorted_outputs, metric):
+    """
+    For each row of targets (tables, entries), the cheapest choice of sorted
+    outputs that never moves to a lower one. All tables advance together, one
+    entry at a time, with the errors for that entry computed as they are needed.
+    """
+    tables, entries = targets.shape
+    columns = np.arange(len(sorted_outputs))
+    cost = _error(targets[:, :1], sorted_outputs, metric)
+    choices = np.empty((tables, entries, len(sorted_outputs)), dtype=np.uint16)
+    for entry in range(1, entries):
+        # Best predecessor at or below each output
+        best = np.minimum.accumulate(cost, axis=1)
+        changed = np.concatenate((np.ones((tables, 1), dtype=bool), best[:, 1:] < best[:, :-1]), axis=1)
+        choices[:, entry] = np.maximum.accumulate(np.where(changed, columns, 0), axis=1)
+        error = _error(targets[:, entry:entry + 1], sorted_outputs, metric)
+        cost = np.maximum(best, error) if metric == 'max' else best + error
+    path = np.empty((tables, entries), dtype=np.intp)
+    path[:, -1] = cost.argmin(axis=1)
+    rows = np.arange(tables)
+    for entry in range(entries - 1, 0, -1):
+        path[:, entry - 1] = choices[rows, entry, path[:, entry]]
+    return path
+
+
+def optimize_family(gains, channels=3, metric='rms', monotonic=False, levels=None,
+                    compression=DEFAULT_COMPRESSION, curve=None, entries=ENTRIES):
+    """
+    One table per gain, each best matching `entries` evenly spaced levels from
+    silence to that share of full output, all chosen in one pass. Returns the
+    writes, shape (tables, entries, channels), and the modelled output of each
+    entry, shape (tables, entries).
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {', '.join(METRICS)}")
+    if not 1 <= channels <= 3:
+        raise ValueError(f"A YM table uses 1 to 3 channels, got {channels}")
+    outputs = mixed_outputs(channels, levels, compression, curve).reshape(-1)
+    # Among combinations with the same output, the stable sort keeps the lowest volumes first
+    order = np.argsort(outputs, kind='stable')
+    sorted_outputs = outputs[order]
+    targets = np.asarray(gains, dtype=np.float64)[:, None] * np.linspace(0.0, 1.0, entries)
+
+    if monotonic:
+        chosen = _choose_monotonic(targets, sorted_outputs, metric)
+    else:
+        # Without the ordering constraint both metrics pick the nearest output
+        chosen = _choose_nearest(targets, sorted_outputs)
+
+    combinations = np.stack(np.unravel_index(order[chosen], (LEVELS,) * channels), axis=-1)
+    writes = np.empty(targets.shape + (channels,), dtype=WRITE_DTYPE)
+    writes['register'] = np.array(VOLUME_REGISTERS[:channels], dtype=np.uint8)
+    writes['value'] = combinations
+    return writes, sorted_outputs[chosen]
+
+
+def optimize_table(channels=3, metric='rms', monotonic=False, gain=1.0, levels=None,
+                   compression=DEFAULT_COMPRESSION, curve=None, entries=ENTRIES):
+    """
+    The sample-out table whose outputs best match `entries` evenly spaced levels
+    from silence to `gain` of full output. Returns (YmSampleTable, outputs), where
+    outputs is the modelled output of each entry.
+    """
+    writes, outputs = optimize_family([gain], channels, metric, monotonic, levels, compression, curve, entries)
+    return YmSampleTable(writes[0]), outputs[0]
+
+
+def table_outputs(table, levels=None, compression=DEFAULT_COMPRESSION, curve=None):
+    """Modelled output of each entry of an existing volume table, 0.0 to 1.0."""
+    outputs = mixed_outputs(table.channels, levels, compression, curve)
+    return outputs[tuple(table.writes['value'].T & 0x0F)]
+
+
+def report(outputs, gain=1.0):
+    """Errors in 8-bit steps against evenly spaced targets, and whether the outputs only ever rise."""
+    targets = np.linspace(0.0, gain, len(outputs))
+    error = (outputs - targets) * (len(outputs) - 1) / max(gain, 1e-9)
+    falls = np.diff(outputs) < 0
+    return TableReport(float(np.abs(error).max()), float(np.sqrt(np.mean(error * error))), not falls.any(),
+                       int(falls.sum()), len(np.unique(outputs)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate an optimal YM2149 sample-out volume table.")
+    parser.add_argument('output', help="Table to write (.TAB/.DAT/.BIN)")
+    parser.add_argument('--channels', type=int, choices=(1, 2, 3), default=3, help="Channels used (default 3)")
+    parser.add_argument('--metric', choices=METRICS, default='rms', help="Error to minimize (default rms)")
+    parser.add_argument('--monotonic', action='store_true', help="Never let the output fall as the sample rises")
+    parser.add_argument('--gain', type=float, default=1.0, help="Share of full output the top entry targets (default 1.0)")
+    parser.add_argument('--step-db', type=float, default=DEFAULT_STEP_DB,
+                        help=f"DAC step between volumes in dB (default {DEFAULT_STEP_DB})")
+    parser.add_argument('--compression', type=float, default=DEFAULT_COMPRESSION,
+                        help=f"Mixing compression (default {DEFAULT_COMPRESSION}, 0 for a linear sum)")
+    parser.add_argument('--curve', help="Measured curve: 16 channel levels or 4096 mixed outputs")
+    parser.add_argument('--layout', type=int, choices=BYTES_PER_CHANNEL, default=2,
+                        help="Bytes per channel in the written table (default 2)")
+    args = parser.parse_args(argv)
+
+    curve = load_curve(args.curve) if args.curve else None
+    table, outputs = optimize_table(args.channels, args.metric, args.monotonic, args.gain,
+                                    dac_levels(args.step_db), args.compression, curve)
+    table.save(args.output, args.layout)
+    result = report(outputs, args.gain)
+    print(f"{args.output}: max error {result.max_error:.2f}, RMS error {result.rms_error:.2f} (8-bit steps), "
+          f"{'monotonic' if result.monotonic else f'{result.inversions} inversions'}, "
+          f"{result.distinct} distinct levels")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())